@@ -1,33 +1,137 @@
+import os
+import time
 from typing import List, Dict, Any, Optional, Tuple
-from app.llm.groq_client import call_groq_chat
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_chroma import Chroma
-from app.tools.web_search import web_search
+from app.llm.groq_client import call_groq_chat, call_groq_chat_async
+from app.tools.web_search import web_search, web_search_async
+from app import metrics, tracing
+from app.concurrency import Lazy, run_blocking
+from app.agents.keywords import match_keywords
+from app.tools.answer_cache import SemanticAnswerCache, patient_scope, unit_vector
+from app.tools.context_builder import ContextBuilder, count_tokens
+from app.agents.prompt_prefix import Prefix, prefixes
+from app.tools.hybrid_retriever import BM25_FILENAME, BM25Index, CrossEncoderReranker, HybridRetriever, doc_key
+from app.tools.topics import diagnosis_topics
+from app.logging_setup import logger
 
 State = Dict[str, Any] #for storing the state of each act
-emb_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2") 
-vect_store = Chroma(     #retriving saved chromabd
-    embedding_function=emb_model,
-    persist_directory="chroma_db_v2/clinical-nephrology_db"
-)
+
+CHROMA_PERSIST_DIRECTORY = "chroma_db_v2/clinical-nephrology_db"
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid") # "hybrid" (vector + BM25) or "vector"
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "20")) # taken from each retriever before fusion
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.35")) # cosine similarity below which a chunk is not about the question
+RETRIEVAL_SCORE_GAP = float(os.getenv("RETRIEVAL_SCORE_GAP", "0.15")) # chunks this far below the best match are left out
+RETRIEVAL_KEYWORD_COVERAGE = float(os.getenv("RETRIEVAL_KEYWORD_COVERAGE", "0.6")) # keyword hits with this share of the question's IDF weight count as relevant without a vector match
+RETRIEVAL_MIN_K = int(os.getenv("RETRIEVAL_MIN_K", "2"))
+RETRIEVAL_MAX_K = int(os.getenv("RETRIEVAL_MAX_K", "6"))
+RETRIEVAL_TOPIC_MODE = os.getenv("RETRIEVAL_TOPIC_MODE", "boost") # use the patient's diagnosis: "boost" its chapters, "filter" to them, or "off"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "") # e.g. cross-encoder/ms-marco-MiniLM-L-6-v2, empty for no reranking
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))
+
+
+# the model, embedding service and chroma store are built on first use (or by the API's warm-up),
+# so importing this module stays cheap
+def _load_emb_model() -> Any:
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2") 
+
+
+def _load_embedder() -> Any:
+    from app.tools.embedding_service import EmbeddingService
+    return EmbeddingService( # memoised, micro-batched query embeddings shared by routing, retrieval and the answer cache
+        get_emb_model(),
+        cache_size=int(os.getenv("EMBED_CACHE_SIZE", "4096")),
+        batch_window_ms=float(os.getenv("EMBED_BATCH_WINDOW_MS", "2")),
+        max_batch_size=int(os.getenv("EMBED_MAX_BATCH", "32")),
+    )
+
+
+def _load_vect_store() -> Any:
+    from langchain_chroma import Chroma
+    return Chroma(     #retriving saved chromabd
+        embedding_function=get_embedder(),
+        persist_directory=CHROMA_PERSIST_DIRECTORY
+    )
 # retriver = vect_store.as_retriever(search_kwargs={"k":3})
 
 
+def _load_retriever() -> HybridRetriever:
+    bm25 = None
+    if RETRIEVAL_MODE == "hybrid":
+        path = os.path.join(CHROMA_PERSIST_DIRECTORY, BM25_FILENAME)
+        if os.path.exists(path):
+            bm25 = BM25Index.load(path)
+        else:
+            logger.warning("RETRIEVAL no keyword index at %s, using vector search only (build it with python -m app.ingest --bm25-only)", path)
+    reranker = CrossEncoderReranker(RERANK_MODEL, budget_ms=RERANK_BUDGET_MS) if RERANK_MODEL else None
+    return HybridRetriever(
+        get_vect_store(), bm25, reranker,
+        candidates=RETRIEVAL_CANDIDATES,
+        min_score=RETRIEVAL_MIN_SCORE,
+        score_gap=RETRIEVAL_SCORE_GAP,
+        min_k=RETRIEVAL_MIN_K,
+        max_k=RETRIEVAL_MAX_K,
+        topic_mode=RETRIEVAL_TOPIC_MODE,
+        keyword_min_coverage=RETRIEVAL_KEYWORD_COVERAGE,
+    )
+
+
+_emb_model = Lazy("embedding_model", _load_emb_model)
+_embedder = Lazy("embedding_service", _load_embedder)
+_vect_store = Lazy("vector_store", _load_vect_store)
+_retriever = Lazy("retriever", _load_retriever)
+
+
+def get_emb_model() -> Any:
+    return _emb_model.get()
+
+
+def get_embedder() -> Any:
+    return _embedder.get()
+
+
+def get_vect_store() -> Any:
+    return _vect_store.get()
+
+
+def get_retriever() -> HybridRetriever:
+    return _retriever.get()
+
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "1") == "1" # reuse answers to near-identical questions of the same patient
+answer_cache = SemanticAnswerCache(
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92")),
+    ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+    max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "2000")),
+)
+
+
+CLINICAL_CONTEXT_TOKENS = int(os.getenv("CLINICAL_CONTEXT_TOKENS", "1500")) # input-token budget of a clinical prompt, 0 for no limit
+context_builder = ContextBuilder(budget_tokens=CLINICAL_CONTEXT_TOKENS) if CLINICAL_CONTEXT_TOKENS > 0 else None
+SOURCE_HEADER_TOKENS = count_tokens("[Source 6 | Page 123, Chunk 12]\n\n") # what book_context adds per chunk
+
+
+def patient_summary(patient_record: Dict[str, Any]) -> List[str]:
+    """ returns the lines of the patient's discharge summary block.
+    """
+    pr = patient_record
+    return [
+        "=== Patient Discharge Summary ===",
+        f"Primary diagnosis: {pr.get('primary_diagnosis')}",
+        f"Discharge date: {pr.get('discharge_date')}",
+        f"Medications: {pr.get('medications')}",
+        f"Dietary restrictions: {pr.get('dietary_restrictions')}",
+        f"Follow-up: {pr.get('follow_up')}",
+        f"Warning signs: {pr.get('warning_signs')}",
+        "",
+    ]
+
+
 def book_context(docs: List[Any],patient_record: Optional[Dict[str, Any]]=None) -> str:
     """ returns the context string from retrived documents.
     """
     lines = []
     
     if patient_record: #appending patient summary to lines
-        pr = patient_record
-        lines.append("=== Patient Discharge Summary ===")
-        lines.append(f"Primary diagnosis: {pr.get('primary_diagnosis')}")
-        lines.append(f"Discharge date: {pr.get('discharge_date')}")
-        lines.append(f"Medications: {pr.get('medications')}")
-        lines.append(f"Dietary restrictions: {pr.get('dietary_restrictions')}")
-        lines.append(f"Follow-up: {pr.get('follow_up')}")
-        lines.append(f"Warning signs: {pr.get('warning_signs')}")
-        lines.append("")
+        lines.extend(patient_summary(patient_record))
     
     for idx, doc in enumerate(docs, start=1): #appending meta data to lines
         meta = doc.metadata or {}
@@ -58,101 +162,259 @@ def web_context(results: List[Dict[str, Any]]) -> str:
 def wants_latest_or_web(question: str) -> bool:
     """ returns if the question asks for latest or noteworthy information.
     """
-    text = question.lower()
-    keywords = [
-        "latest",
-        "recent",
-        "new research",
-        "new study",
-        "guideline",
-        "2023",
-        "2024",
-        "2025",
-        "web search",
-        "check online",
-    ]
-    return any(k in text for k in keywords) #checking if the question contains above keywords are not
+    return "web" in match_keywords(question) #checking if the question contains WEB_KEYWORDS or not
   
+CLINICAL_LLM_KWARGS: Dict[str, Any] = { # generation settings shared by every clinical answer
+    "model": "openai/gpt-oss-20b",
+    "temperature": 0.1,
+    "max_tokens": 400,
+}
+
+BOOK_FALLBACK = (
+    "I could not find enough reliable information in the textbook to answer this question. "
+    "Please discuss this directly with your doctor."
+)
+
+WEB_FALLBACK = (
+    "I could not find enough reliable information in the textbook or via web search "
+    "to answer this question. Please discuss this directly with your doctor."
+)
+
+
+@tracing.traced("embed")
+def embed_query(message: str) -> List[float]:
+    """ returns the embedding of the message.
+    """
+    return get_embedder().embed_query(message)
+
+
+@tracing.traced("retrieve")
+def retrieve_docs(message: str, patient_record: Optional[Dict[str, Any]] = None) -> List[Any]:
+    """ returns the textbook chunks most relevant to the message: vector and keyword (BM25) search
+    fused, favouring the chapters of the patient's diagnosis, and reranked when RERANK_MODEL is set.
+    As many as are relevant enough, up to RETRIEVAL_MAX_K; an empty list means the textbook has
+    nothing on the question.
+    """
+    retriever = get_retriever()
+    topics = diagnosis_topics(patient_record.get("primary_diagnosis") or "") if patient_record else None
+    docs, stats = retriever.retrieve(message, embed_query(message), topics)
+    logger.info(
+        "RETRIEVAL %s chunks_per_answer=%.2f insufficient=%d/%d",
+        " ".join(f"{key}={value:.1f}" if key.endswith("_ms") else f"{key}={value:g}" for key, value in stats.items()),
+        retriever.stats["chunks"] / max(1, retriever.stats["queries"] - retriever.stats["insufficient"]),
+        retriever.stats["insufficient"], retriever.stats["queries"],
+    )
+    tracing.annotate(**stats)
+    return docs
+
+
+def needs_web(message: str, docs: List[Any], allow_web: bool) -> bool:
+    """ returns if the web should be searched for this message.
+    """
+    ask_for_web = wants_latest_or_web(message) #asking web for context
+    return allow_web and (not docs or ask_for_web)
+
+
+CLINICAL_SYSTEM_PROMPT = ( # system prompt
+  "You are a clinical nephrology assistant answering questions for a recently discharged patient.\n"
+  "- Use only the context from the nephrology reference and discharge summary below.\n"
+  "- Refer to the snippets using the [Source N] labels when needed.\n"
+  "- If the context does not fully answer the question, say that clearly.\n"
+  "- Keep the answer focused and easy to understand.\n"
+  "- End with a short line reminding the user that this does not replace their doctor's advice.\n"
+)
+
+CLINICAL_WEB_SYSTEM_PROMPT = (
+  "You are a clinical nephrology assistant.\n"
+  "- You have textbook context (labelled [Source N]) and web context (labelled [Web N]).\n"
+  "- Prefer textbook information when possible, but you may mention web sources for newer data.\n"
+  "- If there is any conflict, say that the treating doctor should decide.\n"
+  "- Keep the answer concise and clear.\n"
+  "- End with a short reminder that this does not replace medical advice from their own doctor.\n"
+)
+
+
+def _with_summary(system_prompt: str) -> Any:
+    """ a prefix builder: the system prompt followed by the patient's discharge summary,
+    which is the same every turn so it belongs in the cached prefix, not the user prompt.
+    """
+    def build(patient_record: Optional[Dict[str, Any]]) -> str:
+        if not patient_record:
+            return system_prompt
+        return system_prompt + "\n" + "\n".join(patient_summary(patient_record))
+    return build
+
+
+prefixes.register("clinical", _with_summary(CLINICAL_SYSTEM_PROMPT))
+prefixes.register("clinical_web", _with_summary(CLINICAL_WEB_SYSTEM_PROMPT))
+
+
+def clinical_prompts(message: str, docs: List[Any], patient_record: Optional[Dict[str, Any]], web_results: Optional[List[Dict[str, Any]]] = None) -> Optional[Tuple[str, str]]:
+    """ returns the (system_prompt, user_prompt) pair for the clinical answer, or None when there is nothing to answer from.
+    web_results is None when the web was not searched. The system prompt, with the patient's
+    discharge summary, is the same every turn; the question and retrieved context follow it.
+    """
+    started = time.perf_counter()
+    if web_results is None:
+        if not docs:
+            return None
+
+        def user_prompt_for(docs: List[Any]) -> str:
+            context = book_context(docs)#giving similar context to function and returning string
+            return (#user prompt
+              f"Patient question:\n{message}\n\n"
+              f"---\n"
+              f"Context:\n{context}\n"
+            )
+        return _fit_to_budget(prefixes.get("clinical", patient_record), user_prompt_for, docs, started, need_docs=True)
+
+    wc = web_context(web_results) if web_results else ""
+
+    if not docs and not web_results: #writing fallback if neither the textbook nor the web has anything on the question
+        return None
+
+    def user_prompt_for(docs: List[Any]) -> str:
+        bc = book_context(docs) if docs else ""
+        return (
+          f"Patient question:\n{message}\n\n"
+          f"---\n"
+          f"Textbook context (may be empty):\n{bc}\n\n"
+          f"---\n"
+          f"Web search results (may be empty):\n{wc}\n"
+        )
+    return _fit_to_budget(prefixes.get("clinical_web", patient_record), user_prompt_for, docs, started, need_docs=not web_results)
+
+
+def _fit_to_budget(prefix: Prefix, user_prompt_for: Any, docs: List[Any], started: float, need_docs: bool = False) -> Optional[Tuple[str, str]]:
+    """ builds the user prompt from as many of docs as fit the CLINICAL_CONTEXT_TOKENS budget
+    (deduplicated, in relevance order) and logs the prompt's token count and build time.
+    Returns None when need_docs is set and the prefix and question leave no room for any of
+    docs, so the caller falls back instead of asking the LLM with no context.
+    """
+    if context_builder is None or not docs:
+        user_prompt = user_prompt_for(docs)
+        logger.info(
+            "CONTEXT prompt_tokens=%d prefix_tokens=%d chunks=%d build_ms=%.2f",
+            prefix.tokens + count_tokens(user_prompt), prefix.tokens, len(docs), (time.perf_counter() - started) * 1000,
+        )
+        return prefix.text, user_prompt
+
+    used = prefix.tokens + count_tokens(user_prompt_for([]))
+    packed, stats = context_builder.pack(docs, used_tokens=used, chunk_overhead=SOURCE_HEADER_TOKENS)
+    if not stats["packed"]:
+        logger.warning(
+            "CONTEXT budget of %d tokens overflowed: prefix and question take %d, none of %d chunks fit",
+            context_builder.budget_tokens, used, len(docs),
+        )
+        if need_docs:
+            return None
+    user_prompt = user_prompt_for(packed)
+    logger.info(
+        "CONTEXT prompt_tokens=%d prefix_tokens=%d budget=%d chunks=%d/%d duplicates=%d truncated=%d dropped=%d build_ms=%.2f",
+        prefix.tokens + count_tokens(user_prompt), prefix.tokens, context_builder.budget_tokens,
+        stats["packed"], stats["retrieved"], stats["duplicates"], stats["truncated"], stats["dropped"],
+        (time.perf_counter() - started) * 1000,
+    )
+    return prefix.text, user_prompt
+
+
+@tracing.traced("clinical_prepare")
+def prepare_clinical(message: str, state: State, allow_web: bool = True, docs: Optional[List[Any]] = None) -> Dict[str, Any]:
+      """ runs retrieval, web search if needed and the answer cache lookup for a clinical answer.
+      docs can be passed in when retrieval already ran (e.g. speculatively).
+      returns {"reply": fallback or cached answer, or None when the LLM must answer,
+      "prompts": (system_prompt, user_prompt), "cache_key": key to store the LLM answer under}.
+      """
+      if docs is None:
+          docs = retrieve_docs(message, state.get("patient_record"))
+
+      web_results = None
+      if needs_web(message, docs, allow_web): #checking if searching in web allowed and needed
+          web_results = web_search(message, num_results=3)
+
+      return _prepare_answer(message, state, docs, web_results)
+
+
+@tracing.traced("clinical_prepare")
+async def prepare_clinical_async(message: str, state: State, allow_web: bool = True, docs: Optional[List[Any]] = None) -> Dict[str, Any]:
+      """ async version of prepare_clinical, the blocking work runs on the executor and the
+      web search is awaited with its deadline.
+      """
+      if docs is None:
+          docs = await run_blocking(retrieve_docs, message, state.get("patient_record"))
+
+      web_results = None
+      if needs_web(message, docs, allow_web):
+          web_results = await web_search_async(message, num_results=3)
+
+      return await run_blocking(_prepare_answer, message, state, docs, web_results)
+
+
+def _prepare_answer(message: str, state: State, docs: List[Any], web_results: Optional[List[Dict[str, Any]]]) -> Dict[str, Any]:
+      """ the answer cache lookup and prompts of prepare_clinical, once docs and web_results are known.
+      """
+      patient_record = state.get("patient_record") #getting patient records from state
+
+      cache_key = None
+      if ANSWER_CACHE and docs and web_results is None: # web answers are about latest info, never cached
+          cache_key = (patient_scope(patient_record), tuple(doc_key(d) for d in docs), unit_vector(embed_query(message)))
+          cached = answer_cache.get(cache_key)
+          if cached is not None:
+              tracing.annotate(answer_cache_hit=True)
+              metrics.clinical_context.inc("cache")
+              return {"reply": cached, "prompts": None, "cache_key": None}
+
+      prompts = clinical_prompts(message, docs, patient_record, web_results)
+      if prompts is None:
+          metrics.clinical_context.inc("fallback")
+          return {"reply": WEB_FALLBACK if web_results is not None else BOOK_FALLBACK, "prompts": None, "cache_key": None}
+      metrics.clinical_context.inc("web" if web_results else "textbook")
+      return {"reply": None, "prompts": prompts, "cache_key": cache_key}
+
+
+def remember_clinical_answer(prepared: Dict[str, Any], answer: str) -> None:
+      """ stores the LLM answer in the answer cache if prepare_clinical gave it a key.
+      """
+      if prepared.get("cache_key") is not None and answer:
+          answer_cache.put(prepared["cache_key"], answer)
+
+
+@tracing.traced("clinical")
 def clinical_agent(message: str,state: State, allow_web: bool = True) -> Tuple[str, State]:
       """ clinical agent to handle human queries related to diagnosis, searches web if they want to know latest info and suggest them to go to doctor. if they have any serious issues.
       """
-      patient_record = state.get("patient_record") #getting patient records from state
-      ask_for_web = wants_latest_or_web(message) #asking web for context
-      
-      docs = vect_store.similarity_search(message, k=6)#doing similarity search in vector db with respect to the given query and retriving the similar ones
-      
-      if docs and not (ask_for_web and allow_web):
-          context = book_context(docs, patient_record)#giving similar context to function and returning string
-          
-          system_prompt = ( # system prompt
-            "You are a clinical nephrology assistant answering questions for a recently discharged patient.\n"
-            "- Use only the context from the nephrology reference and discharge summary below.\n"
-            "- Refer to the snippets using the [Source N] labels when needed.\n"
-            "- If the context does not fully answer the question, say that clearly.\n"
-            "- Keep the answer focused and easy to understand.\n"
-            "- End with a short line reminding the user that this does not replace their doctor's advice.\n"
-          )
-          
-          user_prompt = (#user prompt
-            f"Patient question:\n{message}\n\n"
-            f"---\n"
-            f"Context:\n{context}\n"
-          )
-          
-          answer = call_groq_chat( #calling groq client
-              system_prompt=system_prompt,  
-              user_prompt=user_prompt,
-              model="openai/gpt-oss-20b",
-              temperature=0.1,
-              max_tokens=400
-          )
-          
-          return answer, state
-      
-      if allow_web: #checking if searching in web allowed or not
-          web_results = web_search(message, num_results=3)
-          
-          bc = book_context(docs, patient_record) if docs else ""
-          wc = web_context(web_results) if web_results else ""
-          
-          if not book_context and not web_context: #writing fallback if the web is not allowed and information doesnt present in chromadb
-              fallback = (
-                "I could not find enough reliable information in the textbook or via web search "
-                "to answer this question. Please discuss this directly with your doctor."
-              )
-              return fallback, state
-          
-          system_prompt = (
-            "You are a clinical nephrology assistant.\n"
-            "- You have textbook context (labelled [Source N]) and web context (labelled [Web N]).\n"
-            "- Prefer textbook information when possible, but you may mention web sources for newer data.\n"
-            "- If there is any conflict, say that the treating doctor should decide.\n"
-            "- Keep the answer concise and clear.\n"
-            "- End with a short reminder that this does not replace medical advice from their own doctor.\n"
-          )
-          
-          user_prompt = (
-            f"Patient question:\n{message}\n\n"
-            f"---\n"
-            f"Textbook context (may be empty):\n{bc}\n\n"
-            f"---\n"
-            f"Web search results (may be empty):\n{wc}\n"
-          )
-          
-          answer = call_groq_chat(
-              system_prompt=system_prompt,  
-              user_prompt=user_prompt,
-              model="openai/gpt-oss-20b",
-              temperature=0.1,
-              max_tokens=400
-          )
-          
-          return answer, state
-      fallback = (
-        "I could not find enough reliable information in the textbook to answer this question. "
-        "Please discuss this directly with your doctor."
+      prepared = prepare_clinical(message, state, allow_web)
+      if prepared["reply"] is not None:
+          return prepared["reply"], state
+
+      system_prompt, user_prompt = prepared["prompts"]
+      answer = call_groq_chat( #calling groq client
+          system_prompt=system_prompt,
+          user_prompt=user_prompt,
+          **CLINICAL_LLM_KWARGS
+      )
+      remember_clinical_answer(prepared, answer)
+
+      return answer, state
+
+
+@tracing.traced("clinical")
+async def clinical_agent_async(message: str, state: State, allow_web: bool = True) -> Tuple[str, State]:
+      """ async version of clinical_agent, retrieval and web search run on the blocking executor.
+      """
+      prepared = await prepare_clinical_async(message, state, allow_web)
+      if prepared["reply"] is not None:
+          return prepared["reply"], state
+
+      system_prompt, user_prompt = prepared["prompts"]
+      answer = await call_groq_chat_async(
+          system_prompt=system_prompt,
+          user_prompt=user_prompt,
+          **CLINICAL_LLM_KWARGS
       )
-      return fallback, state
+      remember_clinical_answer(prepared, answer)
+
+      return answer, state
 
 # if __name__ == "__main__": #for testing wether the clinical agent is working or not
 #     state: State = {}
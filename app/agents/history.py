@@ -0,0 +1,166 @@
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.concurrency import run_blocking
+from app.logging_setup import logger
+from app.session_store import SessionStore
+from app.tools.context_builder import truncate_to_tokens
+
+State = Dict[str, Any]
+Entry = Dict[str, Any]
+
+# the session keeps only the last HISTORY_WINDOW messages (user and assistant), older ones are
+# dropped or, with HISTORY_SUMMARY=1, folded into a rolling summary after the reply has been sent.
+# Everything stays plain lists and strings so any session store can serialise it.
+HISTORY_WINDOW = int(os.getenv("HISTORY_WINDOW", "12")) # the router reads the last 6
+HISTORY_SUMMARY = os.getenv("HISTORY_SUMMARY", "0") == "1"
+HISTORY_SUMMARY_BATCH = int(os.getenv("HISTORY_SUMMARY_BATCH", "6")) # evicted messages summarised at once
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "200"))
+
+SUMMARY_LLM_KWARGS: Dict[str, Any] = {
+    "model": "openai/gpt-oss-20b",
+    "temperature": 0.2,
+    "max_tokens": HISTORY_SUMMARY_MAX_TOKENS,
+}
+
+stats: Dict[str, int] = {"evicted": 0, "dropped": 0, "summaries": 0, "summary_failures": 0}
+
+_summarising: set = set() # session ids with a summary running, one at a time per session
+_summarising_lock = threading.Lock()
+
+
+def _entry_bytes(entries: List[Entry]) -> int:
+    return sum(len(json.dumps(e).encode("utf-8")) for e in entries)
+
+
+def history_bytes(state: State) -> int:
+    """ serialised size of the session's conversation history: window, pending messages and summary.
+    """
+    return _entry_bytes(state.get("history", [])) + _entry_bytes(state.get("history_pending", [])) + len(state.get("history_summary", "").encode("utf-8"))
+
+
+def append_entry(state: State, entry: Entry) -> None:
+    """ appends a message to the live window, moving the oldest ones out past HISTORY_WINDOW:
+    into history_pending for the summariser, or away when summaries are off.
+    Keeps state["history_bytes"] up to date without re-serialising the history.
+    """
+    if "history_bytes" not in state: # sessions saved before the counter existed
+        state["history_bytes"] = history_bytes(state)
+    history: List[Entry] = state.setdefault("history", [])
+    history.append(entry)
+    state["history_bytes"] += _entry_bytes([entry])
+    overflow = len(history) - HISTORY_WINDOW
+    if overflow <= 0:
+        return
+    evicted = history[:overflow]
+    del history[:overflow]
+    stats["evicted"] += overflow
+    if not HISTORY_SUMMARY:
+        state["history_bytes"] -= _entry_bytes(evicted)
+        return
+    pending: List[Entry] = state.setdefault("history_pending", [])
+    state["history_evicted"] = state.get("history_evicted", len(pending)) + overflow # so pending[0] is message history_evicted - len(pending)
+    pending.extend(evicted)
+    excess = len(pending) - 2 * HISTORY_WINDOW # bounded too, when nothing summarises (e.g. the sync pipeline)
+    if excess > 0:
+        state["history_bytes"] -= _entry_bytes(pending[:excess])
+        del pending[:excess]
+        stats["dropped"] += excess
+
+
+def _pending_start(state: State) -> int:
+    """ how many messages were moved out of the window before the first pending one.
+    """
+    pending = state.get("history_pending", [])
+    return state.get("history_evicted", len(pending)) - len(pending)
+
+
+def adopt_summary(state: State, stored: Optional[State]) -> None:
+    """ brings a state loaded before a background summary was saved up to date with the stored
+    one: takes the newer summary and drops the pending messages it covers, so saving the state
+    doesn't bring them back and lose the summary.
+    """
+    if not stored or stored.get("history_summarised", 0) <= state.get("history_summarised", 0):
+        return
+    pending = state.get("history_pending", [])
+    covered = min(len(pending), stored["history_summarised"] - _pending_start(state))
+    if covered > 0:
+        del pending[:covered]
+    state["history_summary"] = stored.get("history_summary", "")
+    state["history_summarised"] = stored["history_summarised"]
+    state["history_bytes"] = history_bytes(state)
+
+
+def needs_summary(state: State) -> bool:
+    return HISTORY_SUMMARY and len(state.get("history_pending", [])) >= HISTORY_SUMMARY_BATCH
+
+
+def format_entries(entries: List[Entry]) -> str:
+    lines = []
+    for h in entries:
+        if h.get("role") == "user":
+            lines.append(f"USER: {h.get('content', '')}")
+        elif h.get("agent"):
+            lines.append(f"ASSISTANT({h['agent']}): {h.get('content', '')}")
+        else:
+            lines.append(f"ASSISTANT: {h.get('content', '')}")
+    return "\n".join(lines)
+
+
+def summary_prompts(summary: str, entries: List[Entry]) -> Tuple[str, str]:
+    system_prompt = (
+        "You keep a running summary of a conversation between a recently discharged kidney patient "
+        "and a hospital assistant.\n"
+        "- Merge the earlier summary with the new messages into one short paragraph.\n"
+        "- Keep what the patient asked, symptoms they reported, and anything arranged for them.\n"
+        "- Leave out greetings and the assistant's explanations.\n"
+        "- Reply with the summary only."
+    )
+    user_prompt = (
+        f"Earlier summary (may be empty):\n{summary}\n\n"
+        f"New messages:\n{format_entries(entries)}"
+    )
+    return system_prompt, user_prompt
+
+
+async def summarise_session(store: SessionStore, session_id: str) -> None:
+    """ folds the session's pending messages into its rolling summary and saves it back.
+    Scheduled by the API after the reply is sent; failures leave the messages pending.
+    A request that loaded the state before this saves it merges the summary in with adopt_summary.
+    """
+    from app.llm.groq_client import call_groq_chat_async
+
+    with _summarising_lock:
+        if session_id in _summarising:
+            return
+        _summarising.add(session_id)
+    try:
+        state = await run_blocking(store.get, session_id) # the SQLite store does disk I/O
+        if state is None or not needs_summary(state):
+            return
+        batch = list(state["history_pending"])
+        system_prompt, user_prompt = summary_prompts(state.get("history_summary", ""), batch)
+        try:
+            summary = await call_groq_chat_async(system_prompt=system_prompt, user_prompt=user_prompt, **SUMMARY_LLM_KWARGS)
+        except Exception:
+            stats["summary_failures"] += 1
+            logger.exception("HISTORY session_id=%s summary failed", session_id)
+            return
+
+        state = await run_blocking(store.get, session_id) or state # the patient may have sent another message meanwhile
+        pending = state.get("history_pending", [])
+        done = len(batch) if pending[:len(batch)] == batch else 0
+        if not done:
+            return # pending was trimmed under us, the next run summarises what is there now
+        state["history_summarised"] = _pending_start(state) + done # read by adopt_summary in requests that loaded the state earlier
+        del pending[:done]
+        state["history_summary"] = truncate_to_tokens(summary.strip(), HISTORY_SUMMARY_MAX_TOKENS)
+        state["history_bytes"] = history_bytes(state)
+        await run_blocking(store.set, session_id, state)
+        stats["summaries"] += 1
+        logger.info("HISTORY session_id=%s summarised=%d bytes=%d", session_id, done, state["history_bytes"])
+    finally:
+        with _summarising_lock:
+            _summarising.discard(session_id)
@@ -0,0 +1,146 @@
+import re
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Iterable, List, Set
+
+# keyword lists used by the routing heuristics, all matched in one pass by match_keywords()
+
+ADMIN_KEYWORDS = [ # storing some keywords related to admin
+    "appointment",
+    "book an appointment",
+    "book appointment",
+    "schedule an appointment",
+    "schedule appointment",
+    "reschedule",
+    "cancel appointment",
+    "next appointment",
+    "follow-up appointment",
+    "follow up appointment",
+    "slot",
+    "time slot",
+]
+
+ADMIN_HINT_WORDS = [ # a medical keyword next to one of these is often a paperwork question
+    "report", "document", "certificate", "insurance", "bill", "transport",
+    "parking", "phone", "contact", "timing", "visit", "clinic",
+]
+
+MEDICAL_TRIGGER_WORDS = ["medical", "symptom", "symptomps"] # always medical on their own
+
+MEDICAL_KEYWORDS = [ #Initializing some medical keywords
+   "pain", "swelling", "shortness of breath", "breathless",
+    "bp", "blood pressure", "fever", "vomiting", "nausea",
+    "chest pain", "palpitations", "urine", "urination",
+    "weight gain", "weight loss", "dizzy", "dizziness",
+    "headache", "cramps", "edema", "dialysis",
+    "emergency", "urgent", "bleeding",
+    "kidney", "renal", "ckd", "creatinine", "gfr", "egfr",
+    "stone", "stones",
+    "low potassium", "low pottasium", "potassium", "pottasium",
+    "low sodium", "low salt", "fluid restriction", "phosphorus", "phosphate",
+    "protein restriction"
+]
+
+KIDNEY_CONCEPTS = ["kidney", "renal", "ckd", "stone", "stones", "creatinine", "gfr", "egfr"]
+
+MEDICAL_TOPIC_WORDS = [ #Initializing some medical topic words
+    "symptom", "symptoms", "symptomps",
+    "cause", "causes",
+    "treatment", "treatments",
+    "risk", "risks",
+    "complication", "complications",
+    "diet", "uses", "use", "effect", "effects",
+    "side effect", "side effects",
+    "benefit", "benefits",
+    "management", "manage", "control",
+]
+
+WEB_KEYWORDS = [ # the question asks for latest or noteworthy information
+    "latest",
+    "recent",
+    "new research",
+    "new study",
+    "guideline",
+    "2023",
+    "2024",
+    "2025",
+    "web search",
+    "check online",
+]
+
+
+def _trie_regex(words: List[str]) -> str:
+    """ builds a regex matching any of words, factored by common prefixes
+    ("pain|palpitations" → "pa(?:in|lpitations)") so the engine tries one branch per character
+    instead of every keyword at every position. Longer keywords win over their prefixes.
+    """
+    trie: Dict[str, Any] = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {} # end of a keyword
+
+    def build(node: Dict[str, Any]) -> str:
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        if "" in node: # a keyword ends here, try the longer ones first
+            return "(?:" + "|".join(branches) + ")?"
+        if len(branches) == 1:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")"
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """
+    Matches many keyword lists against a text with one compiled regex.
+    Keywords must start at a word boundary but may be followed by more letters,
+    so "stone" matches "stones" but "use" does not match "because".
+    """
+
+    def __init__(self, categories: Dict[str, Iterable[str]]):
+        owners: Dict[str, Set[str]] = {}
+        for category, words in categories.items():
+            for word in words:
+                owners.setdefault(word.lower(), set()).add(category)
+
+        # the regex takes the longest keyword at a position and skips what it covers,
+        # so a keyword also reports the categories of keywords found inside it ("chest pain" → "pain")
+        self._categories: Dict[str, FrozenSet[str]] = {}
+        for word in owners:
+            found: Set[str] = set()
+            for other, other_categories in owners.items():
+                if re.search(r"(?<!\w)" + re.escape(other), word):
+                    found |= other_categories
+            self._categories[word] = frozenset(found)
+
+        self._pattern = re.compile(r"(?<!\w)" + _trie_regex(list(owners))) # text is lower-cased instead of re.IGNORECASE, which is much slower
+
+    def match(self, text: str) -> FrozenSet[str]:
+        """ returns every category with at least one keyword in text.
+        """
+        found: Set[str] = set()
+        for word in self._pattern.findall(text.lower()):
+            found |= self._categories[word]
+        return frozenset(found)
+
+
+ROUTING_MATCHER = KeywordMatcher({ # built once at import
+    "admin": ADMIN_KEYWORDS,
+    "admin_hint": ADMIN_HINT_WORDS,
+    "medical_trigger": MEDICAL_TRIGGER_WORDS,
+    "medical": MEDICAL_KEYWORDS,
+    "kidney": KIDNEY_CONCEPTS,
+    "topic": MEDICAL_TOPIC_WORDS,
+    "web": WEB_KEYWORDS,
+})
+
+
+@lru_cache(maxsize=1024)
+def match_keywords(text: str) -> FrozenSet[str]:
+    """ returns the routing keyword categories found in text, cached because several
+    heuristics look at the same message.
+    """
+    return ROUTING_MATCHER.match(text)
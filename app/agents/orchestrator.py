@@ -1,62 +1,75 @@
+import asyncio
+import json
 import logging
-from typing import Any, Dict, Tuple, List
-from app.llm.groq_client import call_groq_chat
-from app.agents.receptionist import receptionist_agent
-from app.agents.clinical import clinical_agent
+import os
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Tuple, List
+from app.llm.groq_client import call_groq_chat, call_groq_chat_async, stream_groq_chat_async, get_client as get_groq_client, get_async_client as get_async_groq_client
+from app.agents.receptionist import receptionist_agent, receptionist_step, receptionist_prompts, is_medical_query, RECEPTIONIST_LLM_KWARGS
+from app.agents.clinical import clinical_agent, clinical_agent_async, prepare_clinical_async, remember_clinical_answer, retrieve_docs, get_embedder, get_retriever, CLINICAL_LLM_KWARGS
+from app import metrics, tracing
+from app.concurrency import Lazy, run_blocking
+from app.agents.keywords import match_keywords
+from app.agents.history import append_entry, format_entries
+from app.tools.answer_cache import unit_vector
+from app.tools.patient_db import get_index as get_patient_index
+from app.tools.web_search import get_async_client as get_tavily_client
 from app.logging_setup import logger
 
 State = Dict[str, Any] # initializing the state
 
-ADMIN_KEYWORDS = [ # storing some keywords related to admin
-    "appointment",
-    "book an appointment",
-    "book appointment",
-    "schedule an appointment",
-    "schedule appointment",
-    "reschedule",
-    "cancel appointment",
-    "next appointment",
-    "follow-up appointment",
-    "follow up appointment",
-    "slot",
-    "time slot",
-]
+# work started while the router LLM is still classifying, most identified-patient traffic is CLINICAL
+# off       : classify first, then run the chosen agent
+# retrieval : run the Chroma search concurrently with classification
+# answer    : run the whole clinical answer (retrieval, web, LLM) concurrently; streaming falls back to retrieval
+SPECULATION_LEVELS = ("off", "retrieval", "answer")
+SPECULATION_LEVEL = os.getenv("SPECULATION_LEVEL", "retrieval")
+if SPECULATION_LEVEL not in SPECULATION_LEVELS:
+    raise ValueError(f"SPECULATION_LEVEL must be one of {SPECULATION_LEVELS}, got {SPECULATION_LEVEL!r}")
+
+SPECULATION_STATS: Dict[str, float] = { # totals since startup, per-request numbers are logged
+    "used": 0,
+    "discarded": 0,
+    "saved_ms": 0.0,
+    "wasted_ms": 0.0,
+    "wasted_llm_calls": 0,
+}
+
 
 def _quick_admin_check(message: str) -> bool: # checking if the message is for receptionist or clinical
-    text = message.lower()
-    return any(k in text for k in ADMIN_KEYWORDS)
+    return "admin" in match_keywords(message)
 
 
 
-def _format_history_for_classifier(history: List[Dict[str, Any]]) -> str: 
+def _format_history_for_classifier(history: List[Dict[str, Any]], summary: str = "") -> str: 
     """
     Take a short history list and format it into a compact text block this functions returns a string 
     """
-    lines = [] 
-    # only last 6 turns to keep context short
-    for h in history[-6:]:
-        role = h.get("role", "")
-        agent = h.get("agent", "")
-        content = h.get("content", "")
-        if role == "user":
-            lines.append(f"USER: {content}")
-        else:
-            if agent:
-                lines.append(f"ASSISTANT({agent}): {content}")
-            else:
-                lines.append(f"ASSISTANT: {content}")
-    return "\n".join(lines)
+    # only last 6 turns to keep context short, older ones only through the rolling summary
+    text = format_entries(history[-6:])
+    if summary:
+        return f"(Earlier: {summary})\n{text}"
+    return text
 
 
-def _classify_intent(message: str, state: State) -> str:
+INTENT_LABELS = {"IDENTITY", "ADMIN", "CLINICAL", "SMALL_TALK"}
+
+CLASSIFIER_LLM_KWARGS: Dict[str, Any] = { # deterministic, tiny completion for the router
+    "model": "openai/gpt-oss-20b",
+    "temperature": 0.0,
+    "max_tokens": 5,
+}
+
+
+def _classifier_prompts(message: str, state: State) -> Tuple[str, str]:
     """
-    Use a small LLM call to classify the user message.
-    and uses short conversation history from state to understand context better.
+    Build the router prompts for the next user message,
+    using short conversation history from state to understand context better.
     """
     patient_record = state.get("patient_record")
     history = state.get("history", []) # getting chat history
 
-    history_text = _format_history_for_classifier(history) #formatting the history
+    history_text = _format_history_for_classifier(history, state.get("history_summary", "")) #formatting the history
  
     system_prompt = ( 
         "You are a router for a hospital chatbot.\n"
@@ -90,16 +103,16 @@ def _classify_intent(message: str, state: State) -> str:
         f"Next user message: {message}\n\n"
         "Answer with exactly one word: IDENTITY, ADMIN, CLINICAL, or SMALL_TALK."
     )
+    return system_prompt, user_prompt
 
-    label = call_groq_chat(
-        system_prompt=system_prompt,
-        user_prompt=user_prompt,
-        model="openai/gpt-oss-20b",
-        temperature=0.0,
-        max_tokens=5,
-    ).strip().upper()
 
-    if label not in {"IDENTITY", "ADMIN", "CLINICAL", "SMALL_TALK"}: #fallback if the llm is not working
+def _parse_intent(raw: str, state: State) -> str:
+    """
+    Map the raw router output onto one of INTENT_LABELS.
+    """
+    label = raw.strip().upper()
+
+    if label not in INTENT_LABELS: #fallback if the llm is not working
         # Fallback: if we know the patient already, default to CLINICAL; otherwise IDENTITY
         if state.get("patient_record"):
             return "CLINICAL"
@@ -108,13 +121,157 @@ def _classify_intent(message: str, state: State) -> str:
     return label
 
 
+# local tier in front of the router LLM, only confident answers skip the LLM call
+LOCAL_INTENT = os.getenv("LOCAL_INTENT", "1") == "1"
+LOCAL_INTENT_MIN_SIM = float(os.getenv("LOCAL_INTENT_MIN_SIM", "0.45")) # cosine to the closest label centroid
+LOCAL_INTENT_MARGIN = float(os.getenv("LOCAL_INTENT_MARGIN", "0.08")) # lead over the second closest centroid
+INTENT_EXAMPLES_PATH = "data/intent_examples.json"
+
+ACKNOWLEDGEMENTS = { # whole-message small talk, the router always labels these SMALL_TALK
+    "hi", "hello", "hey", "yes", "no", "ok", "okay", "sure", "fine", "good",
+    "thanks", "thank you", "ok thanks", "okay thanks", "bye",
+}
+
+INTENT_STATS: Dict[str, int] = {"local": 0, "llm": 0} # how often the router LLM was skipped
+
+def _build_intent_centroids() -> Dict[str, List[float]]:
+    """
+    Embed the labelled example messages and return the normalised mean vector per label.
+    """
+    with open(INTENT_EXAMPLES_PATH, "r", encoding="utf-8") as f:
+        examples: Dict[str, List[str]] = json.load(f)
+    centroids = {}
+    for label, texts in examples.items():
+        vectors = get_embedder().embed_documents(texts)
+        centroids[label] = unit_vector([sum(col) / len(vectors) for col in zip(*vectors)])
+    return centroids
+
+
+_intent_centroids = Lazy("intent_centroids", _build_intent_centroids, required=LOCAL_INTENT)
+
+
+def _get_intent_centroids() -> Dict[str, List[float]]:
+    return _intent_centroids.get()
+
+
+def _local_intent(message: str) -> Tuple[Optional[str], float]:
+    """
+    Classify without the LLM: acknowledgements, then the receptionist's medical keywords,
+    then the nearest label centroid of the embedded message.
+    Returns (label, score), label is None when the message is ambiguous.
+    """
+    text = " ".join(message.lower().split()).strip(" .,!?")
+    if text in ACKNOWLEDGEMENTS:
+        return "SMALL_TALK", 1.0
+
+    if is_medical_query(message) and "admin_hint" not in match_keywords(message): # paperwork questions mention medical words too
+        return "CLINICAL", 1.0
+
+    query = unit_vector(get_embedder().embed_query(message))
+    scores = sorted(
+        ((sum(q * c for q, c in zip(query, centroid)), label) for label, centroid in _get_intent_centroids().items()),
+        reverse=True,
+    )
+    (best, label), (second, _) = scores[0], scores[1]
+    if best >= LOCAL_INTENT_MIN_SIM and best - second >= LOCAL_INTENT_MARGIN:
+        return label, best
+    return None, best
+
+
+def _try_local_intent(message: str, state: State) -> Optional[str]:
+    """
+    Run the local tier if enabled, returns None when the router LLM has to decide.
+    """
+    if not LOCAL_INTENT:
+        return None
+
+    label, score = _local_intent(message)
+    if label is None:
+        return None
+
+    INTENT_STATS["local"] += 1
+    logger.info(
+        "ROUTER session_id=%s intent_source=local intent=%s score=%.2f",
+        state.get("session_id", "unknown"),
+        label,
+        score,
+    )
+    return label
+
+
+@tracing.traced("classify")
+def _classify_intent(message: str, state: State) -> str:
+    """
+    Use a small LLM call to classify the user message.
+    and uses short conversation history from state to understand context better.
+    Confidently classified messages are answered locally without the LLM.
+    """
+    label = _try_local_intent(message, state)
+    if label is not None:
+        tracing.annotate(tier="local", intent=label)
+        metrics.intents.inc(label, "local")
+        return label
+
+    INTENT_STATS["llm"] += 1
+    tracing.annotate(tier="llm")
+    system_prompt, user_prompt = _classifier_prompts(message, state)
+    raw = call_groq_chat(
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+        **CLASSIFIER_LLM_KWARGS,
+    )
+    label = _parse_intent(raw, state)
+    metrics.intents.inc(label, "llm")
+    return label
+
+
+@tracing.traced("classify")
+async def _classify_intent_async(message: str, state: State) -> str:
+    """
+    Async version of _classify_intent.
+    """
+    label = await run_blocking(_try_local_intent, message, state) # embedding the message is CPU work
+    if label is not None:
+        tracing.annotate(tier="local", intent=label)
+        metrics.intents.inc(label, "local")
+        return label
+
+    INTENT_STATS["llm"] += 1
+    tracing.annotate(tier="llm")
+    system_prompt, user_prompt = _classifier_prompts(message, state)
+    raw = await call_groq_chat_async(
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+        **CLASSIFIER_LLM_KWARGS,
+    )
+    label = _parse_intent(raw, state)
+    metrics.intents.inc(label, "llm")
+    return label
+
+
+def _start_turn(message: str, state: State) -> None:
+    """
+    Record the user message in the session history.
+    """
+    tracing.annotate(session_id=state.get("session_id", "unknown"))
+    append_entry(state, {"role": "user", "agent": None, "content": message})
+
+
+def _finish_turn(state: State, agent: str, reply: str) -> None:
+    """
+    Record which agent answered and append its reply to the history.
+    """
+    state["mode"] = agent # toggling between clinical and receptionist mode
+    tracing.annotate(agent=agent)
+    append_entry(state, {"role": "assistant", "agent": agent, "content": reply})
+
+
+@tracing.traced("chat")
 def handle_message(message: str, state: State) -> Tuple[str, State]: # handling messages like when to call clinical and receptionist bot
     allow_web = state.get("allow_web", True)
     patient_record = state.get("patient_record")
 
-    history: List[Dict[str, Any]] = state.get("history", []) #getting history
-    state["history"] = history
-    history.append({"role": "user", "agent": None, "content": message})
+    _start_turn(message, state)
     session_id = state.get("session_id", "unknown") 
 
     # 1) No identity yet → receptionist
@@ -125,10 +282,7 @@ def handle_message(message: str, state: State) -> Tuple[str, State]: # handling
             message[:200],
         )
         reply, state, _ = receptionist_agent(message, state)
-        state["mode"] = "receptionist"
-        state["history"].append(
-            {"role": "assistant", "agent": "receptionist", "content": reply}
-        )
+        _finish_turn(state, "receptionist", reply)
         return reply, state
 
     # 2) HARD OVERRIDE: if clearly appointment-related, treat as ADMIN
@@ -139,10 +293,7 @@ def handle_message(message: str, state: State) -> Tuple[str, State]: # handling
             message[:200],
         )
          reply, state, _ = receptionist_agent(message, state)
-         state["mode"] = "receptionist"
-         state["history"].append(
-            {"role": "assistant", "agent": "receptionist", "content": reply}
-        )
+         _finish_turn(state, "receptionist", reply)
          return reply, state
 
     # 3) Otherwise, use LLM classifier with history
@@ -157,10 +308,7 @@ def handle_message(message: str, state: State) -> Tuple[str, State]: # handling
 
     if intent in {"ADMIN", "IDENTITY"}:
         reply, state, _ = receptionist_agent(message, state)
-        state["mode"] = "receptionist"
-        state["history"].append(
-            {"role": "assistant", "agent": "receptionist", "content": reply}
-        )
+        _finish_turn(state, "receptionist", reply)
         logger.info(
             "ROUTER session_id=%s final_agent=receptionist intent=%s", session_id, intent
         )
@@ -168,11 +316,233 @@ def handle_message(message: str, state: State) -> Tuple[str, State]: # handling
 
     # 4) SMALL_TALK + CLINICAL → clinical
     reply, state = clinical_agent(message, state, allow_web=allow_web)
-    state["mode"] = "clinical" # toggling between clinical and receptionist mode
-    state["history"].append(
-        {"role": "assistant", "agent": "clinical", "content": reply}
+    _finish_turn(state, "clinical", reply)
+    logger.info(
+        "ROUTER session_id=%s final_agent=clinical intent=%s", session_id, intent
     )
+    return reply, state
+
+
+@tracing.traced("receptionist")
+def _receptionist_plan(message: str, state: State) -> Dict[str, Any]:
+    """
+    Plan a receptionist reply: either a fixed reply or prompts for the LLM.
+    """
+    reply, state, _ = receptionist_step(message, state)
+    prompts = None
+    if reply is None:
+        prompts = receptionist_prompts(message, state["patient_record"])
+    return {"agent": "receptionist", "reply": reply, "prompts": prompts, "llm_kwargs": RECEPTIONIST_LLM_KWARGS}
+
+
+async def _timed(coro: Any) -> Tuple[Any, float]:
+    """
+    Await coro and return (result, seconds taken).
+    """
+    start = time.perf_counter()
+    result = await coro
+    return result, time.perf_counter() - start
+
+
+async def _speculative_answer(message: str, state: State, allow_web: bool) -> str:
+    """
+    Full clinical answer, started before the router has decided. clinical_agent_async does not modify state.
+    """
+    reply, _ = await clinical_agent_async(message, state, allow_web=allow_web)
+    return reply
+
+
+def _discard_speculation(task: "asyncio.Task[Tuple[Any, float]]", started: float) -> float:
+    """
+    Cancel (or drop the result of) speculative work and return the seconds it used.
+    """
+    if task.done():
+        if not task.cancelled() and task.exception() is None:
+            return task.result()[1]
+        return 0.0
+    task.cancel() # threads in the executor still finish, but the result is dropped
+    return time.perf_counter() - started
+
+
+async def _plan_turn_async(message: str, state: State, speculate_answer: bool = True) -> Dict[str, Any]:
+    """
+    Route the message and prepare everything the answering agent needs, without making its final LLM call.
+    Returns a plan dict with agent, reply (fixed text, or None when the LLM must answer), prompts and llm_kwargs.
+    With SPECULATION_LEVEL=answer and speculate_answer, a clinical plan may already carry the final reply.
+    """
+    allow_web = state.get("allow_web", True)
+    patient_record = state.get("patient_record")
+    session_id = state.get("session_id", "unknown")
+
+    # 1) No identity yet → receptionist
+    if not patient_record:
+        logger.info(
+            "ROUTER session_id=%s route=receptionist reason=no_identity message=%s",
+            session_id,
+            message[:200],
+        )
+        return _receptionist_plan(message, state)
+
+    # 2) HARD OVERRIDE: if clearly appointment-related, treat as ADMIN
+    if _quick_admin_check(message):
+        logger.info(
+            "ROUTER session_id=%s route=receptionist reason=quick_admin_match message=%s",
+            session_id,
+            message[:200],
+        )
+        return _receptionist_plan(message, state)
+
+    # 3) Otherwise, use LLM classifier with history, speculatively starting clinical work alongside it
+    level = SPECULATION_LEVEL
+    if level == "answer" and not speculate_answer:
+        level = "retrieval"
+
+    started = time.perf_counter()
+    spec_task = None
+    if level == "retrieval":
+        spec_task = asyncio.create_task(_timed(run_blocking(retrieve_docs, message, state.get("patient_record"))))
+    elif level == "answer":
+        spec_task = asyncio.create_task(_timed(_speculative_answer(message, state, allow_web)))
+
+    try:
+        intent = await _classify_intent_async(message, state)
+    except BaseException:
+        if spec_task is not None:
+            spec_task.cancel()
+        raise
+    classify_s = time.perf_counter() - started
+    logger.info(
+        "ROUTER session_id=%s intent=%s allow_web=%s message=%s",
+        session_id,
+        intent,
+        allow_web,
+        message[:200],
+    )
+
+    if intent in {"ADMIN", "IDENTITY"}:
+        if spec_task is not None:
+            wasted_s = _discard_speculation(spec_task, started)
+            SPECULATION_STATS["discarded"] += 1
+            SPECULATION_STATS["wasted_ms"] += wasted_s * 1000
+            SPECULATION_STATS["wasted_llm_calls"] += 1 if level == "answer" else 0
+            logger.info(
+                "SPECULATION session_id=%s level=%s intent=%s used=False saved_ms=0.0 wasted_ms=%.1f",
+                session_id, level, intent, wasted_s * 1000,
+            )
+        logger.info(
+            "ROUTER session_id=%s final_agent=receptionist intent=%s", session_id, intent
+        )
+        return _receptionist_plan(message, state)
+
+    # 4) SMALL_TALK + CLINICAL → clinical
+    if spec_task is None:
+        prepared = await prepare_clinical_async(message, state, allow_web=allow_web)
+        plan = {"agent": "clinical", **prepared, "llm_kwargs": CLINICAL_LLM_KWARGS}
+    else:
+        result, spec_s = await spec_task
+        saved_s = max(0.0, classify_s + spec_s - (time.perf_counter() - started)) # sequential cost minus what we waited
+        SPECULATION_STATS["used"] += 1
+        SPECULATION_STATS["saved_ms"] += saved_s * 1000
+        logger.info(
+            "SPECULATION session_id=%s level=%s intent=%s used=True saved_ms=%.1f wasted_ms=0.0",
+            session_id, level, intent, saved_s * 1000,
+        )
+        if level == "retrieval":
+            prepared = await prepare_clinical_async(message, state, allow_web=allow_web, docs=result)
+            plan = {"agent": "clinical", **prepared, "llm_kwargs": CLINICAL_LLM_KWARGS}
+        else:
+            plan = {"agent": "clinical", "reply": result, "prompts": None, "llm_kwargs": CLINICAL_LLM_KWARGS}
+
     logger.info(
         "ROUTER session_id=%s final_agent=clinical intent=%s", session_id, intent
     )
+    return plan
+
+
+@tracing.traced("chat")
+async def handle_message_async(message: str, state: State) -> Tuple[str, State]:
+    """
+    Async version of handle_message used by the API, routing is identical
+    but every LLM call, retrieval and web search is awaited.
+    """
+    _start_turn(message, state)
+    plan = await _plan_turn_async(message, state)
+
+    reply = plan["reply"]
+    if reply is None:
+        system_prompt, user_prompt = plan["prompts"]
+        reply = await call_groq_chat_async(
+            system_prompt=system_prompt,
+            user_prompt=user_prompt,
+            **plan["llm_kwargs"],
+        )
+        remember_clinical_answer(plan, reply)
+
+    _finish_turn(state, plan["agent"], reply)
     return reply, state
+
+
+@tracing.traced("chat")
+async def stream_message_async(message: str, state: State) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streaming version of handle_message_async. Yields events:
+    {"type": "agent"} once routing is done, {"type": "delta"} for every piece of reply text
+    and {"type": "done"} with the full reply. Time-to-first-token is logged per request.
+    """
+    start = time.perf_counter()
+    session_id = state.get("session_id", "unknown")
+
+    _start_turn(message, state)
+    plan = await _plan_turn_async(message, state, speculate_answer=False) # a finished answer cannot be streamed
+    yield {"type": "agent", "agent": plan["agent"]}
+
+    first_token_at = None
+    parts: List[str] = []
+    if plan["reply"] is not None: # fixed replies are sent as a single delta
+        first_token_at = time.perf_counter()
+        parts.append(plan["reply"])
+        yield {"type": "delta", "text": plan["reply"]}
+    else:
+        system_prompt, user_prompt = plan["prompts"]
+        async for delta in stream_groq_chat_async(
+            system_prompt=system_prompt,
+            user_prompt=user_prompt,
+            **plan["llm_kwargs"],
+        ):
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            parts.append(delta)
+            yield {"type": "delta", "text": delta}
+        remember_clinical_answer(plan, "".join(parts))
+
+    reply = "".join(parts)
+    _finish_turn(state, plan["agent"], reply)
+
+    end = time.perf_counter()
+    tracing.annotate(ttft_ms=round(((first_token_at or end) - start) * 1000, 1))
+    logger.info(
+        "STREAM session_id=%s agent=%s ttft_ms=%.1f total_ms=%.1f",
+        session_id,
+        plan["agent"],
+        ((first_token_at or end) - start) * 1000,
+        (end - start) * 1000,
+    )
+    yield {"type": "done", "agent": plan["agent"], "reply": reply}
+
+
+def warm_up() -> None:
+    """
+    Load the patient index, embedding model, vector store, router centroids and API clients
+    up front so the first chat does not pay for it. Called by the API at startup.
+    """
+    start = time.perf_counter()
+    get_patient_index()
+    get_retriever() # also loads the vector store, keyword index, reranker and embedding model
+    get_embedder().embed_query("warm up") # the first encode is slow
+    if LOCAL_INTENT:
+        _get_intent_centroids()
+    get_groq_client()
+    get_async_groq_client()
+    if os.getenv("TAVILY_API_KEY"): # web search is optional
+        get_tavily_client()
+    logger.info("WARMUP done in %.1f s", time.perf_counter() - start)
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, NamedTuple, Optional, Tuple
+
+from app.tools.context_builder import count_tokens
+
+PatientRecord = Optional[Dict[str, Any]]
+
+
+class Prefix(NamedTuple):
+    """A system prompt with the patient's discharge summary in it, and its token count."""
+    text: str
+    tokens: int
+
+
+def record_fingerprint(record: PatientRecord) -> str:
+    """ changes whenever any field of the record does; "" without a record.
+    """
+    if not record:
+        return ""
+    return hashlib.sha1(json.dumps(record, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class PromptPrefixCache:
+    """
+    System prompts that start every LLM call for a patient (the agent's rules followed by
+    the patient's discharge summary), built once when the patient is identified and then
+    reused byte-for-byte on every turn, so the provider's prompt cache matches them.
+    Entries are keyed on the record's fingerprint: a changed record gets new prefixes.
+    Agents register a builder per prompt name at import.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._builders: Dict[str, Callable[[PatientRecord], str]] = {}
+        self._entries: "OrderedDict[Tuple[str, str], Prefix]" = OrderedDict() # (name, fingerprint) -> prefix, LRU order
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"built": 0, "reused": 0}
+        self._build_times: Deque[float] = deque(maxlen=2048) # seconds per build, recent ones only
+
+    def register(self, name: str, build: Callable[[PatientRecord], str]) -> None:
+        self._builders[name] = build
+
+    def get(self, name: str, record: PatientRecord) -> Prefix:
+        key = (name, record_fingerprint(record))
+        with self._lock:
+            prefix = self._entries.get(key)
+            if prefix is not None:
+                self._entries.move_to_end(key)
+                self.stats["reused"] += 1
+                return prefix
+
+        start = time.perf_counter()
+        text = self._builders[name](record)
+        prefix = Prefix(text, count_tokens(text))
+        with self._lock:
+            self._build_times.append(time.perf_counter() - start)
+            self.stats["built"] += 1
+            self._entries[key] = prefix
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return prefix
+
+    def warm(self, record: PatientRecord) -> None:
+        """ builds every registered prefix for record, called at identity confirmation.
+        """
+        for name in list(self._builders):
+            self.get(name, record)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def build_ms(self, pct: float) -> float:
+        """ returns the pct percentile of recent prefix build times in milliseconds.
+        """
+        values = sorted(self._build_times)
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))] * 1000
+
+
+prefixes = PromptPrefixCache(max_entries=int(os.getenv("PROMPT_PREFIX_CACHE_SIZE", "4096")))
@@ -1,9 +1,15 @@
 import os
+import time
 # from langchain_groq import ChatGroq
 # from langchain_core.messages import HumanMessage, SystemMessage
-from app.tools.patient_db import find_patient_by_name 
+from app.tools.patient_db import find_patient_by_name, find_patient_by_name_and_date, is_exact_patient_name
 from typing import List,Dict,Optional,Any,Tuple
-from app.llm.groq_client import call_groq_chat
+from app.llm.groq_client import call_groq_chat, call_groq_chat_async
+from app.agents.keywords import match_keywords
+from app import tracing
+from app.agents import prompt_prefix
+from app.tools.context_builder import count_tokens
+from app.logging_setup import logger
 from dotenv import load_dotenv
 load_dotenv()
 State = Dict[str, Any]
@@ -15,32 +21,6 @@ State = Dict[str, Any]
 #   groq_api_key=os.getenv("GROQ_API_KEY")
 # )
 
-MEDICAL_KEYWORDS = [ #Initializing some medical keywords
-   "pain", "swelling", "shortness of breath", "breathless",
-    "bp", "blood pressure", "fever", "vomiting", "nausea",
-    "chest pain", "palpitations", "urine", "urination",
-    "weight gain", "weight loss", "dizzy", "dizziness",
-    "headache", "cramps", "edema", "dialysis",
-    "emergency", "urgent", "bleeding",
-    "kidney", "renal", "ckd", "creatinine", "gfr",
-    "stone", "stones",
-    "low potassium", "low pottasium", "potassium", "pottasium",
-    "low sodium", "low salt", "fluid restriction", "phosphorus", "phosphate",
-	"protein restriction"
-]
-
-MEDICAL_TOPIC_WORDS = [ #Initializing some medical topic words
-    "symptom", "symptoms", "symptomps", 
-    "cause", "causes",
-    "treatment", "treatments",
-    "risk", "risks",
-    "complication", "complications",
-    "diet", "uses", "use", "effect", "effects",
-    "side effect", "side effects",
-    "benefit", "benefits",
-    "management", "manage", "control",
-]
-
 def _extract_name(message: str) -> Optional[str]:
     """ Extract patient name from a simple intro sentence.
     """
@@ -61,37 +41,22 @@ def _extract_name(message: str) -> Optional[str]:
     return None
   
 
-def _is_medical_query(message: str) -> bool:
+def is_medical_query(message: str) -> bool:
     """
     A function for checking wether it is medical_query or not by checking medical keywords and topics
     """
-    text = message.strip().lower()
-
-
-    if "medical" in text or "symptom" in text or "symptomps" in text:
-        return True
-
-    for keyword in MEDICAL_KEYWORDS:
-        if keyword in text:
-            return True
-
-    has_kidney_concept = any(
-        kw in text
-        for kw in ["kidney", "renal", "ckd", "stone", "stones", "creatinine", "gfr"]
-    )
-    has_topic = any(tw in text for tw in MEDICAL_TOPIC_WORDS)
+    found = match_keywords(message)
 
-    if has_kidney_concept and has_topic:
+    if "medical_trigger" in found or "medical" in found:
         return True
 
-
-    return False
+    return "kidney" in found and "topic" in found #kidney concept together with a medical topic
 
   
-def receptionist_agent(message: str, state: State) -> Tuple[str, State, bool]:
+def receptionist_step(message: str, state: State) -> Tuple[Optional[str], State, bool]:
 	"""
-	Handle human messages at the receptionist level.
-	
+	Handle every receptionist case that does not need the LLM.
+	Returns a None reply when the message should be answered by the LLM.
 	"""
     
 	patient_name = state.get("patient_name") #retriving patient details from state
@@ -102,17 +67,24 @@ def receptionist_agent(message: str, state: State) -> Tuple[str, State, bool]:
 	if state.get("awaiting_patient_disambiguation"): 
 		#checking if there are two similar names and asking for discharge date if it contains ambiguity
 		date_text = message.strip()
-		candidates: List[Dict[str,Any]] = state.get("candidate_patients", []) #initializing candidates which should contain list of dictionaries
-		match: Optional[Dict[str,Any]] = None
-		for p in candidates:
-			if p.get("discharge_date") == date_text:#checking for matching discharge date 
-				match = p
-				break
+		#looking up the candidates discharged on that date in the discharge_date index
+		matches = find_patient_by_name_and_date(state.get("candidate_name", ""), date_text)
+		if len(matches) > 1: #a partial name can still fit several patients discharged that day, confirming any of them could show the wrong record
+			state["awaiting_patient_disambiguation"] = False
+			state.pop("candidate_name", None)
+			reply = (
+				"More than one patient discharged on that date matches that name. "
+				"Please tell me your full name exactly as shown on your discharge summary, "
+				"for example: My name is Jane Doe."
+			)
+			return reply, state, False
+		match: Optional[Dict[str,Any]] = matches[0] if matches else None
 		if match:
 			state["patient_name"] = match.get("patient_name")
 			state["patient_record"] = match
 			state["awaiting_patient_disambiguation"] = False #changing the value of ambiguity to false
-			state["candidate_patients"] = []
+			state.pop("candidate_name", None)
+			prompt_prefix.prefixes.warm(match) # the patient's prompt prefixes are built once, here
 			
 			reply = ( #reply for matching patient
 				"Thank you, I’ve confirmed your identity.\n\n"
@@ -144,9 +116,18 @@ def receptionist_agent(message: str, state: State) -> Tuple[str, State, bool]:
 				)
 				return reply, state, False
 
+			if not is_exact_patient_name(extracted): #a partial or misspelt name only confirms the identity together with the discharge date
+				state["awaiting_patient_disambiguation"] = True
+				state["candidate_name"] = extracted
+				reply = ( #nothing from the record is shown until the date matches too
+					"I couldn’t find that exact name in our records. "
+					"Please tell me your discharge date so I can confirm your identity."
+				)
+				return reply, state, False
+
 			if len(matches)>1: #if there are more than 1 matches 
 				state["awaiting_patient_disambiguation"] = True #convert ambiguity_state to true
-				state["candidate_patients"] = matches
+				state["candidate_name"] = extracted #the records are looked up again with the discharge date
 				reply = ( #replying if there is an ambiguity
 					 f"There are multiple patients named '{extracted}' in our records. "
                     "Please tell me your discharge date so I can confirm your identity."
@@ -156,6 +137,7 @@ def receptionist_agent(message: str, state: State) -> Tuple[str, State, bool]:
 			record = matches[0] # retrieving patient details if there is only one record
 			state["patient_name"] = record.get("patient_name")
 			state["patient_record"] = record
+			prompt_prefix.prefixes.warm(record)
    
 			reply = ( # replying with patient details
 				f"{record.get('patient_name')}! I see you were discharged on "
@@ -170,7 +152,7 @@ def receptionist_agent(message: str, state: State) -> Tuple[str, State, bool]:
 		)
 		return reply, state, False
 
-	if _is_medical_query(message): #checking if the query is medical or not
+	if is_medical_query(message): #checking if the query is medical or not
 		# Forward to medical agent
 		reply = (
 			"Thanks for telling me that. Since this sounds like a medical concern, "
@@ -181,40 +163,104 @@ def receptionist_agent(message: str, state: State) -> Tuple[str, State, bool]:
 		return reply, state, True
 
 	# Non-medical query – respond using Groq LLM
+	return None, state, False
+
+
+RECEPTIONIST_LLM_KWARGS: Dict[str, Any] = { # generation settings for receptionist replies
+	"model": "openai/gpt-oss-20b",
+	"temperature": 0.2,
+	"max_tokens": 300,
+}
+
+
+RECEPTIONIST_SYSTEM_PROMPT = ( # describing system prompt
+	"You are a hospital receptionist for recently discharged patients.\n"
+	"- You have access to basic discharge details (diagnosis, discharge date, "
+	"  medications, diet advice, follow-up plan).\n"
+	"- You handle ONLY non-medical tasks: appointments, transport, documents, "
+	"  contact details, simple check-in questions.\n"
+	"- You MUST NOT give medical advice, interpret symptoms, or explain diseases.\n"
+	"- If the message sounds clinical (symptoms, diagnosis, causes, treatment, diet "
+	"  for a disease), respond briefly that the clinical assistant will handle the "
+	"  medical details, and then ask if they need any non-medical help.\n"
+	"- Keep replies short (2–4 sentences) and polite.\n"
+	"- Do not greet repeatedly; greet the patient only once at the start of the visit."
+)
+
+
+def _receptionist_prefix(patient_record: Optional[Dict[str, Any]]) -> str:
+	"""
+	The system prompt followed by the discharge summary, the part of the prompt that is the
+	same on every turn of the patient's visit.
+	"""
+	if not patient_record:
+		return RECEPTIONIST_SYSTEM_PROMPT
 	summary = ( #creating summary by converting patient details into a single string
-            f"Patient name: {patient_record.get('patient_name')}\n"
-            f"Diagnosis: {patient_record.get('primary_diagnosis')}\n"
-            f"Discharge date: {patient_record.get('discharge_date')}\n"
-            f"Medications: {patient_record.get('medications')}\n"
-            f"Dietary restrictions: {patient_record.get('dietary_restrictions')}\n"
-            f"Follow-up: {patient_record.get('follow_up')}\n"
-    )
-	system_prompt = ( # describing system prompt
-         "You are a hospital receptionist for recently discharged patients.\n"
-        "- You have access to basic discharge details (diagnosis, discharge date, "
-        "  medications, diet advice, follow-up plan).\n"
-        "- You handle ONLY non-medical tasks: appointments, transport, documents, "
-        "  contact details, simple check-in questions.\n"
-        "- You MUST NOT give medical advice, interpret symptoms, or explain diseases.\n"
-        "- If the message sounds clinical (symptoms, diagnosis, causes, treatment, diet "
-        "  for a disease), respond briefly that the clinical assistant will handle the "
-        "  medical details, and then ask if they need any non-medical help.\n"
-        "- Keep replies short (2–4 sentences) and polite.\n"
-        "- Do not greet repeatedly; greet the patient only once at the start of the visit."
-    )
+		f"Patient name: {patient_record.get('patient_name')}\n"
+		f"Diagnosis: {patient_record.get('primary_diagnosis')}\n"
+		f"Discharge date: {patient_record.get('discharge_date')}\n"
+		f"Medications: {patient_record.get('medications')}\n"
+		f"Dietary restrictions: {patient_record.get('dietary_restrictions')}\n"
+		f"Follow-up: {patient_record.get('follow_up')}\n"
+	)
+	return f"{RECEPTIONIST_SYSTEM_PROMPT}\n\nDischarge summary (for context):\n{summary}"
+
+
+prompt_prefix.prefixes.register("receptionist", _receptionist_prefix)
 
+
+def receptionist_prompts(message: str, patient_record: Dict[str, Any]) -> Tuple[str, str]:
+	"""
+	Build the (system_prompt, user_prompt) pair for a non-medical receptionist reply.
+	The system prompt is the patient's cached prefix, only the user prompt changes per turn.
+	"""
+	started = time.perf_counter()
+	prefix = prompt_prefix.prefixes.get("receptionist", patient_record)
 	user_prompt = ( # describing user prompt
-        f"Discharge summary (for context):\n{summary}\n\n"
-        f"Patient message:\n{message}\n\n"
-        "Write a reply as the receptionist, following the rules above."
-    )
+		f"Patient message:\n{message}\n\n"
+		"Write a reply as the receptionist, following the rules above."
+	)
+	logger.info(
+		"PROMPT agent=receptionist prompt_tokens=%d prefix_tokens=%d build_ms=%.2f",
+		prefix.tokens + count_tokens(user_prompt), prefix.tokens, (time.perf_counter() - started) * 1000,
+	)
+	return prefix.text, user_prompt
+
+
+@tracing.traced("receptionist")
+def receptionist_agent(message: str, state: State) -> Tuple[str, State, bool]:
+	"""
+	Handle human messages at the receptionist level.
+	
+	"""
+	reply, state, handoff = receptionist_step(message, state)
+	if reply is not None:
+		return reply, state, handoff
 
+	system_prompt, user_prompt = receptionist_prompts(message, state["patient_record"])
 	response = call_groq_chat( # calling llm which is hosted in groq
         system_prompt=system_prompt,
         user_prompt=user_prompt,
-        model="openai/gpt-oss-20b",
-        temperature=0.2,
-        max_tokens=300,
+        **RECEPTIONIST_LLM_KWARGS
+    )
+
+	return response, state, False
+
+
+@tracing.traced("receptionist")
+async def receptionist_agent_async(message: str, state: State) -> Tuple[str, State, bool]:
+	"""
+	Async version of receptionist_agent, the LLM call does not block the event loop.
+	"""
+	reply, state, handoff = receptionist_step(message, state)
+	if reply is not None:
+		return reply, state, handoff
+
+	system_prompt, user_prompt = receptionist_prompts(message, state["patient_record"])
+	response = await call_groq_chat_async(
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+        **RECEPTIONIST_LLM_KWARGS
     )
 
 	return response, state, False
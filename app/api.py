@@ -1,15 +1,82 @@
-from typing import Any, Dict
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 
-from app.agents.orchestrator import handle_message
+from app import metrics
+from app.agents.history import HISTORY_SUMMARY, adopt_summary, needs_summary, summarise_session
+from app.agents.orchestrator import handle_message_async, stream_message_async, warm_up
+from app.concurrency import LAZY_RESOURCES, run_blocking
+from app.llm.gateway import LLMUnavailableError
+from app.logging_setup import logger
+from app.session_store import SessionState, SessionStore, make_session_store
 
-SessionState = Dict[str, Any]
-SESSIONS: Dict[str, SessionState] = {}
+SESSIONS: SessionStore = make_session_store() # SESSION_STORE=memory (per worker) or sqlite (shared by workers)
 
-app = FastAPI(title="Nephrology Assistant API") # instance of fastApi
+LLM_UNAVAILABLE_REPLY = ( # sent instead of an error when the LLM can't be reached after retries
+    "I'm sorry, I'm having trouble reaching our assistant service right now. "
+    "Please try again in a minute. If this is urgent, contact the hospital directly."
+)
+
+
+_background_tasks: set = set() # referenced until done so they aren't garbage collected mid-run
+
+
+def _save_session(session_id: str, state: SessionState) -> None:
+    """
+    Store the state after a reply, keeping a rolling summary saved by the background
+    summariser since the request loaded it. Blocking, run it with run_blocking.
+    """
+    if HISTORY_SUMMARY:
+        adopt_summary(state, SESSIONS.get(session_id))
+    SESSIONS.set(session_id, state)
+
+
+def _summarise_later(session_id: str, state: SessionState) -> None:
+    """
+    Fold the session's older messages into its rolling summary once the reply has been sent.
+    """
+    if needs_summary(state):
+        task = asyncio.create_task(summarise_session(SESSIONS, session_id))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+
+async def _warm_up_in_background() -> None:
+    try:
+        await run_blocking(warm_up)
+    except Exception:
+        logger.exception("WARMUP failed, resources will load on first use")
+
+
+async def _flush_metrics_periodically() -> None:
+    while True: # so /metrics on another worker sees this one's numbers
+        await asyncio.sleep(metrics.METRICS_FLUSH_SECONDS)
+        try:
+            await run_blocking(metrics.flush)
+        except Exception:
+            logger.exception("METRICS flush failed")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # load models while already accepting requests, /ready reports when it is done
+    if os.getenv("WARM_UP", "1") == "1":
+        app.state.warm_up_task = asyncio.create_task(_warm_up_in_background())
+    metrics.register_app_metrics(SESSIONS)
+    if metrics.shared is not None:
+        app.state.metrics_task = asyncio.create_task(_flush_metrics_periodically())
+    yield
+
+
+app = FastAPI(title="Nephrology Assistant API", lifespan=lifespan) # instance of fastApi
 
 
 app.add_middleware(
@@ -21,6 +88,51 @@ app.add_middleware(
 )
 
 
+class RequestMetricsMiddleware:
+    """
+    Counts requests and observes their latency once the last body chunk is sent, so a
+    streamed reply is timed to its end rather than to its headers. Pure ASGI for that
+    reason: BaseHTTPMiddleware returns as soon as the response starts.
+    """
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+        recorded = False
+
+        def record() -> None:
+            nonlocal recorded
+            if recorded:
+                return
+            recorded = True
+            route = scope.get("route")
+            endpoint = getattr(route, "path", "other") # the route template, not the raw path, to keep label values few
+            metrics.http_requests.inc(endpoint, str(status))
+            metrics.http_latency.observe(time.perf_counter() - start, endpoint)
+
+        async def send_and_record(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                record()
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            record() # errors and client disconnects before the last chunk
+
+
+app.add_middleware(RequestMetricsMiddleware)
+
+
 class ChatRequest(BaseModel): #pydantic base model
     session_id: str
     message: str
@@ -37,23 +149,74 @@ async def health_check():
     return {"status": "ok", "message": "Nephrology assistant backend is running"}
 
 
+@app.get("/ready") #readiness check, unlike "/" it fails until models are loaded
+async def readiness_check() -> JSONResponse:
+    resources = {name: r.loaded for name, r in LAZY_RESOURCES.items()}
+    ready = all(r.loaded for r in LAZY_RESOURCES.values() if r.required)
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "resources": resources},
+    )
+
+
+@app.get("/metrics") #prometheus scrape target
+async def metrics_endpoint() -> PlainTextResponse:
+    body = await run_blocking(metrics.render) # collectors may read the SQLite session store
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
 @app.post("/chat", response_model=ChatResponse) #post request
 async def chat_endpoint(payload: ChatRequest) -> ChatResponse:
     """
     Main chat endpoint.
     The frontend must keep using the same session_id for one conversation.
     """
-    state: SessionState = SESSIONS.get(payload.session_id, {})
+    state: SessionState = await run_blocking(SESSIONS.get, payload.session_id) or {} # the SQLite store does disk I/O
+    state.setdefault("session_id", payload.session_id) # so router logs carry the session id
 
-    reply, new_state = handle_message(payload.message, state) # calling handle_message function in orchestrator
+    start = time.perf_counter()
+    try:
+        reply, new_state = await handle_message_async(payload.message, state) # awaiting the orchestrator so slow LLM calls don't block other chats
+    except LLMUnavailableError:
+        logger.exception("CHAT session_id=%s LLM unavailable", payload.session_id)
+        metrics.llm_errors.inc("/chat")
+        return ChatResponse(session_id=payload.session_id, reply=LLM_UNAVAILABLE_REPLY, agent=state.get("mode", "receptionist"))
 
     # detect which agent responded 
     agent_name = new_state.get("mode", "receptionist")
+    metrics.agent_latency.observe(time.perf_counter() - start, agent_name)
 
-    SESSIONS[payload.session_id] = new_state
+    await run_blocking(_save_session, payload.session_id, new_state)
+    _summarise_later(payload.session_id, new_state)
 
     return ChatResponse(
         session_id=payload.session_id,
         reply=reply,
         agent=agent_name,
     )
+
+
+@app.post("/chat/stream") #streaming post request
+async def chat_stream_endpoint(payload: ChatRequest) -> StreamingResponse:
+    """
+    Streaming chat endpoint, replies are sent as newline-delimited JSON events
+    (agent, delta..., done) as soon as the model produces them.
+    """
+    state: SessionState = await run_blocking(SESSIONS.get, payload.session_id) or {}
+    state.setdefault("session_id", payload.session_id)
+
+    async def events() -> AsyncIterator[str]:
+        start = time.perf_counter()
+        try:
+            async for event in stream_message_async(payload.message, state):
+                yield json.dumps(event) + "\n"
+        except LLMUnavailableError:
+            logger.exception("STREAM session_id=%s LLM unavailable", payload.session_id)
+            metrics.llm_errors.inc("/chat/stream")
+            yield json.dumps({"type": "done", "agent": state.get("mode", "receptionist"), "reply": LLM_UNAVAILABLE_REPLY}) + "\n"
+            return
+        metrics.agent_latency.observe(time.perf_counter() - start, state.get("mode", "receptionist"))
+        await run_blocking(_save_session, payload.session_id, state) # save once the reply is complete
+        _summarise_later(payload.session_id, state)
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
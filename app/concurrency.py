@@ -0,0 +1,57 @@
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+# bounded pool for blocking work (embedding, chroma search, web search) so it never runs on the event loop
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "4"))
+executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking function on the shared executor and await its result.
+    It runs in a copy of the caller's context, so trace spans started in it nest under the caller's."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(contextvars.copy_context().run, func, *args, **kwargs))
+
+
+class Lazy(Generic[T]):
+    """
+    A singleton built on first use (thread-safe). Every instance is registered in
+    LAZY_RESOURCES so the API can report which ones are loaded.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], T], required: bool = True):
+        self.name = name
+        self.required = required # the app is not ready until required resources are loaded
+        self._factory = factory
+        self._value: Optional[T] = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        LAZY_RESOURCES[name] = self
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def get(self) -> T:
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._value = self._factory()
+                    self._loaded = True
+        return self._value
+
+    def set(self, value: T) -> None:
+        """Use value instead of building it (e.g. the benchmarks' stand-in embedding model)."""
+        with self._lock:
+            self._value = value
+            self._loaded = True
+
+
+LAZY_RESOURCES: Dict[str, Lazy] = {}
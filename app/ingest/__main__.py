@@ -0,0 +1,43 @@
+import argparse
+import json
+
+from app.ingest.pipeline import DEFAULT_PERSIST_DIRECTORY, Ingestor, open_collection, rebuild_bm25
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m app.ingest",
+        description="Build or incrementally update the Chroma store the clinical agent reads from a PDF textbook.",
+    )
+    parser.add_argument("pdf", nargs="?", help="path to the textbook PDF")
+    parser.add_argument("--source", default=None, help="source name stored on every chunk (default: file name)")
+    parser.add_argument("--persist-dir", default=DEFAULT_PERSIST_DIRECTORY)
+    parser.add_argument("--workers", type=int, default=2, help="embedding processes, 0 embeds in this process")
+    parser.add_argument("--batch-size", type=int, default=64, help="chunks per embedding batch")
+    parser.add_argument("--chunk-size", type=int, default=1200)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--bm25-only", action="store_true", help="only rebuild the keyword index of an existing store (e.g. one built by the notebook)")
+    args = parser.parse_args()
+
+    if args.bm25_only:
+        print(json.dumps(rebuild_bm25(open_collection(args.persist_dir), args.persist_dir), indent=2))
+        return
+    if args.pdf is None:
+        parser.error("the pdf argument is required unless --bm25-only is given")
+
+    ingestor = Ingestor(
+        persist_directory=args.persist_dir,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+    )
+    try:
+        stats = ingestor.ingest(args.pdf, source=args.source)
+    finally:
+        ingestor.close()
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
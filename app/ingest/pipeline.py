@@ -0,0 +1,240 @@
+import bisect
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import chromadb
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from pypdf import PdfReader
+
+from app.logging_setup import logger
+from app.tools.hybrid_retriever import BM25_FILENAME, build_from_collection
+from app.tools.topics import main_topic
+
+DEFAULT_PERSIST_DIRECTORY = "chroma_db_v2/clinical-nephrology_db" # what app.agents.clinical opens
+COLLECTION_NAME = "langchain" # langchain_chroma's default collection name
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+Chunk = Tuple[str, str, Dict[str, Any]] # (id, text, metadata)
+
+_worker_model = None # sentence-transformers model of this embedding process
+
+
+def _init_worker(model_name: str) -> None:
+    global _worker_model
+    from sentence_transformers import SentenceTransformer
+    _worker_model = SentenceTransformer(model_name)
+
+
+def _embed_batch(texts: List[str]) -> List[List[float]]:
+    return _worker_model.encode(texts, batch_size=len(texts)).tolist()
+
+
+def iter_pages(pdf_path: str) -> Iterator[Tuple[int, str]]:
+    """ yields (page number, text) one page at a time, page numbers start at 0 like the original notebook.
+    """
+    reader = PdfReader(pdf_path)
+    for page_num, page in enumerate(reader.pages):
+        yield page_num, page.extract_text() or ""
+
+
+def read_outline(pdf_path: str) -> List[Tuple[int, str]]:
+    """ (first page, heading) of every section and chapter bookmark of the PDF, sorted by page.
+    Chapters nested in a section are headed "Section › Chapter". Empty if the PDF has no bookmarks.
+    """
+    reader = PdfReader(pdf_path)
+    headings: List[Tuple[int, str]] = []
+
+    def walk(items: List[Any], parent: str, depth: int) -> None:
+        last = parent
+        for item in items:
+            if isinstance(item, list): # the children of the bookmark before it
+                if depth < 1:
+                    walk(item, last, depth + 1)
+                continue
+            try:
+                page = reader.get_destination_page_number(item)
+            except Exception: # a bookmark that points nowhere
+                continue
+            last = f"{parent} › {item.title}" if parent else item.title
+            headings.append((page, last))
+
+    walk(reader.outline, "", 0)
+    return sorted(headings, key=lambda h: h[0])
+
+
+def heading_for(outline: List[Tuple[int, str]], page_num: int) -> str:
+    i = bisect.bisect_right([page for page, _ in outline], page_num)
+    return outline[i - 1][1] if i else ""
+
+
+def page_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def existing_pages(collection: Any, source: str, page_size: int = 5000) -> Dict[int, Dict[str, Any]]:
+    """ returns {page: {"hash": page_hash or None, "ids": [...]}} for the chunks of source already in the store.
+    Chunks written without page_hash (e.g. by the notebook) get hash None so they are replaced.
+    """
+    pages: Dict[int, Dict[str, Any]] = {}
+    offset = 0
+    while True:
+        got = collection.get(where={"source": source}, include=["metadatas"], limit=page_size, offset=offset)
+        for chunk_id, meta in zip(got["ids"], got["metadatas"]):
+            entry = pages.setdefault(int(meta.get("page", -1)), {"hash": meta.get("page_hash"), "ids": [], "tagged": True})
+            entry["ids"].append(chunk_id)
+            entry["tagged"] = entry["tagged"] and "topic" in meta # stored before chunks had chapter/topic metadata
+            if entry["hash"] != meta.get("page_hash"): # mixed old and new chunks, treat the page as changed
+                entry["hash"] = None
+        if len(got["ids"]) < page_size:
+            return pages
+        offset += page_size
+
+
+def open_collection(persist_directory: str = DEFAULT_PERSIST_DIRECTORY) -> Any:
+    return chromadb.PersistentClient(path=persist_directory).get_or_create_collection(COLLECTION_NAME)
+
+
+def rebuild_bm25(collection: Any, persist_directory: str) -> Dict[str, Any]:
+    """ rebuilds the keyword (BM25) index the hybrid retriever reads next to the collection.
+    """
+    start = time.perf_counter()
+    index = build_from_collection(collection, persist_directory)
+    stats = {"bm25_chunks": len(index), "bm25_terms": len(index.postings), "bm25_seconds": round(time.perf_counter() - start, 2)}
+    logger.info("INGEST bm25 %s", stats)
+    return stats
+
+
+def page_tags(heading: str, text: str) -> Dict[str, str]:
+    """ the chapter and topic metadata of a page's chunks, which retrieval can filter on.
+    """
+    return {"chapter": heading, "topic": main_topic(heading, text)}
+
+
+class Ingestor:
+    """
+    Streams a PDF into the Chroma collection page by page. Only pages whose content hash
+    changed since the last run are chunked, embedded (in batches across a process pool) and upserted.
+    At most two windows of flush_chunks chunks (one being embedded, one being read) are held in memory.
+    """
+
+    def __init__(self, persist_directory: str = DEFAULT_PERSIST_DIRECTORY, workers: int = 2, batch_size: int = 64, chunk_size: int = 1200, chunk_overlap: int = 200):
+        self.persist_directory = persist_directory
+        self.collection = open_collection(persist_directory)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.flush_chunks = batch_size * max(1, workers) * 2
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separators=["\n\n", "\n", " ", ""],
+        )
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self._inflight: Optional[Tuple[List[Chunk], List[Any]]] = None # window being embedded on the pool
+        if workers > 0:
+            self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(EMBEDDING_MODEL_NAME,))
+        else:
+            _init_worker(EMBEDDING_MODEL_NAME) # embed in this process
+        self.stats: Dict[str, Any] = {}
+
+    def chunk_page(self, source: str, page_num: int, text: str, heading: str = "") -> List[Chunk]:
+        digest = page_hash(text)
+        tags = page_tags(heading, text)
+        return [
+            (
+                f"{source}:{page_num}:{chunk_index}",
+                chunk,
+                {"source": source, "page": page_num, "chunk_index": chunk_index, "page_hash": digest, **tags},
+            )
+            for chunk_index, chunk in enumerate(self.splitter.split_text(text))
+        ]
+
+    def _tag(self, ids: List[str], tags: Dict[str, str]) -> None:
+        """ adds chapter/topic metadata to stored chunks of an unchanged page, without re-embedding them.
+        """
+        got = self.collection.get(ids=ids, include=["metadatas"])
+        self.collection.update(ids=got["ids"], metadatas=[{**meta, **tags} for meta in got["metadatas"]])
+        self.stats["chunks_tagged"] += len(got["ids"])
+
+    def _flush(self, chunks: List[Chunk]) -> None:
+        """ starts embedding chunks on the pool and upserts the previously started window,
+        so reading the next pages overlaps with embedding this one.
+        """
+        self._finish_inflight()
+        if not chunks:
+            return
+        texts = [text for _, text, _ in chunks]
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if self.pool is not None:
+            self._inflight = (chunks, [self.pool.submit(_embed_batch, b) for b in batches])
+        else:
+            self._upsert(chunks, [_embed_batch(b) for b in batches])
+
+    def _finish_inflight(self) -> None:
+        if self._inflight is None:
+            return
+        chunks, futures = self._inflight
+        self._inflight = None
+        self._upsert(chunks, [f.result() for f in futures])
+
+    def _upsert(self, chunks: List[Chunk], embedded: List[List[List[float]]]) -> None:
+        self.collection.upsert(
+            ids=[chunk_id for chunk_id, _, _ in chunks],
+            embeddings=[vec for batch in embedded for vec in batch],
+            documents=[text for _, text, _ in chunks],
+            metadatas=[meta for _, _, meta in chunks],
+        )
+        self.stats["chunks_embedded"] += len(chunks)
+
+    def ingest(self, pdf_path: str, source: Optional[str] = None) -> Dict[str, Any]:
+        """ ingests pdf_path and returns throughput stats.
+        """
+        source = source or os.path.splitext(os.path.basename(pdf_path))[0]
+        start = time.perf_counter()
+        self.stats = {"source": source, "pages": 0, "pages_changed": 0, "chunks_embedded": 0, "chunks_deleted": 0, "chunks_tagged": 0}
+
+        outline = read_outline(pdf_path)
+        known = existing_pages(self.collection, source)
+        pending: List[Chunk] = []
+        for page_num, text in iter_pages(pdf_path):
+            self.stats["pages"] += 1
+            heading = heading_for(outline, page_num)
+            old = known.pop(page_num, None)
+            if old is not None and old["hash"] == page_hash(text):
+                if not old["tagged"]:
+                    self._tag(old["ids"], page_tags(heading, text))
+                continue # unchanged since the last run
+
+            self.stats["pages_changed"] += 1
+            if old is not None: # the page may now split into fewer chunks, drop the old ones first
+                self.collection.delete(ids=old["ids"])
+                self.stats["chunks_deleted"] += len(old["ids"])
+            pending.extend(self.chunk_page(source, page_num, text, heading))
+            if len(pending) >= self.flush_chunks:
+                self._flush(pending)
+                pending = []
+
+            if self.stats["pages"] % 100 == 0:
+                logger.info("INGEST source=%s pages=%d chunks_embedded=%d", source, self.stats["pages"], self.stats["chunks_embedded"])
+        self._flush(pending)
+        self._finish_inflight()
+
+        for old in known.values(): # pages that no longer exist in the pdf
+            self.collection.delete(ids=old["ids"])
+            self.stats["chunks_deleted"] += len(old["ids"])
+
+        if self.stats["pages_changed"] or self.stats["chunks_deleted"] or self.stats["chunks_tagged"] or not os.path.exists(os.path.join(self.persist_directory, BM25_FILENAME)):
+            self.stats.update(rebuild_bm25(self.collection, self.persist_directory))
+
+        elapsed = time.perf_counter() - start
+        self.stats["seconds"] = round(elapsed, 2)
+        self.stats["pages_per_s"] = round(self.stats["pages"] / elapsed, 2) if elapsed else 0.0
+        self.stats["chunks_per_s"] = round(self.stats["chunks_embedded"] / elapsed, 2) if elapsed else 0.0
+        logger.info("INGEST done %s", self.stats)
+        return self.stats
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown()
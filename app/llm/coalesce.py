@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class LLMCoalescer:
+    """
+    Single-flight for identical LLM calls: while a call for a key is in flight, callers
+    with the same key wait for its result instead of making their own. Results of
+    cacheable (temperature 0) calls are also kept for cache_ttl seconds, so identical
+    requests shortly after still don't reach the API.
+    Sync and async callers are coalesced separately.
+    """
+
+    def __init__(self, cache_ttl: float = 30, cache_size: int = 1024):
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict() # key -> (result, stored at), LRU order
+        self._inflight: Dict[Hashable, Future] = {}
+        self._async_inflight: Dict[Hashable, "asyncio.Future[Any]"] = {}
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"calls": 0, "coalesced": 0, "cache_hits": 0}
+
+    def _cached(self, key: Hashable) -> Optional[Tuple[Any]]:
+        """ returns (result,) if key is cached and fresh, else None. Call with the lock held.
+        """
+        item = self._cache.get(key)
+        if item is None:
+            return None
+        if time.monotonic() - item[1] > self.cache_ttl:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        self.stats["cache_hits"] += 1
+        return (item[0],)
+
+    def _store(self, key: Hashable, result: Any) -> None:
+        with self._lock:
+            self._cache[key] = (result, time.monotonic())
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def call(self, key: Hashable, func: Callable[[], Any], cacheable: bool = False) -> Any:
+        with self._lock:
+            self.stats["calls"] += 1
+            if cacheable and self.cache_ttl > 0:
+                hit = self._cached(key)
+                if hit is not None:
+                    return hit[0]
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            if cacheable and self.cache_ttl > 0:
+                self._store(key, result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def call_async(self, key: Hashable, func: Callable[[], Awaitable[Any]], cacheable: bool = False) -> Any:
+        with self._lock:
+            self.stats["calls"] += 1
+            if cacheable and self.cache_ttl > 0:
+                hit = self._cached(key)
+                if hit is not None:
+                    return hit[0]
+            task = self._async_inflight.get(key)
+            if task is None:
+                task = self._async_inflight[key] = asyncio.ensure_future(func())
+                task.add_done_callback(lambda t: self._finish_async(key, t, cacheable))
+            else:
+                self.stats["coalesced"] += 1
+        # shielded: a waiter being cancelled (e.g. discarded speculation) must not cancel the call for the others
+        return await asyncio.shield(task)
+
+    def _finish_async(self, key: Hashable, task: "asyncio.Future[Any]", cacheable: bool) -> None:
+        with self._lock:
+            self._async_inflight.pop(key, None)
+        if cacheable and self.cache_ttl > 0 and not task.cancelled() and task.exception() is None:
+            self._store(key, task.result())
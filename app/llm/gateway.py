@@ -0,0 +1,340 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterable, Iterator, Optional, Tuple, TypeVar
+
+from app.logging_setup import logger
+
+T = TypeVar("T")
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMUnavailableError(RuntimeError):
+    """The LLM could not be reached: retries ran out or the circuit breaker is open."""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    pass
+
+
+class TokenBucket:
+    """
+    Refills rate tokens per second up to capacity. acquire() takes cost tokens, waiting
+    for them if needed, and returns how long it waited. A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, cost: float) -> float:
+        """ takes cost tokens now, possibly going negative, and returns the wait until they exist.
+        Reserving up front keeps waiters first come, first served.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= min(cost, self.capacity) # a call larger than the bucket waits for a full one
+            return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self, cost: float = 1) -> float:
+        if self.rate <= 0:
+            return 0.0
+        wait = self._reserve(cost)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, cost: float = 1) -> float:
+        if self.rate <= 0:
+            return 0.0
+        wait = self._reserve(cost)
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures and rejects calls for reset_seconds,
+    then lets one trial call through (half-open): success closes it, failure opens it again.
+    A trial that ends without an outcome (cancelled) or is still running after trial_seconds
+    hands the trial to the next caller, so a lost trial cannot keep the breaker half-open.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30, trial_seconds: float = 60):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.trial_seconds = trial_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if (self.state == "open" and now - self._opened_at >= self.reset_seconds) or (
+                self.state == "half_open" and now - self._trial_at >= self.trial_seconds
+            ):
+                self.state = "half_open" # this caller is the trial
+                self._trial_at = now
+                return True
+            return False
+
+    def abandon(self) -> None:
+        """ a call ended without success or failure (e.g. cancelled); if a trial was running, the next caller gets one.
+        """
+        with self._lock:
+            if self.state == "half_open":
+                self._trial_at = time.monotonic() - self.trial_seconds
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning("LLM circuit opened after %d failures", self._failures)
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+@lru_cache(maxsize=1)
+def _transport_errors() -> Tuple[type, ...]:
+    try:
+        from groq import APIConnectionError # also covers APITimeoutError
+    except ImportError:
+        return (TimeoutError, ConnectionError)
+    return (APIConnectionError, TimeoutError, ConnectionError)
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError: # an HTTP date, fall back to our own backoff
+        pass
+    return None
+
+
+def classify_error(exc: BaseException) -> Tuple[str, bool]:
+    """ returns (kind, retryable) for an exception raised by the SDK call.
+    """
+    status = getattr(exc, "status_code", None)
+    if status is not None:
+        return ("rate_limited" if status == 429 else f"http_{status}"), status in RETRY_STATUSES
+    if isinstance(exc, _transport_errors()):
+        return ("timeout" if "timeout" in type(exc).__name__.lower() else "connection"), True
+    return type(exc).__name__, False
+
+
+class LLMGateway:
+    """
+    Every Groq call goes through here:
+    - at most max_concurrency calls in flight, the rest queue,
+    - token buckets for the account's requests-per-minute and tokens-per-minute quota,
+    - retries of 429 / 5xx / timeouts with exponential backoff and full jitter, waiting
+      as long as Retry-After says when the server sends it (up to max_backoff),
+    - a circuit breaker so an outage fails fast instead of piling up retries.
+    Streams (stream / stream_async) keep their slot until they end.
+    Raises LLMUnavailableError when a call cannot be completed.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        max_retries: int = 3,
+        base_backoff: float = 0.5,
+        max_backoff: float = 20,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.requests = TokenBucket(requests_per_minute / 60, max(1, requests_per_minute / 6)) # bursts of up to 10 s of quota
+        self.tokens = TokenBucket(tokens_per_minute / 60, max(1, tokens_per_minute / 6))
+        self.breaker = breaker or CircuitBreaker()
+
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._async_slots: Optional[asyncio.Semaphore] = None # made on first use, in the event loop
+
+        self.stats: Dict[str, int] = {
+            "calls": 0, "attempts": 0, "retries": 0, "failures": 0, "circuit_rejections": 0,
+        }
+        self.errors: Dict[str, int] = {} # error kind -> count, every attempt
+        self._queue_waits: Deque[float] = deque(maxlen=2048) # seconds waiting for a slot and quota, recent calls only
+
+    def _backoff(self, attempt: int, exc: BaseException) -> float:
+        retry_after = _retry_after(exc)
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+
+    def _check_breaker(self) -> None:
+        self.stats["calls"] += 1
+        if not self.breaker.allow():
+            self.stats["circuit_rejections"] += 1
+            raise CircuitOpenError("LLM circuit breaker is open")
+
+    def _on_error(self, attempt: int, exc: BaseException) -> float:
+        """ records a failed attempt and returns the delay before the next one, re-raising
+        when the error is not retryable or the retries are used up.
+        """
+        kind, retryable = classify_error(exc)
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+        if not retryable or kind == "rate_limited":
+            self.breaker.record_success() # the service answered, it is up
+        else:
+            self.breaker.record_failure()
+        if not retryable: # e.g. a bad request, retrying won't help
+            self.stats["failures"] += 1
+            raise exc
+        if attempt >= self.max_retries or self.breaker.state == "open":
+            self.stats["failures"] += 1
+            raise LLMUnavailableError(f"LLM call failed after {attempt + 1} attempts ({kind})") from exc
+        self.stats["retries"] += 1
+        delay = self._backoff(attempt, exc)
+        logger.warning("LLM %s, retry %d in %.2f s", kind, attempt + 1, delay)
+        return delay
+
+    def _on_stream_error(self, exc: BaseException) -> LLMUnavailableError:
+        """ records a failure partway through a stream, which is not retried since part of
+        the reply was already sent, and returns the error to raise in its place.
+        """
+        kind, retryable = classify_error(exc)
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+        self.stats["failures"] += 1
+        if retryable and kind != "rate_limited":
+            self.breaker.record_failure()
+        logger.warning("LLM stream failed partway through (%s)", kind)
+        return LLMUnavailableError(f"LLM stream failed partway through ({kind})")
+
+    def _attempts(self, func: Callable[..., T], args: Any, kwargs: Dict[str, Any], cost: float, start: float) -> T:
+        """ the quota and retry loop of call, run while holding a slot.
+        """
+        self.requests.acquire()
+        self.tokens.acquire(cost)
+        self._queue_waits.append(time.perf_counter() - start)
+        attempt = 0
+        while True:
+            self.stats["attempts"] += 1
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                time.sleep(self._on_error(attempt, e))
+                attempt += 1
+                self.requests.acquire() # a retry is another request against the quota
+
+    async def _attempts_async(self, func: Callable[..., Awaitable[T]], args: Any, kwargs: Dict[str, Any], cost: float, start: float) -> T:
+        await self.requests.acquire_async()
+        await self.tokens.acquire_async(cost)
+        self._queue_waits.append(time.perf_counter() - start)
+        attempt = 0
+        while True:
+            self.stats["attempts"] += 1
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                await asyncio.sleep(self._on_error(attempt, e))
+                attempt += 1
+                await self.requests.acquire_async()
+
+    def _slots_async(self) -> asyncio.Semaphore:
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.max_concurrency)
+        return self._async_slots
+
+    def call(self, func: Callable[..., T], *args: Any, cost: float = 1, **kwargs: Any) -> T:
+        """ runs func(*args, **kwargs) under the limits; cost is its estimated token usage.
+        """
+        self._check_breaker()
+        start = time.perf_counter()
+        try:
+            with self._slots:
+                result = self._attempts(func, args, kwargs, cost, start)
+            self.breaker.record_success()
+            return result
+        except BaseException: # errors are recorded by _on_error, this is for interrupts
+            self.breaker.abandon()
+            raise
+
+    async def call_async(self, func: Callable[..., Awaitable[T]], *args: Any, cost: float = 1, **kwargs: Any) -> T:
+        """ async version of call, func is a coroutine function.
+        """
+        self._check_breaker()
+        start = time.perf_counter()
+        try:
+            async with self._slots_async():
+                result = await self._attempts_async(func, args, kwargs, cost, start)
+            self.breaker.record_success()
+            return result
+        except BaseException: # cancelled (client gone, speculation discarded, wait_for timeout): no outcome to record
+            self.breaker.abandon()
+            raise
+
+    def stream(self, func: Callable[..., Iterable[T]], *args: Any, cost: float = 1, **kwargs: Any) -> Iterator[T]:
+        """ like call for a func that returns a stream, yielding its chunks. The slot is held
+        until the stream is exhausted or closed, and a failure partway through counts against
+        the breaker and is raised as LLMUnavailableError. Only opening the stream is retried.
+        """
+        self._check_breaker()
+        start = time.perf_counter()
+        try:
+            with self._slots:
+                chunks = self._attempts(func, args, kwargs, cost, start)
+                try:
+                    yield from chunks
+                except Exception as e:
+                    raise self._on_stream_error(e) from e
+            self.breaker.record_success()
+        except BaseException: # also a consumer closing the stream early
+            self.breaker.abandon()
+            raise
+
+    async def stream_async(self, func: Callable[..., Awaitable[AsyncIterable[T]]], *args: Any, cost: float = 1, **kwargs: Any) -> AsyncIterator[T]:
+        """ async version of stream.
+        """
+        self._check_breaker()
+        start = time.perf_counter()
+        try:
+            async with self._slots_async():
+                chunks = await self._attempts_async(func, args, kwargs, cost, start)
+                try:
+                    async for chunk in chunks:
+                        yield chunk
+                except Exception as e:
+                    raise self._on_stream_error(e) from e
+            self.breaker.record_success()
+        except BaseException:
+            self.breaker.abandon()
+            raise
+
+    def queue_wait_ms(self, pct: float) -> float:
+        """ returns the pct percentile of recent waits for a slot and quota in milliseconds.
+        """
+        values = sorted(self._queue_waits)
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))] * 1000
@@ -1,22 +1,230 @@
 import os
-from typing import List, Dict
-from groq import Groq
+import time
+from contextlib import aclosing, closing
+from typing import Any, AsyncIterator, Dict, Iterator, List
 from dotenv import load_dotenv
+from app import tracing
+from app.concurrency import Lazy
+from app.llm.coalesce import LLMCoalescer
+from app.llm.gateway import CircuitBreaker, LLMGateway
 load_dotenv()
 
-client = Groq(api_key=os.getenv("GROQ_API_KEY")) #setting up the groq with api key
+GROQ_TIMEOUT = float(os.getenv("GROQ_TIMEOUT", "30")) # seconds per attempt, a stalled call is retried
+GROQ_CONNECT_TIMEOUT = float(os.getenv("GROQ_CONNECT_TIMEOUT", "5"))
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "20")) # pooled keep-alive connections per client
 
-def call_groq_chat(system_prompt: str,user_prompt: str, model: str="openai/gpt-oss-20b", temperature: float=0.4,max_tokens: int = 300) -> str:
-    """call Groq chat completion API."""
-    messages: List[Dict[str, str]] = [ #formatting the user message
+# every call goes through the gateway: concurrency cap, quota, retries, circuit breaker
+gateway = LLMGateway(
+    max_concurrency=int(os.getenv("GROQ_MAX_CONCURRENCY", "8")),
+    requests_per_minute=float(os.getenv("GROQ_RPM", "0")), # 0 = no limit, set to the account's quota
+    tokens_per_minute=float(os.getenv("GROQ_TPM", "0")),
+    max_retries=int(os.getenv("GROQ_MAX_RETRIES", "3")),
+    base_backoff=float(os.getenv("GROQ_BACKOFF", "0.5")),
+    max_backoff=float(os.getenv("GROQ_MAX_BACKOFF", "20")),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv("GROQ_BREAKER_FAILURES", "5")),
+        reset_seconds=float(os.getenv("GROQ_BREAKER_RESET", "30")),
+        trial_seconds=float(os.getenv("GROQ_BREAKER_TRIAL", "60")), # a half-open trial running longer than this is given up on
+    ),
+)
+
+
+# identical concurrent calls share one completion, temperature-0 results are reused for LLM_CACHE_TTL seconds
+COALESCE = os.getenv("LLM_COALESCE", "1") == "1"
+coalescer = LLMCoalescer(
+    cache_ttl=float(os.getenv("LLM_CACHE_TTL", "30")), # 0 turns the cache off
+    cache_size=int(os.getenv("LLM_CACHE_SIZE", "1024")),
+)
+
+
+def _client_options() -> Dict[str, Any]:
+    import httpx
+    return {
+        "api_key": os.getenv("GROQ_API_KEY"),
+        "timeout": httpx.Timeout(GROQ_TIMEOUT, connect=GROQ_CONNECT_TIMEOUT),
+        "max_retries": 0, # the gateway retries
+    }
+
+
+def _pool_limits() -> Any:
+    import httpx
+    return httpx.Limits(max_connections=GROQ_MAX_CONNECTIONS, max_keepalive_connections=GROQ_MAX_CONNECTIONS)
+
+
+def _make_client() -> Any:
+    from groq import DefaultHttpxClient, Groq
+    return Groq(http_client=DefaultHttpxClient(limits=_pool_limits()), **_client_options()) #setting up the groq with api key
+
+
+def _make_async_client() -> Any:
+    from groq import AsyncGroq, DefaultAsyncHttpxClient
+    return AsyncGroq(http_client=DefaultAsyncHttpxClient(limits=_pool_limits()), **_client_options()) #non-blocking client used by the async chat pipeline
+
+
+# built on first use so importing the app does not import the SDK
+_client = Lazy("groq_client", _make_client)
+_async_client = Lazy("groq_async_client", _make_async_client)
+
+
+def get_client() -> Any:
+    return _client.get()
+
+
+def get_async_client() -> Any:
+    return _async_client.get()
+
+
+def estimate_tokens(messages: List[Dict[str, str]], max_tokens: int) -> int:
+    """rough token cost of a call for the tokens-per-minute limit, ~4 characters per token."""
+    return sum(len(m["content"]) for m in messages) // 4 + max_tokens
+
+
+def _build_messages(system_prompt: str, user_prompt: str) -> List[Dict[str, str]]:
+    """format the system and user prompt into chat messages."""
+    return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt}
     ]
-    resp = client.chat.completions.create( # retriving response from the model
+
+
+# prompt tokens billed and the share of them the provider served from its prompt cache
+usage_stats: Dict[str, int] = {"calls": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0, "completion_tokens": 0}
+
+
+def _stream_usage(chunk: Any) -> Any:
+    """ the usage on a stream chunk: Groq sends it in x_groq on the last one, None on the others.
+    """
+    return getattr(chunk, "usage", None) or getattr(getattr(chunk, "x_groq", None), "usage", None)
+
+
+def _record_usage(usage: Any) -> Dict[str, int]:
+    """ counts a call's usage in usage_stats and returns it as span attributes.
+    """
+    if usage is None:
+        return {}
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+    usage_stats["calls"] += 1
+    usage_stats["prompt_tokens"] += usage.prompt_tokens or 0
+    usage_stats["cached_prompt_tokens"] += cached
+    usage_stats["completion_tokens"] += usage.completion_tokens or 0
+    return {"prompt_tokens": usage.prompt_tokens or 0, "cached_prompt_tokens": cached, "completion_tokens": usage.completion_tokens or 0}
+
+
+@tracing.traced("llm")
+def _complete(system_prompt: str, user_prompt: str, model: str, temperature: float, max_tokens: int) -> str:
+    messages = _build_messages(system_prompt, user_prompt) #formatting the user message
+    tracing.annotate(model=model)
+    resp = gateway.call( # retriving response from the model
+        get_client().chat.completions.create,
+        cost=estimate_tokens(messages, max_tokens),
         model=model,
         messages=messages,
           temperature=temperature,
           max_tokens=max_tokens
     )
-    
+    tracing.annotate(**_record_usage(getattr(resp, "usage", None)))
+
     return resp.choices[0].message.content #retruns message content
+
+
+@tracing.traced("llm")
+async def _complete_async(system_prompt: str, user_prompt: str, model: str, temperature: float, max_tokens: int) -> str:
+    messages = _build_messages(system_prompt, user_prompt)
+    tracing.annotate(model=model)
+    resp = await gateway.call_async(
+        get_async_client().chat.completions.create,
+        cost=estimate_tokens(messages, max_tokens),
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens
+    )
+    tracing.annotate(**_record_usage(getattr(resp, "usage", None)))
+
+    return resp.choices[0].message.content
+
+
+def call_groq_chat(system_prompt: str,user_prompt: str, model: str="openai/gpt-oss-20b", temperature: float=0.4,max_tokens: int = 300) -> str:
+    """call Groq chat completion API."""
+    args = (system_prompt, user_prompt, model, temperature, max_tokens)
+    if not COALESCE:
+        return _complete(*args)
+    return coalescer.call(args, lambda: _complete(*args), cacheable=temperature == 0)
+
+
+async def call_groq_chat_async(system_prompt: str, user_prompt: str, model: str = "openai/gpt-oss-20b", temperature: float = 0.4, max_tokens: int = 300) -> str:
+    """call Groq chat completion API without blocking the event loop."""
+    args = (system_prompt, user_prompt, model, temperature, max_tokens)
+    if not COALESCE:
+        return await _complete_async(*args)
+    return await coalescer.call_async(args, lambda: _complete_async(*args), cacheable=temperature == 0)
+
+
+def stream_groq_chat(system_prompt: str, user_prompt: str, model: str = "openai/gpt-oss-20b", temperature: float = 0.4, max_tokens: int = 300) -> Iterator[str]:
+    """call Groq chat completion API and yield the reply text as it is generated."""
+    messages = _build_messages(system_prompt, user_prompt)
+    span = tracing.start_span("llm_stream", model=model) # ended by hand, the generator outlives any with block
+    start = time.perf_counter()
+    deltas, error, usage = 0, None, None
+    try:
+        # holds a gateway slot until the stream ends; retries cover opening it, not a failure halfway through
+        with closing(gateway.stream(
+            get_client().chat.completions.create,
+            cost=estimate_tokens(messages, max_tokens),
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )) as stream:
+            for chunk in stream:
+                usage = _stream_usage(chunk) or usage
+                if chunk.choices and chunk.choices[0].delta.content: #the last chunk carries no text
+                    if not deltas:
+                        span.set(ttft_ms=round((time.perf_counter() - start) * 1000, 1))
+                    deltas += 1
+                    yield chunk.choices[0].delta.content
+        span.set(**_record_usage(usage)) # the usage comes with the last chunk
+    except GeneratorExit: # the consumer stopped early (client gone, speculation discarded), not a failure
+        raise
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        span.set(deltas=deltas)
+        span.end(error)
+
+
+async def stream_groq_chat_async(system_prompt: str, user_prompt: str, model: str = "openai/gpt-oss-20b", temperature: float = 0.4, max_tokens: int = 300) -> AsyncIterator[str]:
+    """async version of stream_groq_chat."""
+    messages = _build_messages(system_prompt, user_prompt)
+    span = tracing.start_span("llm_stream", model=model)
+    start = time.perf_counter()
+    deltas, error, usage = 0, None, None
+    try:
+        async with aclosing(gateway.stream_async(
+            get_async_client().chat.completions.create,
+            cost=estimate_tokens(messages, max_tokens),
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )) as stream:
+            async for chunk in stream:
+                usage = _stream_usage(chunk) or usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if not deltas:
+                        span.set(ttft_ms=round((time.perf_counter() - start) * 1000, 1))
+                    deltas += 1
+                    yield chunk.choices[0].delta.content
+        span.set(**_record_usage(usage)) # the usage comes with the last chunk
+    except GeneratorExit: # the consumer stopped early (client gone, speculation discarded), not a failure
+        raise
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        span.set(deltas=deltas)
+        span.end(error)
@@ -1,20 +1,130 @@
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import sys
+from typing import Any, Dict, List, Optional
 
-log_dirs = "logs"
-os.makedirs(log_dirs, exist_ok=True)#makin up the directory
+# request threads only put records on a queue, a listener thread formats them and does the file and
+# console I/O. LOG_FORMAT=json writes one JSON object per line (event, the KEY=value fields of the
+# message, exception), text the usual readable lines. app.log is rotated at LOG_MAX_BYTES.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text") # "text" or "json"
+LOG_DIR = os.getenv("LOG_DIR", "logs")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_CONSOLE = os.getenv("LOG_CONSOLE", "1") == "1"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000")) # records waiting for the writer; past it they are dropped, not waited on
 
-logfile = os.path.join(log_dirs, "app.log")
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] [%(name)s] %(message)s"
 
-logging.basicConfig(
-   level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] [%(name)s] %(message)s",
-    handlers=[
-        logging.FileHandler(logfile, encoding="utf-8"),
-        logging.StreamHandler()
-        ]
-    
-)
+stats: Dict[str, int] = {"dropped": 0}
 
+_traceback_formatter = logging.Formatter()
 
-logger = logging.getLogger("nephrology_app") 
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record. Messages in the app's "EVENT key=value ..." style also get
+    the event and the fields split out, so log tools can filter on them.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        entry: Dict[str, Any] = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": message,
+        }
+        head, _, rest = message.partition(" ")
+        if head.isupper() and head.isalpha():
+            entry["event"] = head
+            fields = dict(part.split("=", 1) for part in rest.split(" ") if "=" in part and not part.startswith("="))
+            if fields:
+                entry["fields"] = fields
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler that drops (and counts) records when the queue is full instead of blocking or erroring."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """ merges the arguments into the message now (they may change before the listener runs),
+        keeping the traceback apart so the JSON formatter can still put it in its own field.
+        """
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            stats["dropped"] += 1
+
+
+def make_formatter(kind: str = LOG_FORMAT) -> logging.Formatter:
+    if kind == "json":
+        return JsonFormatter()
+    if kind == "text":
+        return logging.Formatter(TEXT_FORMAT)
+    raise ValueError(f"LOG_FORMAT must be 'text' or 'json', got {kind!r}")
+
+
+def make_handlers(log_dir: str = LOG_DIR, kind: str = LOG_FORMAT, max_bytes: int = LOG_MAX_BYTES, backup_count: int = LOG_BACKUP_COUNT, console: bool = LOG_CONSOLE) -> List[logging.Handler]:
+    """ the handlers that do the I/O: the rotating app.log and optionally the console.
+    """
+    os.makedirs(log_dir, exist_ok=True) #makin up the directory
+    formatter = make_formatter(kind)
+    handlers: List[logging.Handler] = [
+        logging.handlers.RotatingFileHandler(os.path.join(log_dir, "app.log"), maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"),
+    ]
+    if console:
+        handlers.append(logging.StreamHandler(sys.stderr))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+
+def start_queue_logging(target: logging.Logger, handlers: List[logging.Handler], queue_size: int = LOG_QUEUE_SIZE) -> logging.handlers.QueueListener:
+    """ routes target's records through a queue to handlers on a listener thread; stop() the listener to flush.
+    """
+    records: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=queue_size)
+    target.addHandler(DroppingQueueHandler(records))
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging() -> None:
+    """ sets up the root logger once: level from LOG_LEVEL, records queued to the file and console handlers.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    _listener = start_queue_logging(root, make_handlers())
+    atexit.register(_listener.stop) # writes out what is still queued
+
+
+configure_logging()
+
+logfile = os.path.join(LOG_DIR, "app.log")
+
+logger = logging.getLogger("nephrology_app")
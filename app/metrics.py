@@ -0,0 +1,324 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Prometheus text-format metrics for /metrics. Counters and histograms are sharded per thread:
+# each thread only writes its own dict, so recording never takes a lock, and a scrape sums the
+# shards. Metrics that other modules already count in their .stats dicts are read at scrape time.
+# With several uvicorn workers set METRICS_SHARED_PATH: every worker writes its samples to that
+# SQLite file every METRICS_FLUSH_SECONDS and /metrics on any worker reports the sum of all live ones.
+METRICS_SHARED_PATH = os.getenv("METRICS_SHARED_PATH", "") # empty: each worker reports only itself
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Labels, float] # metric name with suffix, labels, value
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0) # seconds
+
+
+class _Sharded:
+    """Per-thread dicts of label values -> state, registered on a thread's first write."""
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._shards: List[Dict[Tuple[str, ...], Any]] = []
+        self._lock = threading.Lock() # only taken for a thread's first write and for scrapes
+
+    def _shard(self) -> Dict[Tuple[str, ...], Any]:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _snapshot(self) -> List[Dict[Tuple[str, ...], Any]]:
+        with self._lock:
+            shards = list(self._shards)
+        return [dict(shard) for shard in shards] # a dict copy is atomic under the GIL
+
+
+class Counter(_Sharded):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__()
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        shard = self._shard()
+        shard[label_values] = shard.get(label_values, 0) + amount
+
+    def samples(self) -> List[Sample]:
+        totals: Dict[Tuple[str, ...], float] = {}
+        for shard in self._snapshot():
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0) + value
+        return [(self.name, tuple(zip(self.labels, key)), value) for key, value in totals.items()]
+
+
+class Histogram(_Sharded):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__()
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *label_values: str) -> None:
+        shard = self._shard()
+        counts = shard.get(label_values)
+        if counts is None:
+            counts = shard[label_values] = [0.0] * (len(self.buckets) + 2) # per bucket, then sum and count
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        counts[-2] += value
+        counts[-1] += 1
+
+    def samples(self) -> List[Sample]:
+        totals: Dict[Tuple[str, ...], List[float]] = {}
+        for shard in self._snapshot():
+            for key, counts in shard.items():
+                total = totals.setdefault(key, [0.0] * len(counts))
+                for i, c in enumerate(list(counts)):
+                    total[i] += c
+        out: List[Sample] = []
+        for key, counts in totals.items():
+            labels = tuple(zip(self.labels, key))
+            cumulative = 0.0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                out.append((f"{self.name}_bucket", labels + (("le", f"{bound:g}"),), cumulative))
+            out.append((f"{self.name}_bucket", labels + (("le", "+Inf"),), counts[-1]))
+            out.append((f"{self.name}_sum", labels, counts[-2]))
+            out.append((f"{self.name}_count", labels, counts[-1]))
+        return out
+
+
+class Collected:
+    """
+    A metric read from elsewhere at scrape time: collect() returns {label values: value}.
+    Across workers gauges are summed, or maxed with shared=True (e.g. a count every worker
+    reads from the same SQLite store).
+    """
+
+    def __init__(self, name: str, kind: str, help: str, labels: Sequence[str], collect: Callable[[], Dict[Tuple[str, ...], float]], shared: bool = False):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+        self.shared = shared
+
+    def samples(self) -> List[Sample]:
+        return [(self.name, tuple(zip(self.labels, key)), float(value)) for key, value in self.collect().items()]
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Any] = {}
+
+    def add(self, metric: Any) -> Any:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.add(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def collected(self, name: str, kind: str, help: str, labels: Sequence[str], collect: Callable[[], Dict[Tuple[str, ...], float]], shared: bool = False) -> Collected:
+        return self.add(Collected(name, kind, help, labels, collect, shared))
+
+    def samples(self) -> Dict[str, List[Sample]]:
+        """ metric name -> samples of this process; a failing collector only loses its own metric.
+        """
+        out = {}
+        for name, metric in self._metrics.items():
+            try:
+                out[name] = metric.samples()
+            except Exception:
+                out[name] = []
+        return out
+
+    def render(self, samples: Optional[Dict[str, List[Sample]]] = None) -> str:
+        """ the Prometheus text exposition format (version 0.0.4).
+        """
+        samples = self.samples() if samples is None else samples
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for sample_name, labels, value in samples.get(name, []):
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                lines.append(f"{sample_name}{{{label_text}}} {_number(value)}" if label_text else f"{sample_name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def combine(self, per_worker: List[Dict[str, List[Sample]]]) -> Dict[str, List[Sample]]:
+        """ sums the samples of several workers (max for shared gauges).
+        """
+        out: Dict[str, List[Sample]] = {}
+        for name, metric in self._metrics.items():
+            totals: Dict[Tuple[str, Labels], float] = {}
+            for samples in per_worker:
+                for sample_name, labels, value in samples.get(name, []):
+                    key = (sample_name, tuple(tuple(pair) for pair in labels))
+                    if getattr(metric, "shared", False):
+                        totals[key] = max(totals.get(key, value), value)
+                    else:
+                        totals[key] = totals.get(key, 0) + value
+            out[name] = [(sample_name, labels, value) for (sample_name, labels), value in totals.items()]
+        return out
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class SharedSamples:
+    """
+    Latest samples of every worker in a SQLite file, one row per process. Rows not refreshed
+    for three flush intervals belong to workers that are gone and are ignored.
+    """
+
+    def __init__(self, path: str, flush_seconds: float = 5):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self._local = threading.local() # sqlite connections can't be shared between threads
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS worker_metrics (pid INTEGER PRIMARY KEY, samples TEXT NOT NULL, updated_at REAL NOT NULL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def put(self, samples: Dict[str, List[Sample]]) -> None:
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO worker_metrics (pid, samples, updated_at) VALUES (?, ?, ?)",
+                (os.getpid(), json.dumps(samples), time.time()),
+            )
+            conn.execute("DELETE FROM worker_metrics WHERE updated_at < ?", (time.time() - 10 * self.flush_seconds,))
+
+    def others(self) -> List[Dict[str, List[Sample]]]:
+        rows = self._conn().execute(
+            "SELECT samples FROM worker_metrics WHERE pid != ? AND updated_at >= ?",
+            (os.getpid(), time.time() - 3 * self.flush_seconds),
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+registry = Registry()
+shared = SharedSamples(METRICS_SHARED_PATH, METRICS_FLUSH_SECONDS) if METRICS_SHARED_PATH else None
+
+
+def render() -> str:
+    """ this worker's metrics, summed with the other workers' when METRICS_SHARED_PATH is set.
+    """
+    own = registry.samples()
+    if shared is None:
+        return registry.render(own)
+    shared.put(own)
+    return registry.render(registry.combine([own] + shared.others()))
+
+
+def flush() -> None:
+    if shared is not None:
+        shared.put(registry.samples())
+
+
+# recorded by the API and agents
+http_requests = registry.counter("chat_http_requests_total", "HTTP requests by endpoint and status code.", ("endpoint", "status"))
+http_latency = registry.histogram("chat_http_request_seconds", "HTTP request latency by endpoint.", ("endpoint",))
+agent_latency = registry.histogram("chat_agent_seconds", "Chat turn latency by the agent that answered.", ("agent",))
+intents = registry.counter("chat_intent_total", "Router intent labels, by the tier (local or llm) that decided.", ("intent", "tier"))
+clinical_context = registry.counter(
+    "chat_clinical_answers_total",
+    "Clinical answers by where their context came from: textbook, web (searched as fallback or for latest info), cache or fallback (no context).",
+    ("source",),
+)
+llm_errors = registry.counter("chat_llm_errors_total", "Chat requests answered with the LLM-unavailable apology.", ("endpoint",))
+
+
+def _from_stats(stats: Callable[[], Dict[str, float]], mapping: Dict[str, Tuple[str, ...]]) -> Callable[[], Dict[Tuple[str, ...], float]]:
+    """ a collector reading the given keys of a .stats dict, each as the given label values.
+    """
+    def collect() -> Dict[Tuple[str, ...], float]:
+        values = stats()
+        return {labels: values.get(key, 0) for key, labels in mapping.items()}
+    return collect
+
+
+def register_app_metrics(sessions: Any) -> None:
+    """ metrics counted by other modules in their .stats dicts, read at scrape time.
+    Imports lazily so importing this module stays cheap.
+    """
+    from app.agents import clinical, history
+    from app import logging_setup
+    from app.agents.prompt_prefix import prefixes
+    from app.llm import groq_client
+    from app.tools import web_search
+
+    registry.collected(
+        "chat_sessions_active", "gauge", "Sessions held by the session store.", (),
+        lambda: {(): len(sessions)}, shared=type(sessions).__name__ != "InMemorySessionStore",
+    )
+    registry.collected(
+        "chat_llm_tokens_total", "counter", "Groq tokens by kind; cached_prompt is the part of prompt served from the provider's prompt cache.", ("kind",),
+        _from_stats(lambda: groq_client.usage_stats, {"prompt_tokens": ("prompt",), "cached_prompt_tokens": ("cached_prompt",), "completion_tokens": ("completion",)}),
+    )
+    registry.collected(
+        "chat_llm_calls_total", "counter", "Groq calls through the gateway, attempts, retries and failures.", ("outcome",),
+        _from_stats(lambda: groq_client.gateway.stats, {k: (k,) for k in ("calls", "attempts", "retries", "failures", "circuit_rejections")}),
+    )
+    registry.collected(
+        "chat_llm_attempt_errors_total", "counter", "Failed Groq attempts by error kind.", ("kind",),
+        lambda: {(kind,): n for kind, n in dict(groq_client.gateway.errors).items()},
+    )
+    registry.collected(
+        "chat_cache_requests_total", "counter", "Lookups of the app's caches by result.", ("cache", "result"),
+        lambda: {
+            ("answer", "hit"): clinical.answer_cache.stats["hits"],
+            ("answer", "miss"): clinical.answer_cache.stats["misses"],
+            ("llm", "hit"): groq_client.coalescer.stats["cache_hits"],
+            ("llm", "coalesced"): groq_client.coalescer.stats["coalesced"],
+            # calls counts every lookup, hit or coalesced; the rest went to Groq
+            ("llm", "miss"): groq_client.coalescer.stats["calls"] - groq_client.coalescer.stats["cache_hits"] - groq_client.coalescer.stats["coalesced"],
+            ("web", "hit"): web_search.stats["cache_hits"],
+            ("web", "miss"): web_search.stats["requests"], # sent to Tavily, not searches skipped (no key, deadline) or joined
+            ("prompt_prefix", "hit"): prefixes.stats["reused"],
+            ("prompt_prefix", "miss"): prefixes.stats["built"],
+            **({("embedding", "hit"): clinical.get_embedder().stats["hits"], ("embedding", "miss"): clinical.get_embedder().stats["misses"]} if clinical._embedder.loaded else {}),
+        },
+    )
+    registry.collected(
+        "chat_web_searches_total", "counter", "Web searches by outcome; timeouts answered without the web.", ("outcome",),
+        _from_stats(lambda: web_search.stats, {"searches": ("searched",), "requests": ("requested",), "timeouts": ("timeout",), "errors": ("error",)}),
+    )
+    registry.collected(
+        "chat_log_records_dropped_total", "counter", "Log records dropped because the logging queue was full.", (),
+        lambda: {(): logging_setup.stats["dropped"]},
+    )
+    registry.collected(
+        "chat_history_messages_total", "counter", "Conversation history messages moved out of the window, dropped, and summaries made.", ("event",),
+        _from_stats(lambda: history.stats, {k: (k,) for k in ("evicted", "dropped", "summaries", "summary_failures")}),
+    )
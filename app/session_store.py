@@ -0,0 +1,148 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+SessionState = Dict[str, Any]
+
+
+class SessionStore(ABC):
+    """
+    Where conversation state lives between requests. get() returns None for unknown
+    or expired sessions; callers must set() the state back after changing it.
+    """
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[SessionState]:
+        ...
+
+    @abstractmethod
+    def set(self, session_id: str, state: SessionState) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Per-process store. Sessions idle for longer than ttl_seconds expire and the least
+    recently used session is evicted past max_sessions.
+    """
+
+    def __init__(self, max_sessions: int = 10000, ttl_seconds: float = 86400):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, Tuple[SessionState, float]]" = OrderedDict() # LRU order, oldest first
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"evictions": 0, "expirations": 0}
+
+    def get(self, session_id: str) -> Optional[SessionState]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._sessions.get(session_id)
+            if item is None:
+                return None
+            state, last_used = item
+            if now - last_used > self.ttl_seconds:
+                del self._sessions[session_id]
+                self.stats["expirations"] += 1
+                return None
+            self._sessions[session_id] = (state, now)
+            self._sessions.move_to_end(session_id)
+            return state
+
+    def set(self, session_id: str, state: SessionState) -> None:
+        with self._lock:
+            self._sessions[session_id] = (state, time.monotonic())
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sessions stored as JSON in a SQLite file, shared by every uvicorn worker on the host
+    and kept across restarts. Expired rows are purged every purge_every writes.
+    """
+
+    def __init__(self, path: str = "sessions.db", ttl_seconds: float = 86400, purge_every: int = 1000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.purge_every = purge_every
+        self._writes = 0
+        self._local = threading.local() # sqlite connections can't be shared between threads
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions(updated_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL") # readers don't block the writer of another worker
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id: str) -> Optional[SessionState]:
+        row = self._conn().execute(
+            "SELECT state FROM sessions WHERE session_id = ? AND updated_at >= ?",
+            (session_id, time.time() - self.ttl_seconds),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, session_id: str, state: SessionState) -> None:
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, state, updated_at) VALUES (?, ?, ?)",
+                (session_id, json.dumps(state), time.time()),
+            )
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            self.purge_expired()
+
+    def delete(self, session_id: str) -> None:
+        with self._conn() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def purge_expired(self) -> int:
+        with self._conn() as conn:
+            cur = conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl_seconds,))
+        return cur.rowcount
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+def make_session_store() -> SessionStore:
+    """
+    Build the store selected by SESSION_STORE (memory or sqlite).
+    """
+    kind = os.getenv("SESSION_STORE", "memory")
+    ttl = float(os.getenv("SESSION_TTL", "86400"))
+    if kind == "memory":
+        return InMemorySessionStore(max_sessions=int(os.getenv("SESSION_MAX", "10000")), ttl_seconds=ttl)
+    if kind == "sqlite":
+        return SQLiteSessionStore(path=os.getenv("SESSION_DB_PATH", "sessions.db"), ttl_seconds=ttl)
+    raise ValueError(f"SESSION_STORE must be 'memory' or 'sqlite', got {kind!r}")
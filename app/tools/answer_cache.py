@@ -0,0 +1,106 @@
+import hashlib
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# (patient scope, retrieved chunk ids in rank order, unit query embedding)
+CacheKey = Tuple[str, Tuple[str, ...], List[float]]
+
+# every patient field that ends up in a clinical prompt, a change in any of them starts a new scope
+PATIENT_SCOPE_FIELDS = [
+    "patient_name",
+    "discharge_date",
+    "primary_diagnosis",
+    "medications",
+    "dietary_restrictions",
+    "follow_up",
+    "warning_signs",
+]
+
+
+def patient_scope(patient_record: Optional[Dict[str, Any]]) -> str:
+    """ returns a stable id for the patient fields an answer was personalised with.
+    """
+    fields = {f: (patient_record or {}).get(f) for f in PATIENT_SCOPE_FIELDS}
+    return hashlib.sha1(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def unit_vector(vec: List[float]) -> List[float]:
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+class SemanticAnswerCache:
+    """
+    Caches clinical answers per patient scope. A lookup hits when an entry of the same scope
+    was answered from the same retrieved chunks and its query embedding is within the cosine threshold.
+    Entries expire after ttl_seconds and the least recently used one is evicted past max_entries.
+    """
+
+    def __init__(self, threshold: float = 0.92, ttl_seconds: float = 3600, max_entries: int = 2000):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict() # LRU order, oldest first
+        self._by_scope: Dict[str, Set[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        ids = self._by_scope[entry["scope"]]
+        ids.discard(entry_id)
+        if not ids:
+            del self._by_scope[entry["scope"]]
+
+    def get(self, key: CacheKey) -> Optional[str]:
+        """ returns the cached answer for key, or None.
+        """
+        scope, doc_ids, vec = key
+        now = time.monotonic()
+        with self._lock:
+            best_id, best_sim = None, self.threshold
+            for entry_id in list(self._by_scope.get(scope, ())):
+                entry = self._entries[entry_id]
+                if now - entry["created"] > self.ttl_seconds:
+                    self._remove(entry_id)
+                    self.stats["expirations"] += 1
+                    continue
+                if entry["doc_ids"] != doc_ids:
+                    continue
+                sim = sum(a * b for a, b in zip(vec, entry["vec"]))
+                if sim >= best_sim:
+                    best_id, best_sim = entry_id, sim
+
+            if best_id is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            self._entries.move_to_end(best_id)
+            return self._entries[best_id]["answer"]
+
+    def put(self, key: CacheKey, answer: str) -> None:
+        """ stores answer under key, evicting the least recently used entries when full.
+        """
+        scope, doc_ids, vec = key
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                "scope": scope,
+                "doc_ids": doc_ids,
+                "vec": vec,
+                "answer": answer,
+                "created": time.monotonic(),
+            }
+            self._by_scope.setdefault(scope, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,127 @@
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Set, Tuple
+
+MIN_OVERLAP_CHARS = 40 # shorter shared edges between chunks are coincidence, not splitter overlap
+
+
+@lru_cache(maxsize=1)
+def _encoding() -> Any:
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken.get_encoding("o200k_base") # the gpt-oss tokenizer family
+
+
+def count_tokens(text: str) -> int:
+    """ tokens of text for the LLM; ~4 characters per token when tiktoken is not installed.
+    """
+    enc = _encoding()
+    if enc is None:
+        return (len(text) + 3) // 4
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """ cuts text to at most max_tokens, at the last sentence end if there is one in the second half.
+    """
+    enc = _encoding()
+    if enc is None:
+        cut = text[:max_tokens * 4]
+    else:
+        cut = enc.decode(enc.encode(text, disallowed_special=())[:max_tokens])
+    end = max(cut.rfind(". "), cut.rfind(".\n"))
+    return cut[:end + 1] if end > len(cut) // 2 else cut
+
+
+class Chunk(NamedTuple):
+    """The part of a retrieved document that goes into the prompt; book_context reads the same fields as a Document."""
+    page_content: str
+    metadata: Dict[str, Any]
+
+
+def _shingles(text: str, size: int = 5) -> Set[Tuple[str, ...]]:
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+def _trim_overlap(text: str, kept: List[str]) -> str:
+    """ removes the start (or end) of text that repeats the end (or start) of a kept chunk,
+    i.e. the overlap the text splitter puts between neighbouring chunks.
+    """
+    for other in kept:
+        head = text[:MIN_OVERLAP_CHARS]
+        pos = other.find(head)
+        while pos != -1:
+            if text.startswith(other[pos:]):
+                text = text[len(other) - pos:]
+                break
+            pos = other.find(head, pos + 1)
+        tail = text[-MIN_OVERLAP_CHARS:]
+        pos = other.rfind(tail)
+        while pos != -1:
+            if text.endswith(other[:pos + len(tail)]):
+                text = text[:len(text) - pos - len(tail)]
+                break
+            pos = other.rfind(tail, 0, pos)
+    return text.strip()
+
+
+class ContextBuilder:
+    """
+    Packs retrieved chunks, most relevant first, into what is left of an input-token budget:
+    - near-duplicate chunks (shingle Jaccard >= duplicate_threshold) are dropped,
+    - text that overlaps a chunk already packed is trimmed,
+    - the first chunk that does not fit is truncated if at least min_chunk_tokens fit, and packing stops.
+    """
+
+    def __init__(self, budget_tokens: int = 1500, min_chunk_tokens: int = 60, duplicate_threshold: float = 0.8):
+        self.budget_tokens = budget_tokens
+        self.min_chunk_tokens = min_chunk_tokens
+        self.duplicate_threshold = duplicate_threshold
+
+    def pack(self, docs: List[Any], used_tokens: int = 0, chunk_overhead: int = 0) -> Tuple[List[Chunk], Dict[str, int]]:
+        """ returns the chunks to put in the prompt and packing stats.
+        used_tokens is what the rest of the prompt already takes, chunk_overhead the tokens of each chunk's header.
+        """
+        remaining = self.budget_tokens - used_tokens
+        packed: List[Chunk] = []
+        kept_texts: List[str] = []
+        kept_shingles: List[Set[Tuple[str, ...]]] = []
+        stats = {"retrieved": len(docs), "packed": 0, "duplicates": 0, "truncated": 0, "dropped": 0, "context_tokens": 0}
+
+        for i, doc in enumerate(docs):
+            shingles = _shingles(doc.page_content)
+            if any(len(shingles & s) / len(shingles | s) >= self.duplicate_threshold for s in kept_shingles):
+                stats["duplicates"] += 1
+                continue
+            text = _trim_overlap(doc.page_content, kept_texts)
+            if not text:
+                stats["duplicates"] += 1
+                continue
+
+            tokens = count_tokens(text) + chunk_overhead
+            if tokens > remaining:
+                room = remaining - chunk_overhead
+                if room >= self.min_chunk_tokens:
+                    text = truncate_to_tokens(text, room)
+                    tokens = count_tokens(text) + chunk_overhead
+                    stats["truncated"] += 1
+                else:
+                    stats["dropped"] += len(docs) - i
+                    break
+                packed.append(Chunk(text, doc.metadata or {}))
+                stats["context_tokens"] += tokens
+                stats["dropped"] += len(docs) - i - 1
+                break
+
+            packed.append(Chunk(text, doc.metadata or {}))
+            kept_texts.append(text)
+            kept_shingles.append(shingles)
+            remaining -= tokens
+            stats["context_tokens"] += tokens
+
+        stats["packed"] = len(packed)
+        return packed, stats
+
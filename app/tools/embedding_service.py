@@ -0,0 +1,107 @@
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Deque, Dict, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+
+class EmbeddingService(Embeddings):
+    """
+    Wraps an embedding model for query embeddings:
+    - memoises embeddings of normalised text in a bounded LRU,
+    - micro-batches concurrent cache misses: the worker thread collects requests for
+      batch_window_ms (or until max_batch_size) and encodes them in one model call.
+    Document embedding (ingestion) goes straight to the model.
+    """
+
+    def __init__(self, model: Embeddings, cache_size: int = 4096, batch_window_ms: float = 2.0, max_batch_size: int = 32):
+        self.model = model
+        self.cache_size = cache_size
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch_size = max_batch_size
+
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "batches": 0}
+        self.batch_size_histogram: Dict[int, int] = {}
+        self._latencies: Deque[float] = deque(maxlen=2048) # seconds per embed_query call, recent calls only
+
+    @staticmethod
+    def normalise(text: str) -> str:
+        """ all-MiniLM-L6-v2 lower-cases its input, so case and extra whitespace don't change the embedding.
+        """
+        return " ".join(text.split()).lower()
+
+    def embed_query(self, text: str) -> List[float]:
+        start = time.perf_counter()
+        key = self.normalise(text)
+        with self._lock:
+            vec = self._cache.get(key)
+            if vec is not None:
+                self._cache.move_to_end(key)
+                self.stats["hits"] += 1
+            else:
+                self.stats["misses"] += 1
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    self._worker.start()
+
+        if vec is None:
+            future: Future = Future()
+            self._queue.put((key, future))
+            vec = future.result()
+
+        self._latencies.append(time.perf_counter() - start)
+        return vec
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.model.embed_documents(texts)
+
+    def _collect_batch(self) -> List[Tuple[str, Future]]:
+        batch = [self._queue.get()] # wait for the first request
+        deadline = time.perf_counter() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect_batch()
+            texts = list(dict.fromkeys(key for key, _ in batch)) # the same text asked twice is encoded once
+            try:
+                vectors = self.model.embed_documents(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            by_text = dict(zip(texts, vectors))
+            with self._lock:
+                self.stats["batches"] += 1
+                self.batch_size_histogram[len(texts)] = self.batch_size_histogram.get(len(texts), 0) + 1
+                for text, vec in by_text.items():
+                    self._cache[text] = vec
+                    self._cache.move_to_end(text)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+            for key, future in batch:
+                future.set_result(by_text[key])
+
+    def latency_ms(self, pct: float) -> float:
+        """ returns the pct percentile of recent embed_query latencies in milliseconds.
+        """
+        values = sorted(self._latencies)
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))] * 1000
@@ -0,0 +1,363 @@
+import math
+import os
+import pickle
+import re
+import time
+from array import array
+from bisect import bisect_left
+from typing import Any, Collection, Dict, Iterable, List, Optional, Tuple
+
+from app import tracing
+
+BM25_FILENAME = "bm25_index.pkl" # saved in the Chroma persist directory, next to the collection it indexes
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from has have how i in is it its me my of on or "
+    "should so that the their there these this to was what when which who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """ lower-cased words and numbers without stopwords; drug names and lab terms like egfr stay whole.
+    """
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index over the chunks of the Chroma collection, keyed by chunk id,
+    with each chunk's topic so searches can be limited to some topics.
+    Built from the collection (build_from_collection) and saved to disk next to it.
+    """
+
+    def __init__(self, ids: List[str], lengths: array, postings: Dict[str, Tuple[array, array]], k1: float = 1.5, b: float = 0.75,
+                 topics: Optional[List[str]] = None):
+        self.ids = ids
+        self.lengths = lengths
+        self.postings = postings # term -> (chunk positions, term frequencies)
+        self.topics = topics or [""] * len(ids) # by chunk position, "" for chunks stored without one
+        self.positions = {chunk_id: pos for pos, chunk_id in enumerate(ids)}
+        self.k1 = k1
+        self.b = b
+        self.avg_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+
+    @classmethod
+    def build(cls, chunks: Iterable[Tuple[str, str, str]]) -> "BM25Index":
+        """ chunks are (id, text, topic) triples.
+        """
+        ids: List[str] = []
+        topics: List[str] = []
+        lengths = array("I")
+        postings: Dict[str, Tuple[array, array]] = {}
+        for pos, (chunk_id, text, topic) in enumerate(chunks):
+            tokens = tokenize(text)
+            ids.append(chunk_id)
+            topics.append(topic)
+            lengths.append(len(tokens))
+            counts: Dict[str, int] = {}
+            for t in tokens:
+                counts[t] = counts.get(t, 0) + 1
+            for term, tf in counts.items():
+                docs, tfs = postings.setdefault(term, (array("I"), array("I")))
+                docs.append(pos)
+                tfs.append(tf)
+        return cls(ids, lengths, postings, topics=topics)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def topic(self, chunk_id: str) -> str:
+        pos = self.positions.get(chunk_id)
+        return self.topics[pos] if pos is not None else ""
+
+    def search(self, query: str, k: int = 20, topics: Optional[Collection[str]] = None) -> List[Tuple[str, float]]:
+        """ returns up to k (chunk id, score) pairs, best first, only of chunks in topics if given.
+        """
+        n = len(self.ids)
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            docs, tfs = posting
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for pos, tf in zip(docs, tfs):
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[pos] / self.avg_length)
+                scores[pos] = scores.get(pos, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        if topics is not None:
+            scores = {pos: score for pos, score in scores.items() if self.topics[pos] in topics}
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.ids[pos], score) for pos, score in best]
+
+    def coverage(self, query: str, chunk_id: str) -> float:
+        """ share of the query's IDF weight in words the chunk contains, 1.0 when it has them all.
+        Words the index has never seen weigh the most, so off-topic questions score low.
+        """
+        n = len(self.ids)
+        pos = self.positions.get(chunk_id)
+        total = matched = 0.0
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            df = len(posting[0]) if posting is not None else 0
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            total += idf
+            if posting is not None and pos is not None:
+                docs = posting[0] # positions ascending, as indexed
+                i = bisect_left(docs, pos)
+                if i < len(docs) and docs[i] == pos:
+                    matched += idf
+        return matched / total if total else 0.0
+
+    def save(self, path: str) -> None:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(
+                {"ids": self.ids, "lengths": self.lengths, "postings": self.postings, "k1": self.k1, "b": self.b, "topics": self.topics},
+                f, protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp_path, path) # a running app never reads a half-written index
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        return cls(data["ids"], data["lengths"], data["postings"], data["k1"], data["b"], data.get("topics"))
+
+
+def iter_collection_chunks(collection: Any, page_size: int = 5000) -> Iterable[Tuple[str, str, str]]:
+    """ yields (id, text, topic) for every chunk of a chromadb collection.
+    """
+    offset = 0
+    while True:
+        got = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        for chunk_id, text, meta in zip(got["ids"], got["documents"], got["metadatas"]):
+            yield chunk_id, text, (meta or {}).get("topic", "")
+        if len(got["ids"]) < page_size:
+            return
+        offset += page_size
+
+
+def build_from_collection(collection: Any, persist_directory: str) -> BM25Index:
+    """ (re)builds the BM25 index of the collection and saves it in persist_directory.
+    """
+    index = BM25Index.build(iter_collection_chunks(collection))
+    index.save(os.path.join(persist_directory, BM25_FILENAME))
+    return index
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """ fuses ranked id lists: each id scores sum(1 / (k + rank)) over the lists it is in.
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class CrossEncoderReranker:
+    """
+    Scores (query, chunk) pairs with a sentence-transformers cross-encoder on CPU, in small
+    batches until the latency budget is spent; chunks left unscored keep their fused order.
+    """
+
+    def __init__(self, model_name: str, budget_ms: float = 200, batch_size: int = 4):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, device="cpu")
+        self.budget = budget_ms / 1000
+        self.batch_size = batch_size
+
+    def rerank(self, query: str, docs: List[Any]) -> Tuple[List[Any], int]:
+        """ returns the reordered docs and how many were scored.
+        """
+        start = time.perf_counter()
+        scored: List[Tuple[float, int]] = []
+        for i in range(0, len(docs), self.batch_size):
+            if scored and time.perf_counter() - start > self.budget:
+                break
+            batch = docs[i:i + self.batch_size]
+            scores = self.model.predict([(query, d.page_content) for d in batch])
+            scored.extend((float(s), i + j) for j, s in enumerate(scores))
+        scored.sort(reverse=True)
+        order = [i for _, i in scored] + list(range(len(scored), len(docs)))
+        return [docs[i] for i in order], len(scored)
+
+
+def doc_key(doc: Any) -> str:
+    meta = doc.metadata or {}
+    return getattr(doc, "id", None) or f"{meta.get('page')}:{meta.get('chunk_index', meta.get('chunk'))}"
+
+
+def cosine_from_distance(distance: float, space: str = "l2") -> float:
+    """ cosine similarity of unit vectors from a Chroma distance (squared L2 by default).
+    """
+    return 1 - distance / 2 if space == "l2" else 1 - distance
+
+
+TOPIC_MODES = ("off", "boost", "filter")
+
+
+class HybridRetriever:
+    """
+    Vector search and BM25 over the same collection, fused with reciprocal-rank fusion,
+    optionally reranked by a cross-encoder. Without a BM25 index it is plain vector search.
+
+    How many chunks are returned adapts to the query: only as many as there are vector
+    matches with a cosine similarity of at least min_score and within score_gap of the best
+    one (at least min_k of those above min_score, at most max_k). An empty list when even
+    the best match is below min_score (and no keyword hit qualifies, see below), which tells
+    the caller the textbook has nothing on the question. The defaults always return 6.
+
+    Searches can be given the topics of the patient's diagnosis. topic_mode "filter" only
+    searches chunks of those topics (all of them again if none is relevant enough), "boost"
+    searches everything but ranks chunks of those topics higher, "off" ignores them.
+
+    With a BM25 index, a question no vector match is relevant enough for still gets the
+    keyword hits that contain at least keyword_min_coverage of its IDF weight (see
+    BM25Index.coverage): exact drug names and lab terms the embedding model scores low.
+    """
+
+    def __init__(self, vect_store: Any, bm25: Optional[BM25Index] = None, reranker: Optional[CrossEncoderReranker] = None,
+                 candidates: int = 20, rrf_k: int = 60, rerank_top: int = 12,
+                 min_score: float = -1.0, score_gap: float = 2.0, min_k: int = 6, max_k: int = 6, topic_mode: str = "off",
+                 keyword_min_coverage: float = 0.6):
+        if topic_mode not in TOPIC_MODES:
+            raise ValueError(f"topic_mode must be one of {TOPIC_MODES}, got {topic_mode!r}")
+        self.vect_store = vect_store
+        self.bm25 = bm25
+        self.reranker = reranker
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.rerank_top = rerank_top
+        self.min_score = min_score
+        self.score_gap = score_gap
+        self.min_k = min_k
+        self.max_k = max_k
+        self.topic_mode = topic_mode
+        self.keyword_min_coverage = keyword_min_coverage
+        collection = getattr(vect_store, "_collection", None)
+        self.space = ((getattr(collection, "metadata", None) or {}).get("hnsw:space", "l2"))
+        self.stats: Dict[str, int] = {"queries": 0, "insufficient": 0, "chunks": 0, "topic_fallbacks": 0, "keyword_only": 0}
+
+    def _fetch(self, ids: List[str]) -> Dict[str, Any]:
+        """ Documents for chunk ids found only by BM25.
+        """
+        from langchain_core.documents import Document
+        got = self.vect_store.get(ids=ids, include=["documents", "metadatas"])
+        return {
+            chunk_id: Document(id=chunk_id, page_content=text, metadata=meta or {})
+            for chunk_id, text, meta in zip(got["ids"], got["documents"], got["metadatas"])
+        }
+
+    def adaptive_k(self, scores: List[float]) -> int:
+        """ chunks worth returning for vector match scores sorted best first, 0 for none.
+        """
+        if not scores or scores[0] < self.min_score:
+            return 0
+        relevant = sum(1 for s in scores if s >= self.min_score)
+        close = sum(1 for s in scores if s >= scores[0] - self.score_gap)
+        return min(relevant, max(close, self.min_k), self.max_k) # min_k overrides the gap, never min_score
+
+    def _vector_search(self, query_vector: List[float], topics: Optional[List[str]], stats: Dict[str, float]) -> Tuple[List[Any], List[float]]:
+        """ returns the vector candidates, only of topics if given, and their cosine similarities.
+        """
+        start = time.perf_counter()
+        kwargs = {"filter": {"topic": {"$in": topics}}} if topics else {}
+        with tracing.span("chroma_search", filtered=bool(topics)):
+            scored = self.vect_store.similarity_search_by_vector_with_relevance_scores(
+                query_vector, k=self.candidates if self.bm25 or self.topic_mode == "boost" else self.max_k, **kwargs
+            )
+        stats["vector_ms"] = stats.get("vector_ms", 0.0) + (time.perf_counter() - start) * 1000
+        return [doc for doc, _ in scored], [round(cosine_from_distance(distance, self.space), 3) for _, distance in scored]
+
+    def retrieve(self, query: str, query_vector: List[float], topics: Optional[List[str]] = None) -> Tuple[List[Any], Dict[str, float]]:
+        """ returns the best chunks (possibly none) and retrieval stats: milliseconds spent in
+        each stage, the best vector match score and the number of chunks returned.
+        topics are those of the patient's diagnosis, used as topic_mode says.
+        """
+        stats: Dict[str, float] = {}
+        topics = topics if topics and self.topic_mode != "off" else None
+        only = topics if self.topic_mode == "filter" else None
+        vector_docs, scores = self._vector_search(query_vector, only, stats)
+        k = self.adaptive_k(scores)
+        if k == 0 and only:  # nothing relevant in the patient's chapters, search them all
+            self.stats["topic_fallbacks"] += 1
+            only = None
+            vector_docs, scores = self._vector_search(query_vector, None, stats)
+            k = self.adaptive_k(scores)
+        stats["top_score"] = scores[0] if scores else 0.0
+        self.stats["queries"] += 1
+        if k == 0 and self.bm25 is not None:
+            docs = self._keyword_hits(query, vector_docs, only, stats)
+            if docs:
+                self.stats["keyword_only"] += 1
+                stats["k"] = len(docs)
+                stats["keyword_only"] = 1
+                self.stats["chunks"] += len(docs)
+                return docs, stats
+        if k == 0:
+            self.stats["insufficient"] += 1
+            stats["k"] = 0
+            return [], stats
+
+        if self.bm25 is None and not (topics and self.topic_mode == "boost"):
+            docs = vector_docs[:k]
+        else:
+            docs = self._fuse(query, vector_docs, k, stats, topics, only)
+        stats["k"] = len(docs)
+        if topics:
+            stats["on_topic"] = sum(1 for d in docs if (d.metadata or {}).get("topic") in topics)
+        self.stats["chunks"] += len(docs)
+        return docs, stats
+
+    def _keyword_hits(self, query: str, vector_docs: List[Any], only: Optional[List[str]], stats: Dict[str, float]) -> List[Any]:
+        """ the BM25 hits (best first, at most max_k) that cover enough of the question to answer it
+        without a relevant vector match, an empty list when none does.
+        """
+        start = time.perf_counter()
+        ids = [
+            chunk_id for chunk_id, _ in self.bm25.search(query, self.max_k, only)
+            if self.bm25.coverage(query, chunk_id) >= self.keyword_min_coverage
+        ]
+        by_key = {doc_key(d): d for d in vector_docs}
+        missing = [chunk_id for chunk_id in ids if chunk_id not in by_key]
+        if missing:
+            by_key.update(self._fetch(missing))
+        stats["bm25_ms"] = (time.perf_counter() - start) * 1000
+        return [by_key[chunk_id] for chunk_id in ids if chunk_id in by_key]
+
+    def _fuse(self, query: str, vector_docs: List[Any], k: int, stats: Dict[str, float],
+              topics: Optional[List[str]], only: Optional[List[str]]) -> List[Any]:
+        by_key = {doc_key(d): d for d in vector_docs}
+        rankings = [list(by_key)]
+        if self.bm25 is not None:
+            start = time.perf_counter()
+            rankings.append([chunk_id for chunk_id, _ in self.bm25.search(query, self.candidates, only)])
+            stats["bm25_ms"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        fused = reciprocal_rank_fusion(rankings, k=self.rrf_k)
+        if topics and self.topic_mode == "boost": # the on-topic chunks ranked once more, in fused order
+            on_topic = [key for key, _ in fused if self._topic(key, by_key) in topics]
+            fused = reciprocal_rank_fusion(rankings + [on_topic], k=self.rrf_k)
+        top_n = max(self.rerank_top, k) if self.reranker else k
+        top = [key for key, _ in fused[:top_n]]
+        missing = [key for key in top if key not in by_key]
+        if missing:
+            by_key.update(self._fetch(missing))
+        docs = [by_key[key] for key in top if key in by_key]
+        stats["fuse_ms"] = (time.perf_counter() - start) * 1000
+
+        if self.reranker is not None:
+            start = time.perf_counter()
+            docs, reranked = self.reranker.rerank(query, docs)
+            stats["rerank_ms"] = (time.perf_counter() - start) * 1000
+            stats["reranked"] = reranked
+        return docs[:k]
+
+    def _topic(self, key: str, by_key: Dict[str, Any]) -> str:
+        doc = by_key.get(key)
+        if doc is not None:
+            return (doc.metadata or {}).get("topic", "")
+        return self.bm25.topic(key) if self.bm25 is not None else ""
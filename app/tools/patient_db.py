@@ -1,58 +1,245 @@
 # app/tools/patient_db.py
 
-import json
+import math
 import os
-from typing import List, Dict, Any
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import List, Dict, Any, Iterable, Optional, Sequence, Tuple
 
-# In-memory cache
-patients:List[Dict] = []
+from app.concurrency import Lazy
+from app.logging_setup import logger
+from app.tools.patient_source import PatientSource, SQLitePatientRecords, make_patient_source
 
+PATIENTS_PATH = os.getenv("PATIENTS_PATH", "data/patients.json") # .json array or .jsonl, one record per line
+PATIENTS_DB_PATH = os.getenv("PATIENTS_DB_PATH", "patients.db") # where a .jsonl source is stored
+PATIENTS_RELOAD_SECONDS = float(os.getenv("PATIENTS_RELOAD_SECONDS", "30")) # how often to check the file for changes, 0 to never
+PATIENT_MATCH_MIN_SCORE = float(os.getenv("PATIENT_MATCH_MIN_SCORE", "0.5")) # below this a fuzzy match is not offered
+PARTIAL_NAME_SCORE = 0.9 # every word of the query is a word of the name, e.g. "john" for "John Smith"
+MATCH_MARGIN = 0.05 # fuzzy matches this close to the best one are returned together
 
-def load_patients() -> List[Dict[str, Any]]:
-    """Load patient data from JSON file."""
-    global patients
 
-    if patients:  # already loaded
-        return patients
+def normalise_name(name: str) -> str:
+    """normalize spaces and lower-case"""
+    return " ".join(name.strip().split()).lower()
 
-    fp = "data/patients.json" # retriving the file
 
-    if not os.path.exists(fp):
-        raise FileNotFoundError("Patient data file not found.") #throwing error if the file is not foundes
+def name_trigrams(name: str) -> set:
+    """Character trigrams of a normalised name, padded so first and last letters count."""
+    padded = f" {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
 
-    with open(fp, "r", encoding="utf-8") as f:
-        patients = json.load(f)# loading json file into list
 
-    return patients
+class PatientIndex:
+    """
+    Lookup structures over the patient records:
+    - normalised name -> records, for exact hits,
+    - word and trigram inverted indexes over the distinct names, for partial and
+      typo-tolerant matches ranked by trigram (Dice) similarity,
+    - discharge_date -> records, for disambiguating patients who share a name.
+    """
+
+    def __init__(self, records: Sequence[Dict[str, Any]], min_score: float = PATIENT_MATCH_MIN_SCORE):
+        self.records = records
+        self.min_score = min_score
+        self._count = 0 # records indexed so far
+
+        self._by_name: Dict[str, array] = {} # normalised name -> record positions
+        self._by_date: Dict[str, array] = {} # discharge_date -> record positions
+        self._names: List[str] = [] # name id -> normalised name
+        self._by_word: Dict[str, array] = {} # word -> name ids
+        self._by_trigram: Dict[str, array] = {} # trigram -> name ids, ascending
+        self._trigram_counts = array("H") # name id -> number of distinct trigrams
+        self.add(records.summaries() if isinstance(records, SQLitePatientRecords) else records)
+
+    def add(self, records: Iterable[Dict[str, Any]]) -> None:
+        """
+        Index records stored after the ones already indexed. Safe while other threads search:
+        a name id only appears in the postings once everything it points at is in place.
+        """
+        for record in records:
+            pos = self._count
+            self._by_date.setdefault(str(record.get("discharge_date", "")), array("I")).append(pos)
+            name = normalise_name(record.get("patient_name", ""))
+            positions = self._by_name.get(name)
+            if positions is None:
+                name_id = len(self._names)
+                grams = name_trigrams(name)
+                self._names.append(name)
+                self._trigram_counts.append(len(grams))
+                self._by_name[name] = array("I", [pos])
+                for word in set(name.split()):
+                    self._by_word.setdefault(word, array("I")).append(name_id)
+                for gram in grams:
+                    self._by_trigram.setdefault(gram, array("I")).append(name_id)
+            else:
+                positions.append(pos)
+            self._count += 1
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _partial(self, target: str) -> Iterable[int]:
+        postings = [self._by_word.get(word) for word in set(target.split())]
+        if not all(postings):
+            return ()
+        postings.sort(key=len) # intersect starting from the rarest word
+        ids = set(postings[0])
+        for ids_with_word in postings[1:]:
+            ids.intersection_update(ids_with_word)
+        return ids
+
+    def _similar(self, target: str) -> List[Tuple[float, int]]:
+        grams = name_trigrams(target)
+        # Dice >= min_score needs at least this many shared trigrams
+        need = max(1, math.ceil(self.min_score * len(grams) / (2 - self.min_score)))
+        postings = sorted((self._by_trigram.get(g, ()) for g in grams), key=len)
+        # count shared trigrams over every posting list but the longest, which is only
+        # binary-searched for the names that can still reach need
+        longest = postings.pop() if need > 1 else ()
+        shared: Counter = Counter()
+        for ids in postings:
+            shared.update(ids)
+
+        scored = []
+        for name_id, count in shared.items():
+            if count + 1 < need:
+                continue
+            i = bisect_left(longest, name_id)
+            if i < len(longest) and longest[i] == name_id:
+                count += 1
+            score = 2 * count / (len(grams) + self._trigram_counts[name_id])
+            if score >= self.min_score:
+                scored.append((score, name_id))
+        return scored
+
+    def search(self, name: str, limit: int = 10) -> List[Tuple[float, str]]:
+        """
+        Rank the distinct patient names against name, best first, as (score, normalised name).
+        An exact match scores 1.0.
+        """
+        target = normalise_name(name)
+        if not target:
+            return []
+        scores: Dict[int, float] = {name_id: PARTIAL_NAME_SCORE for name_id in self._partial(target)}
+        if not scores: # whole-word matches rank above misspellings, only look for those without any
+            scores = {name_id: score for score, name_id in self._similar(target)}
+        ranked = sorted(((score, self._names[name_id]) for name_id, score in scores.items()), reverse=True)
+        if target in self._by_name:
+            ranked = [(1.0, target)] + [r for r in ranked if r[1] != target]
+        return ranked[:limit]
+
+    def find_by_name(self, name: str, discharge_date: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Records of the exact name, or failing that of the best partial / fuzzy matches.
+        With discharge_date, only the records discharged on that date.
+        """
+        target = normalise_name(name)
+        positions = self._by_name.get(target)
+        if positions is None:
+            ranked = self.search(target, limit=len(self._names))
+            best = ranked[0][0] if ranked else 0.0
+            positions = [pos for score, n in ranked if score >= best - MATCH_MARGIN for pos in self._by_name[n]]
+
+        if discharge_date is not None:
+            on_date = self._by_date.get(discharge_date.strip(), ())
+            if len(on_date) < len(positions):
+                wanted = set(positions)
+                positions = [pos for pos in on_date if pos in wanted]
+            else:
+                on_date = set(on_date)
+                positions = [pos for pos in positions if pos in on_date]
+        return [self.records[pos] for pos in positions]
+
+    def is_exact(self, name: str) -> bool:
+        """Whether name is, once normalised, the full name of a patient (not a partial or fuzzy match)."""
+        return normalise_name(name) in self._by_name
+
+    def find_by_discharge_date(self, discharge_date: str) -> List[Dict[str, Any]]:
+        return [self.records[pos] for pos in self._by_date.get(discharge_date.strip(), ())]
+
+
+class PatientRegistry:
+    """
+    Holds the PatientIndex over the current patient source and keeps it in step with the
+    file: lines appended to a JSON Lines source are indexed in place, any other change
+    builds a new index in the background and swaps it in once complete. Requests already
+    holding the old index finish on it.
+    """
+
+    def __init__(self, source: PatientSource, reload_seconds: float = 0):
+        self.source = source
+        self.reload_seconds = reload_seconds
+        self.index = PatientIndex(source.load())
+        if reload_seconds > 0:
+            threading.Thread(target=self._watch, name="patient-reload", daemon=True).start()
+
+    def refresh(self) -> bool:
+        """ picks up changes to the source file, returns whether there were any.
+        """
+        if not self.source.changed():
+            return False
+        start = time.perf_counter()
+        appended = self.source.load_appended()
+        if appended is not None:
+            self.index.add(appended)
+            logger.info("PATIENTS indexed %d appended records in %.2f s", len(appended), time.perf_counter() - start)
+        else:
+            self.index = PatientIndex(self.source.load())
+            logger.info("PATIENTS rebuilt index of %d records in %.2f s", len(self.index), time.perf_counter() - start)
+        return True
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(self.reload_seconds)
+            try:
+                self.refresh()
+            except Exception: # e.g. the file is mid-rewrite, try again next time
+                logger.exception("PATIENTS reload of %s failed", self.source.path)
+
+
+def _load_registry() -> PatientRegistry:
+    """Load patient data from the source file and index it."""
+    return PatientRegistry(make_patient_source(PATIENTS_PATH, PATIENTS_DB_PATH), PATIENTS_RELOAD_SECONDS)
+
+
+_registry = Lazy("patient_index", _load_registry) # In-memory cache
+
 
+def get_index() -> PatientIndex:
+    return _registry.get().index
 
-def get_all_patients() -> List[Dict]:
+
+def load_patients() -> Sequence[Dict[str, Any]]:
+    """Load patient data from the source file."""
+    return get_index().records
+
+
+def get_all_patients() -> Sequence[Dict]:
     """Return all patient records."""
     return load_patients()
 
 
 def find_patient_by_name(name: str) -> List[Dict[str, Any]]:
     """
-    Find patients by name.
-    """
-    patients = load_patients()
-
-    # normalize spaces and lower-case
-    target = " ".join(name.strip().split()).lower()
-
-    # 1) exact matches
-    exact_matches: List[Dict[str, Any]] = [
-        p
-        for p in patients
-        if " ".join(p.get("patient_name", "").strip().split()).lower() == target
-    ]
-    if exact_matches:
-        return exact_matches
-
-    # 2) fallback: substring matches
-    substring_matches: List[Dict[str, Any]] = [
-        p
-        for p in patients
-        if target in p.get("patient_name", "").lower()
-    ]
-    return substring_matches
+    Find patients by name: exact matches first, otherwise the best partial or
+    misspelt matches (e.g. "Jon Smith" finds John Smith).
+    """
+    return get_index().find_by_name(name)
+
+
+def is_exact_patient_name(name: str) -> bool:
+    """
+    Whether find_patient_by_name(name) found the name itself rather than partial or
+    misspelt matches, which must not be taken as the patient's identity on their own.
+    """
+    return get_index().is_exact(name)
+
+
+def find_patient_by_name_and_date(name: str, discharge_date: str) -> List[Dict[str, Any]]:
+    """
+    Patients found by find_patient_by_name who were discharged on discharge_date.
+    """
+    return get_index().find_by_name(name, discharge_date=discharge_date)
@@ -0,0 +1,284 @@
+# app/tools/patient_source.py
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app.logging_setup import logger
+
+Fingerprint = Tuple[int, int, int] # (inode, size, mtime_ns) of the source file
+Row = Tuple[Dict[str, Any], str] # (record, its JSON text)
+
+
+def file_fingerprint(path: str) -> Fingerprint:
+    st = os.stat(path)
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def tail_digest(path: str, offset: int, size: int = 4096) -> str:
+    """ sha1 of the size bytes before offset, to tell an append from an edit of the stored part.
+    """
+    with open(path, "rb") as f:
+        f.seek(max(0, offset - size))
+        return hashlib.sha1(f.read(min(offset, size))).hexdigest()
+
+
+class PatientSource(ABC):
+    """
+    Where patient records come from. load() returns every record as a sequence indexed
+    by position; changed() is cheap and is polled to notice edits to the file.
+    """
+
+    def __init__(self, path: str):
+        if not os.path.exists(path):
+            raise FileNotFoundError("Patient data file not found.")
+        self.path = path
+        self.fingerprint: Optional[Fingerprint] = None # of the file as last loaded
+
+    def changed(self) -> bool:
+        return file_fingerprint(self.path) != self.fingerprint
+
+    @abstractmethod
+    def load(self) -> Sequence[Dict[str, Any]]:
+        ...
+
+    def load_appended(self) -> Optional[List[Dict[str, Any]]]:
+        """
+        Records added to the end of the file since the last load, stored after the
+        existing ones. None when the file changed in some other way and must be reloaded.
+        """
+        return None
+
+
+class JsonPatientSource(PatientSource):
+    """A JSON array of records (data/patients.json), read whole into memory."""
+
+    def load(self) -> List[Dict[str, Any]]:
+        fingerprint = file_fingerprint(self.path)
+        with open(self.path, "r", encoding="utf-8") as f:
+            records = json.load(f)
+        self.fingerprint = fingerprint
+        return records
+
+
+class SQLitePatientRecords(Sequence):
+    """
+    Patient records kept in a SQLite file and read on demand by position, so only the
+    lookup indexes have to fit in memory. Positions are rowid - 1.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # one connection shared by the request threads; it keeps reading this file even
+        # after a rebuild replaces the path, so in-flight lookups see a consistent generation
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._len = self._conn.execute("SELECT COUNT(*) FROM patients").fetchone()[0]
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [self[i] for i in range(*pos.indices(self._len))]
+        if not 0 <= pos < self._len:
+            raise IndexError(pos)
+        with self._lock:
+            row = self._conn.execute("SELECT record FROM patients WHERE id = ?", (pos + 1,)).fetchone()
+        return json.loads(row[0])
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        # a separate connection so a long scan does not hold the lock
+        conn = sqlite3.connect(self.path)
+        try:
+            for (record,) in conn.execute("SELECT record FROM patients WHERE id <= ? ORDER BY id", (self._len,)):
+                yield json.loads(record)
+        finally:
+            conn.close()
+
+    def summaries(self) -> Iterator[Dict[str, Any]]:
+        """ yields just the name and discharge date of each record, from their own columns,
+        which is all PatientIndex needs and much cheaper than decoding the records.
+        """
+        conn = sqlite3.connect(self.path)
+        try:
+            for name, date in conn.execute("SELECT patient_name, discharge_date FROM patients WHERE id <= ? ORDER BY id", (self._len,)):
+                yield {"patient_name": name, "discharge_date": date}
+        finally:
+            conn.close()
+
+    def append_rows(self, rows: List[Row]) -> None:
+        with self._lock, self._conn:
+            _insert(self._conn, self._len, rows)
+        self._len += len(rows)
+
+    def set_meta(self, **values: Any) -> None:
+        with self._lock, self._conn:
+            _write_meta(self._conn, **values)
+
+    def get_meta(self, key: str) -> Any:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def _create_schema(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        "CREATE TABLE patients (id INTEGER PRIMARY KEY, patient_name TEXT, name_key TEXT, discharge_date TEXT, record TEXT NOT NULL)"
+    )
+    conn.execute("CREATE INDEX patients_name_key ON patients(name_key)")
+    conn.execute("CREATE INDEX patients_discharge_date ON patients(discharge_date)")
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+
+
+def _write_meta(conn: sqlite3.Connection, **values: Any) -> None:
+    conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [(k, json.dumps(v)) for k, v in values.items()])
+
+
+def _complete_record(line: bytes) -> Optional[Row]:
+    """ the record on a last line that has no newline, None if it is not whole JSON yet.
+    """
+    text = line.decode("utf-8", errors="replace").strip()
+    try:
+        return json.loads(text), text
+    except ValueError:
+        return None
+
+
+def _insert(conn: sqlite3.Connection, first_pos: int, rows: List[Row]) -> None:
+    conn.executemany(
+        "INSERT INTO patients (id, patient_name, name_key, discharge_date, record) VALUES (?, ?, ?, ?, ?)",
+        [
+            (
+                first_pos + i + 1,
+                r.get("patient_name"),
+                " ".join(str(r.get("patient_name", "")).split()).lower(),
+                r.get("discharge_date"),
+                text,
+            )
+            for i, (r, text) in enumerate(rows)
+        ],
+    )
+
+
+class JsonLinesPatientSource(PatientSource):
+    """
+    One JSON record per line, streamed into a SQLite store (db_path) in batches so the
+    file is never held in memory. The store is reused across restarts while the file is
+    unchanged, and lines appended to the file are added to it without a rebuild.
+    """
+
+    def __init__(self, path: str, db_path: str, batch_size: int = 5000):
+        super().__init__(path)
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.offset = 0 # bytes of the file already stored
+        self.store: Optional[SQLitePatientRecords] = None
+
+    def _read_lines(self, offset: int, end: Optional[int] = None) -> Iterator[Tuple[List[Row], int]]:
+        """ yields (batch of rows, file offset after the batch), starting at offset.
+        A last line without a newline is taken when it ends at end (the file has not grown
+        since it was fingerprinted) and is valid JSON; otherwise it may still be being
+        written and is left for later.
+        """
+        batch: List[Row] = []
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    record = _complete_record(line) if offset + len(line) == end else None
+                    if record is not None:
+                        batch.append(record)
+                        offset += len(line)
+                    elif line.strip():
+                        log = logger.info if end is None else logger.warning
+                        log("PATIENTS left %d bytes without a newline at the end of %s for later", len(line), self.path)
+                    break
+                offset += len(line)
+                text = line.decode("utf-8").strip()
+                if text:
+                    batch.append((json.loads(text), text))
+                if len(batch) >= self.batch_size:
+                    yield batch, offset
+                    batch = []
+        yield batch, offset
+
+    def _reuse_store(self, fingerprint: Fingerprint) -> bool:
+        if not os.path.exists(self.db_path):
+            return False
+        try:
+            store = SQLitePatientRecords(self.db_path)
+        except sqlite3.Error:
+            return False
+        if store.get_meta("source") != [os.path.abspath(self.path), *fingerprint]:
+            store.close()
+            return False
+        self.store, self.offset = store, store.get_meta("offset")
+        return True
+
+    def load(self) -> SQLitePatientRecords:
+        fingerprint = file_fingerprint(self.path)
+        if self._reuse_store(fingerprint):
+            logger.info("PATIENTS reusing %s (%d records)", self.db_path, len(self.store))
+            self.fingerprint = fingerprint
+            return self.store
+
+        # per process, so workers starting together don't write into each other's build
+        tmp_path = f"{self.db_path}.{os.getpid()}.new"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        count, offset = 0, 0
+        try:
+            with conn:
+                _create_schema(conn)
+            for batch, offset in self._read_lines(0, fingerprint[1]):
+                with conn:
+                    _insert(conn, count, batch)
+                count += len(batch)
+            with conn: # before publishing, so a worker opening the store never finds it without meta
+                _write_meta(conn, source=[os.path.abspath(self.path), *fingerprint], offset=offset, tail=tail_digest(self.path, offset))
+        except BaseException:
+            conn.close()
+            os.remove(tmp_path)
+            raise
+        conn.close()
+        os.replace(tmp_path, self.db_path) # the old store stays readable through its open connection
+
+        self.store = SQLitePatientRecords(self.db_path)
+        self.fingerprint, self.offset = fingerprint, offset
+        logger.info("PATIENTS imported %d records from %s into %s", count, self.path, self.db_path)
+        return self.store
+
+    def load_appended(self) -> Optional[List[Dict[str, Any]]]:
+        fingerprint = file_fingerprint(self.path)
+        if self.store is None or self.fingerprint is None:
+            return None
+        if fingerprint[0] != self.fingerprint[0] or fingerprint[1] < self.offset:
+            return None # replaced or truncated
+        if tail_digest(self.path, self.offset) != self.store.get_meta("tail"):
+            return None # the stored part was edited
+        appended: List[Dict[str, Any]] = []
+        for batch, offset in self._read_lines(self.offset):
+            self.store.append_rows(batch)
+            appended.extend(record for record, _ in batch)
+            self.offset = offset
+        self.fingerprint = fingerprint
+        self.store.set_meta(source=[os.path.abspath(self.path), *fingerprint], offset=self.offset, tail=tail_digest(self.path, self.offset))
+        return appended
+
+
+def make_patient_source(path: str, db_path: str) -> PatientSource:
+    """
+    A JSON Lines source for .jsonl files, otherwise a JSON array source.
+    """
+    if path.endswith(".jsonl"):
+        return JsonLinesPatientSource(path, db_path)
+    return JsonPatientSource(path)
@@ -0,0 +1,70 @@
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+# nephrology topics roughly following the sections of the textbook; a chunk gets the topic of
+# its chapter at ingestion, a patient the topics of their primary diagnosis
+TOPIC_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "aki": ("acute kidney injury", "aki", "acute renal failure", "acute tubular necrosis", "contrast nephropathy", "rhabdomyolysis"),
+    "ckd": ("chronic kidney disease", "ckd", "chronic renal failure", "progression of kidney disease", "renal osteodystrophy", "mineral and bone"),
+    "dialysis": ("dialysis", "hemodialysis", "haemodialysis", "end-stage", "end stage", "esrd", "esrf", "vascular access", "fistula"),
+    "transplant": ("transplant", "allograft", "rejection", "immunosuppress"),
+    "glomerular": (
+        "glomerul", "nephrotic", "nephritic", "nephritis", "iga nephropathy", "membranous", "minimal change",
+        "fsgs", "proteinuria", "hematuria", "haematuria", "vasculitis",
+    ),
+    "diabetic": ("diabetic", "diabetes"),
+    "hypertension": ("hypertens", "blood pressure", "renovascular", "renal artery stenosis"),
+    "electrolytes": ("hyperkal", "hypokal", "potassium", "hyponat", "hypernat", "sodium", "acid-base", "acidosis", "alkalosis", "magnesium", "fluid", "edema", "oedema"),
+    "stones": ("stone", "calculi", "nephrolithiasis", "urolithiasis"),
+    "cystic": ("polycystic", "cystic", "renal cyst", "hereditary", "genetic"),
+    "infection": ("urinary tract infection", "uti", "pyelonephritis", "infection"),
+    "urologic": ("obstruction", "obstructive", "hydronephrosis", "trauma", "urolog", "tumor", "tumour", "cancer"),
+    "pregnancy": ("pregnan", "preeclampsia", "pre-eclampsia"),
+    "pharmacology": ("drug", "pharmacolog", "dosing", "nephrotoxic"),
+}
+
+# chapters a patient with the topic's diagnosis also often needs (diet, drugs, what comes next)
+RELATED_TOPICS: Dict[str, Tuple[str, ...]] = {
+    "aki": ("electrolytes", "pharmacology"),
+    "ckd": ("electrolytes", "hypertension", "pharmacology", "dialysis"),
+    "dialysis": ("ckd", "electrolytes"),
+    "transplant": ("pharmacology", "infection"),
+    "glomerular": ("electrolytes",),
+    "diabetic": ("ckd", "hypertension"),
+    "hypertension": ("ckd",),
+}
+
+GENERAL_TOPIC = "general" # chunks of chapters that match no topic
+
+_PATTERNS = {
+    topic: re.compile(r"\b(?:" + "|".join(re.escape(k) for k in keywords) + r")", re.IGNORECASE)
+    for topic, keywords in TOPIC_KEYWORDS.items()
+}
+
+
+def topics_in(text: str) -> List[str]:
+    """ every topic mentioned in text (e.g. a diagnosis or a chapter title), in TOPIC_KEYWORDS order.
+    """
+    return [topic for topic, pattern in _PATTERNS.items() if pattern.search(text or "")]
+
+
+def diagnosis_topics(diagnosis: str) -> List[str]:
+    """ the topics of a primary diagnosis followed by their related topics.
+    """
+    found = topics_in(diagnosis)
+    for topic in list(found):
+        found.extend(t for t in RELATED_TOPICS.get(topic, ()) if t not in found)
+    return found
+
+
+def main_topic(heading: str, text: str = "") -> str:
+    """ the topic of a chunk: the first one its chapter heading mentions, else the one its
+    text mentions most, else GENERAL_TOPIC.
+    """
+    found = topics_in(heading)
+    if found:
+        return found[0]
+    counts = Counter({topic: len(pattern.findall(text)) for topic, pattern in _PATTERNS.items()})
+    topic, hits = counts.most_common(1)[0]
+    return topic if hits else GENERAL_TOPIC
@@ -1,25 +1,235 @@
+import asyncio
+import json
 import os
-from typing import Any, Dict, List
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Dict, List, Optional
 
-from tavily import TavilyClient
 from dotenv import load_dotenv
 
+from app import tracing
+from app.concurrency import Lazy, run_blocking
+from app.logging_setup import logger
+
 load_dotenv() #loading environment variables
 
-client = TavilyClient(api_key=os.getenv("TAVILY_API_KEY")) # starting up tavily client with api
+TAVILY_BASE_URL = os.getenv("TAVILY_BASE_URL", "https://api.tavily.com")
+WEB_SEARCH_DEADLINE = float(os.getenv("WEB_SEARCH_DEADLINE", "2.5")) # seconds an answer waits for search before going on without it
+WEB_SEARCH_TIMEOUT = float(os.getenv("WEB_SEARCH_TIMEOUT", "10")) # a search past the deadline still runs this long to fill the cache
+WEB_SEARCH_MAX_CONCURRENCY = int(os.getenv("WEB_SEARCH_MAX_CONCURRENCY", "4"))
+WEB_CACHE_PATH = os.getenv("WEB_CACHE_PATH", "web_cache.db") # empty for no cache
+WEB_CACHE_TTL = float(os.getenv("WEB_CACHE_TTL", "21600")) # "latest" answers shouldn't be older than this
 
-def web_search(query: str, num_results: int = 5) -> List[Dict[str, Any]]:
-	"""Perform a web search using Tavily API."""
-	resp = client.search(query=query, num_results=num_results,include_raw_content=False,include_images=False,include_answer=False) #response by messsage
-	
+
+def normalise_query(query: str) -> str:
+	""" lower-cased words only, so rephrasings in case, spacing and punctuation share a cache entry.
+	"""
+	return " ".join(re.findall(r"\w+", query.lower()))
+
+
+class WebSearchCache:
+	"""
+	Search results stored as JSON in a SQLite file keyed on the normalised query, shared by
+	every uvicorn worker and kept across restarts. Entries older than ttl_seconds are misses.
+	"""
+
+	def __init__(self, path: str = "web_cache.db", ttl_seconds: float = 21600):
+		self.path = path
+		self.ttl_seconds = ttl_seconds
+		self._local = threading.local() # sqlite connections can't be shared between threads
+		with self._conn() as conn:
+			conn.execute("CREATE TABLE IF NOT EXISTS web_results (query TEXT PRIMARY KEY, results TEXT NOT NULL, stored_at REAL NOT NULL)")
+
+	def _conn(self) -> sqlite3.Connection:
+		conn = getattr(self._local, "conn", None)
+		if conn is None:
+			conn = sqlite3.connect(self.path, timeout=10)
+			conn.execute("PRAGMA journal_mode=WAL")
+			conn.execute("PRAGMA synchronous=NORMAL")
+			self._local.conn = conn
+		return conn
+
+	def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+		row = self._conn().execute(
+			"SELECT results FROM web_results WHERE query = ? AND stored_at >= ?",
+			(key, time.time() - self.ttl_seconds),
+		).fetchone()
+		return json.loads(row[0]) if row else None
+
+	def put(self, key: str, results: List[Dict[str, Any]]) -> None:
+		with self._conn() as conn:
+			conn.execute("INSERT OR REPLACE INTO web_results (query, results, stored_at) VALUES (?, ?, ?)", (key, json.dumps(results), time.time()))
+			conn.execute("DELETE FROM web_results WHERE stored_at < ?", (time.time() - self.ttl_seconds,))
+
+
+def _client_kwargs() -> Dict[str, Any]:
+	return {
+		"base_url": TAVILY_BASE_URL,
+		"headers": {"Authorization": f"Bearer {os.getenv('TAVILY_API_KEY', '')}"},
+		"timeout": WEB_SEARCH_TIMEOUT,
+	}
+
+
+def _make_client() -> Any:
+	import httpx
+	return httpx.Client(**_client_kwargs())
+
+
+def _make_async_client() -> Any:
+	import httpx
+	return httpx.AsyncClient(**_client_kwargs())
+
+
+def _make_cache() -> Optional[WebSearchCache]:
+	return WebSearchCache(WEB_CACHE_PATH, WEB_CACHE_TTL) if WEB_CACHE_PATH else None
+
+
+_client = Lazy("tavily_client", _make_client, required=False) # web search is optional
+_async_client = Lazy("tavily_async_client", _make_async_client, required=False)
+_cache = Lazy("web_search_cache", _make_cache, required=False)
+
+
+def get_client() -> Any:
+	return _client.get()
+
+
+def get_async_client() -> Any:
+	return _async_client.get()
+
+
+_slots = threading.BoundedSemaphore(WEB_SEARCH_MAX_CONCURRENCY)
+_search_pool = ThreadPoolExecutor(max_workers=WEB_SEARCH_MAX_CONCURRENCY, thread_name_prefix="web-search") # blocking searches, waited on with the deadline
+_async_slots: Optional[asyncio.Semaphore] = None # made on first use, in the event loop
+_inflight: Dict[str, "asyncio.Future[List[Dict[str, Any]]]"] = {} # identical searches share one request
+
+stats: Dict[str, int] = {"searches": 0, "cache_hits": 0, "requests": 0, "timeouts": 0, "errors": 0}
+
+
+def _request_body(query: str, num_results: int) -> Dict[str, Any]:
+	return {"query": query, "max_results": num_results, "include_raw_content": False, "include_images": False, "include_answer": False}
+
+
+def _parse(resp: Dict[str, Any]) -> List[Dict[str, Any]]:
 	results: List[Dict[str,Any]] = []
 	for item in resp.get("results", []):
-		result = { # appending results in below format
+		result = { # appending results in the format web_context reads
 			"title": item.get("title", ""),
-			"link": item.get("link", ""),
-			"snippet": item.get("snippet", "")
+			"url": item.get("url", ""),
+			"snippet": item.get("content", "")
 		}
 		results.append(result)
 	return results
 
 
+def _cache_key(query: str, num_results: int) -> str:
+	return f"{num_results}:{normalise_query(query)}"
+
+
+@tracing.traced("web_search")
+def web_search(query: str, num_results: int = 5) -> List[Dict[str, Any]]:
+	"""Perform a web search using Tavily API.
+	Returns cached results when there are fresh ones, and no results when the search fails
+	or takes longer than WEB_SEARCH_DEADLINE, so the answer goes on with the textbook alone.
+	A search past the deadline keeps running and caches its results.
+	"""
+	stats["searches"] += 1
+	if not os.getenv("TAVILY_API_KEY"):
+		return []
+	key, cache = _cache_key(query, num_results), _cache.get()
+	cached = cache.get(key) if cache is not None else None
+	if cached is not None:
+		stats["cache_hits"] += 1
+		tracing.annotate(cache_hit=True, results=len(cached))
+		return cached
+
+	deadline = time.monotonic() + WEB_SEARCH_DEADLINE
+	if not _slots.acquire(timeout=WEB_SEARCH_DEADLINE):
+		stats["timeouts"] += 1
+		logger.warning("WEB search skipped, %d searches already running", WEB_SEARCH_MAX_CONCURRENCY)
+		return []
+	# httpx timeouts apply to each phase (connect, every read...), so a trickling response could
+	# outlast them; the deadline is kept by waiting on the whole request instead
+	future = _search_pool.submit(_search_blocking, query, num_results, key, cache)
+	try:
+		results = future.result(timeout=max(0.0, deadline - time.monotonic()))
+	except FutureTimeout:
+		stats["timeouts"] += 1
+		tracing.annotate(missed_deadline=True)
+		logger.warning("WEB search missed the %.1f s deadline, answering without it", WEB_SEARCH_DEADLINE)
+		return []
+	tracing.annotate(results=len(results))
+	return results
+
+
+def _search_blocking(query: str, num_results: int, key: str, cache: Optional[WebSearchCache]) -> List[Dict[str, Any]]:
+	""" the Tavily request of web_search, on _search_pool. Runs on past the caller's deadline
+	(up to WEB_SEARCH_TIMEOUT per phase) and caches its results for the next identical question.
+	"""
+	try:
+		stats["requests"] += 1
+		resp = get_client().post("/search", json=_request_body(query, num_results))
+		resp.raise_for_status()
+		results = _parse(resp.json())
+		if cache is not None:
+			cache.put(key, results)
+		return results
+	except Exception as e:
+		kind = "timeouts" if "timeout" in type(e).__name__.lower() else "errors"
+		stats[kind] += 1
+		logger.warning("WEB search failed (%s): %s", type(e).__name__, e)
+		return []
+	finally:
+		_slots.release() # taken by web_search
+
+
+async def _search_async(query: str, num_results: int, key: str, cache: Optional[WebSearchCache]) -> List[Dict[str, Any]]:
+	global _async_slots
+	if _async_slots is None:
+		_async_slots = asyncio.Semaphore(WEB_SEARCH_MAX_CONCURRENCY)
+	try:
+		async with _async_slots:
+			stats["requests"] += 1
+			resp = await get_async_client().post("/search", json=_request_body(query, num_results))
+		resp.raise_for_status()
+		results = _parse(resp.json())
+		if cache is not None:
+			await run_blocking(cache.put, key, results)
+		return results
+	except Exception as e: # nobody may be waiting any more, so never let it propagate
+		stats["errors"] += 1
+		logger.warning("WEB search failed (%s): %s", type(e).__name__, e)
+		return []
+	finally:
+		_inflight.pop(key, None) # only once cached, so an identical question meanwhile joins this search instead of sending another
+
+
+@tracing.traced("web_search")
+async def web_search_async(query: str, num_results: int = 5) -> List[Dict[str, Any]]:
+	""" async version of web_search. A search that misses the deadline keeps running in the
+	background (up to WEB_SEARCH_TIMEOUT) and caches its results for the next identical question.
+	"""
+	stats["searches"] += 1
+	if not os.getenv("TAVILY_API_KEY"):
+		return []
+	key, cache = _cache_key(query, num_results), _cache.get()
+	cached = await run_blocking(cache.get, key) if cache is not None else None
+	if cached is not None:
+		stats["cache_hits"] += 1
+		tracing.annotate(cache_hit=True, results=len(cached))
+		return cached
+
+	task = _inflight.get(key)
+	if task is None:
+		task = _inflight[key] = asyncio.ensure_future(_search_async(query, num_results, key, cache))
+	try:
+		results = await asyncio.wait_for(asyncio.shield(task), WEB_SEARCH_DEADLINE)
+		tracing.annotate(results=len(results))
+		return results
+	except asyncio.TimeoutError:
+		stats["timeouts"] += 1
+		tracing.annotate(missed_deadline=True)
+		logger.warning("WEB search missed the %.1f s deadline, answering without it", WEB_SEARCH_DEADLINE)
+		return []
@@ -0,0 +1,313 @@
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import os
+import queue
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from app.logging_setup import logger
+
+# per-stage timings of a chat request as spans (request_id, session_id, stage, duration, attributes
+# such as token counts). TRACE_EXPORT lists the exporters: "jsonl" appends one JSON object per span
+# to TRACE_PATH, "otel" hands spans to the OpenTelemetry SDK's global tracer provider (configured by
+# the deployment, e.g. with an OTLP exporter). Empty (the default) turns tracing off, and span()
+# then returns a shared do-nothing object.
+TRACE_EXPORT = [e.strip() for e in os.getenv("TRACE_EXPORT", "").split(",") if e.strip()]
+TRACE_PATH = os.getenv("TRACE_PATH", os.path.join("logs", "traces.jsonl"))
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "10000")) # spans waiting to be written, newer ones are dropped past it
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+_current: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("current_span", default=None)
+
+stats: Dict[str, int] = {"spans": 0, "dropped": 0}
+
+_ids = random.Random() # span and trace ids, like OpenTelemetry's; not secrets, so no need for uuid4's os.urandom
+
+
+class Span:
+    """
+    One timed stage. Used as a context manager it becomes the parent of spans started inside
+    it (also across awaits and run_blocking); start_span() makes one that is ended by hand.
+    """
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "session_id", "attrs", "start", "_start_ns", "_token", "_otel")
+
+    def __init__(self, name: str, parent: Optional["Span"], session_id: Optional[str], attrs: Dict[str, Any]):
+        self.name = name
+        self.span_id = f"{_ids.getrandbits(64):016x}"
+        self.trace_id = parent.trace_id if parent is not None else f"{_ids.getrandbits(128):032x}"
+        self.parent_id = parent.span_id if parent is not None else None
+        self.session_id = session_id if session_id is not None else (parent.session_id if parent is not None else None)
+        self.attrs = attrs
+        self.start = time.time()
+        self._start_ns = time.perf_counter_ns()
+        self._token: Optional[contextvars.Token] = None
+        self._otel: Any = None
+        for exporter in _exporters:
+            exporter.on_start(self, parent)
+
+    def set(self, **attrs: Any) -> None:
+        """ adds attributes; a session_id given here is also passed on to child spans started later.
+        """
+        if "session_id" in attrs:
+            self.session_id = attrs.pop("session_id")
+        self.attrs.update(attrs)
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        duration_ms = (time.perf_counter_ns() - self._start_ns) / 1e6
+        if error is not None:
+            self.attrs["error"] = type(error).__name__
+        stats["spans"] += 1
+        for exporter in _exporters:
+            exporter.on_end(self, duration_ms)
+
+    def __enter__(self) -> "Span":
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Optional[BaseException], tb: Any) -> None:
+        try:
+            _current.reset(self._token)
+        except ValueError: # exited in another context, e.g. a stream closed by a disconnecting client
+            pass
+        self.end(exc)
+
+    def to_dict(self, duration_ms: float) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "session_id": self.session_id,
+            "name": self.name,
+            "start": round(self.start, 6),
+            "duration_ms": round(duration_ms, 3),
+            "attrs": self.attrs,
+        }
+
+
+class _NoopSpan:
+    """What span() returns with tracing off."""
+
+    __slots__ = ()
+
+    def set(self, **attrs: Any) -> None:
+        pass
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, session_id: Optional[str] = None, **attrs: Any) -> Any:
+    """ a span for a stage, child of the current one; use as `with span("retrieve") as s: ... s.set(k=3)`.
+    """
+    if not _exporters:
+        return NOOP_SPAN
+    return Span(name, _current.get(), session_id, attrs)
+
+
+def start_span(name: str, **attrs: Any) -> Any:
+    """ a span that is not made current, for stages that outlive a with block (streams); call .end().
+    """
+    if not _exporters:
+        return NOOP_SPAN
+    return Span(name, _current.get(), None, attrs)
+
+
+def annotate(**attrs: Any) -> None:
+    """ adds attributes (token counts, cache hits...) to the current span, if any.
+    """
+    if _exporters:
+        current = _current.get()
+        if current is not None:
+            current.set(**attrs)
+
+
+def traced(name: str) -> Callable[[F], F]:
+    """ decorator running every call of a function (sync, async or an async generator) in a span called name.
+    """
+    def decorate(func: F) -> F:
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def run_stream(*args: Any, **kwargs: Any) -> Any:
+                if not _exporters:
+                    async for item in func(*args, **kwargs):
+                        yield item
+                    return
+                # current only while the generator body runs: a span entered here would stay
+                # current in the consumer between items and adopt whatever it traces meanwhile
+                stream = Span(name, _current.get(), None, {})
+                items = func(*args, **kwargs)
+                error: Optional[BaseException] = None
+                try:
+                    while True:
+                        token = _current.set(stream)
+                        try:
+                            item = await items.__anext__()
+                        except StopAsyncIteration:
+                            break
+                        finally:
+                            _current.reset(token)
+                        yield item
+                except GeneratorExit: # the consumer stopped early, not a failure
+                    raise
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    await items.aclose()
+                    stream.end(error)
+            return run_stream # type: ignore[return-value]
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def run_async(*args: Any, **kwargs: Any) -> Any:
+                if not _exporters:
+                    return await func(*args, **kwargs)
+                with Span(name, _current.get(), None, {}):
+                    return await func(*args, **kwargs)
+            return run_async # type: ignore[return-value]
+
+        @functools.wraps(func)
+        def run(*args: Any, **kwargs: Any) -> Any:
+            if not _exporters:
+                return func(*args, **kwargs)
+            with Span(name, _current.get(), None, {}):
+                return func(*args, **kwargs)
+        return run # type: ignore[return-value]
+    return decorate
+
+
+class JsonLinesExporter:
+    """
+    Appends finished spans to a JSON lines file from a background thread, so exporting never
+    waits on disk in the request path. When the queue is full spans are dropped and counted.
+    """
+
+    def __init__(self, path: str, max_queue: int = 10000):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def on_start(self, span: Span, parent: Optional[Span]) -> None:
+        pass
+
+    def on_end(self, span: Span, duration_ms: float) -> None:
+        try:
+            self._queue.put_nowait(span.to_dict(duration_ms))
+        except queue.Full:
+            stats["dropped"] += 1
+
+    def _run(self) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                item = self._queue.get()
+                batch: List[Optional[Dict[str, Any]]] = [item]
+                while not self._queue.empty() and len(batch) < 512:
+                    batch.append(self._queue.get_nowait())
+                f.write("".join(json.dumps(s, default=str) + "\n" for s in batch if s is not None))
+                f.flush()
+                for _ in batch:
+                    self._queue.task_done()
+                if None in batch:
+                    return
+
+    def flush(self) -> None:
+        """ blocks until every span handed over so far is written.
+        """
+        self._queue.join()
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+
+class OpenTelemetryExporter:
+    """
+    Mirrors spans into OpenTelemetry (needs opentelemetry-api, and the SDK with an exporter to send
+    them anywhere). Parent links follow ours, so each chat request is one OTel trace.
+    """
+
+    def __init__(self) -> None:
+        from opentelemetry import trace
+        self._trace = trace
+        self._tracer = trace.get_tracer("nephrology_app")
+
+    def on_start(self, span: Span, parent: Optional[Span]) -> None:
+        context = None
+        if parent is not None and parent._otel is not None:
+            context = self._trace.set_span_in_context(parent._otel)
+        span._otel = self._tracer.start_span(span.name, context=context, start_time=int(span.start * 1e9))
+
+    def on_end(self, span: Span, duration_ms: float) -> None:
+        otel = span._otel
+        if otel is None:
+            return
+        if span.session_id is not None:
+            otel.set_attribute("session_id", span.session_id)
+        for key, value in span.attrs.items():
+            if isinstance(value, (str, bool, int, float)):
+                otel.set_attribute(key, value)
+        otel.end(end_time=int((span.start + duration_ms / 1000) * 1e9))
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def _make_exporters(kinds: List[str]) -> List[Any]:
+    exporters: List[Any] = []
+    for kind in kinds:
+        if kind == "jsonl":
+            exporters.append(JsonLinesExporter(TRACE_PATH, TRACE_QUEUE_SIZE))
+        elif kind == "otel":
+            try:
+                exporters.append(OpenTelemetryExporter())
+            except ImportError:
+                logger.warning("TRACE_EXPORT=otel needs opentelemetry-api, OpenTelemetry export is off")
+        else:
+            raise ValueError(f"TRACE_EXPORT entries must be 'jsonl' or 'otel', got {kind!r}")
+    return exporters
+
+
+_exporters: List[Any] = _make_exporters(TRACE_EXPORT)
+
+
+def configure(kinds: List[str]) -> None:
+    """ replaces the exporters, e.g. configure(["jsonl"]); configure([]) turns tracing off.
+    """
+    global _exporters
+    shutdown()
+    _exporters = _make_exporters(kinds)
+
+
+def flush() -> None:
+    for exporter in _exporters:
+        exporter.flush()
+
+
+def shutdown() -> None:
+    for exporter in _exporters:
+        exporter.close()
+
+
+atexit.register(shutdown)
@@ -1,5 +1,6 @@
 # app/ui/chat_app.py
 
+import json
 import uuid
 from typing import Any, Dict
 
@@ -7,6 +8,7 @@ import requests
 import streamlit as st
 
 API_URL = "http://127.0.0.1:8000/chat"
+API_STREAM_URL = "http://127.0.0.1:8000/chat/stream"
 
 State = Dict[str, Any]
 
@@ -118,21 +120,32 @@ if user_input:
         "allow_web": st.session_state.allow_web,
     }
 
-    try:
-        resp = requests.post(API_URL, json=payload, timeout=30)
-        resp.raise_for_status()
-        data = resp.json()
-        reply_text = data.get("reply", "")
-        agent = data.get("agent", "receptionist")
-    except Exception as e:
-        reply_text = f"Error contacting backend: {e}"
+    # stream the reply so the patient sees text as soon as the model produces it
+    with st.chat_message("assistant"):
+        placeholder = st.empty()
+        reply_text = ""
         agent = "receptionist"
-
-    # 3) show assistant message
+        try:
+            with requests.post(API_STREAM_URL, json=payload, stream=True, timeout=(5, 60)) as resp:
+                resp.raise_for_status()
+                for line in resp.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if event["type"] == "agent":
+                        agent = event["agent"]
+                    elif event["type"] == "delta":
+                        reply_text += event["text"]
+                    elif event["type"] == "done":
+                        reply_text = event["reply"]
+                    header = "**Receptionist:** " if agent == "receptionist" else "**Clinical assistant:** "
+                    placeholder.markdown(header + reply_text)
+        except Exception as e:
+            reply_text = f"Error contacting backend: {e}"
+            agent = "receptionist"
+            placeholder.markdown("**Receptionist:** " + reply_text)
+
+    # 3) remember assistant message
     st.session_state.messages.append(
         {"role": "assistant", "agent": agent, "content": reply_text}
     )
-
-    with st.chat_message("assistant"):
-        header = "**Receptionist:** " if agent == "receptionist" else "**Clinical assistant:** "
-        st.markdown(header + reply_text)
@@ -0,0 +1,89 @@
+"""Chunks per answer, prompt size and fallbacks, fixed k=6 vs adaptive retrieval depth.
+
+Runs the in-scope questions of bench/data/retrieval_eval.jsonl and a
+set of questions the nephrology textbook cannot answer through
+retrieve_docs and clinical_prompts (real embedding model and Chroma
+store, no LLM calls). Once with six chunks for every question as
+before, once with the relevance threshold and adaptive k. Reports
+chunks per answer, prompt tokens, how often each kind of question was
+reported as having insufficient context, and the share of returned
+chunks that are relevant.
+
+    python -m bench.adaptive_retrieval --min-score 0.35 --score-gap 0.15
+"""
+import argparse
+import json
+from typing import Any, Dict, List
+
+from bench.context_budget import percentile
+from bench.retrieval_eval import load_questions, relevant
+
+OUT_OF_SCOPE = [
+    "What's the weather going to be like tomorrow?",
+    "Can you recommend a good pizza place nearby?",
+    "How do I reset my email password?",
+    "Who won the football match last night?",
+    "What is the capital of Australia?",
+    "How do I change a flat tyre?",
+    "Can you help me write a birthday card for my sister?",
+    "What time does the pharmacy close on Sunday?",
+    "How many calories are in a banana split?",
+    "What is the best way to learn to play guitar?",
+]
+
+
+def run(questions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    from app.agents import clinical
+    from app.tools.context_builder import count_tokens
+
+    chunks, tokens, insufficient, hits = [], [], 0, 0
+    for q in questions:
+        docs = clinical.retrieve_docs(q["question"])
+        chunks.append(len(docs))
+        insufficient += not docs
+        hits += sum(relevant(d.page_content, q["terms"]) for d in docs) if q["terms"] else 0
+        prompts = clinical.clinical_prompts(q["question"], docs, None)
+        if prompts is not None:
+            tokens.append(count_tokens(prompts[0]) + count_tokens(prompts[1]))
+    result: Dict[str, Any] = {
+        "questions": len(questions),
+        "chunks_per_answer": round(sum(chunks) / len(chunks), 2),
+        "insufficient_context": insufficient,
+        "prompt_tokens_mean": round(sum(tokens) / len(tokens), 1) if tokens else 0,
+        "prompt_tokens_p95": percentile(tokens, 95) if tokens else 0,
+    }
+    if any(q["terms"] for q in questions):
+        result["relevant_chunk_share"] = round(hits / max(1, sum(chunks)), 3)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--min-score", type=float, default=0.35)
+    parser.add_argument("--score-gap", type=float, default=0.15)
+    parser.add_argument("--min-k", type=int, default=2)
+    parser.add_argument("--max-k", type=int, default=6)
+    args = parser.parse_args()
+
+    from app.agents import clinical
+
+    in_scope = load_questions()
+    out_of_scope = [{"question": q, "terms": []} for q in OUT_OF_SCOPE]
+    clinical.context_builder = None # measure the retrieved context as is
+
+    retriever = clinical.get_retriever()
+    retriever.min_score, retriever.score_gap, retriever.min_k, retriever.max_k = -1.0, 2.0, 6, 6
+    fixed = {"in_scope": run(in_scope), "out_of_scope": run(out_of_scope)}
+    retriever.min_score, retriever.score_gap, retriever.min_k, retriever.max_k = args.min_score, args.score_gap, args.min_k, args.max_k
+    adaptive = {"in_scope": run(in_scope), "out_of_scope": run(out_of_scope)}
+
+    print(json.dumps({
+        "config": vars(args),
+        "fixed_k6": fixed,
+        "adaptive": adaptive,
+        "prompt_token_reduction": round(1 - adaptive["in_scope"]["prompt_tokens_mean"] / fixed["in_scope"]["prompt_tokens_mean"], 3),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Replay a clinical query log through the clinical agent with and without the answer cache.
+
+Uses the real embedding model and Chroma store with a stand-in Groq
+server, so the saved time is the LLM latency of every cache hit.
+
+    python -m bench.answer_cache_replay --latency 1.5
+"""
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, List
+
+from bench.stubs import FakeGroqHandler, start_stub
+
+LOG_PATH = "bench/data/clinical_query_log.jsonl"
+
+
+def load_log(path: str = LOG_PATH) -> List[Dict[str, str]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def replay(rows: List[Dict[str, str]], records: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    from app.agents.clinical import clinical_agent
+
+    latencies = []
+    for row in rows:
+        state = {"patient_record": records[row["patient"]]}
+        start = time.perf_counter()
+        clinical_agent(row["question"], state, allow_web=False)
+        latencies.append(time.perf_counter() - start)
+    return {
+        "queries": len(rows),
+        "total_s": round(sum(latencies), 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=1.5, help="stand-in LLM latency in seconds")
+    parser.add_argument("--threshold", type=float, default=None, help="override ANSWER_CACHE_THRESHOLD")
+    args = parser.parse_args()
+
+    _, groq_url = start_stub(FakeGroqHandler, latency=args.latency)
+    os.environ["GROQ_BASE_URL"] = groq_url
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+
+    from app.agents import clinical
+    from app.tools.patient_db import load_patients
+
+    records = {p["patient_name"]: p for p in load_patients()} # duplicate names keep the last record
+    rows = load_log()
+    if args.threshold is not None:
+        clinical.answer_cache.threshold = args.threshold
+
+    clinical.ANSWER_CACHE = False
+    uncached = replay(rows, records)
+    clinical.ANSWER_CACHE = True
+    cached = replay(rows, records)
+    cached["cache"] = dict(clinical.answer_cache.stats, entries=len(clinical.answer_cache))
+
+    print(json.dumps({
+        "threshold": clinical.answer_cache.threshold,
+        "without_cache": uncached,
+        "with_cache": cached,
+        "hit_rate": round(cached["cache"]["hits"] / len(rows), 3),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
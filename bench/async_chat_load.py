@@ -0,0 +1,102 @@
+"""Concurrent /chat throughput, blocking vs async pipeline.
+
+Runs the FastAPI app in-process against a local stand-in Groq server and
+drives it with concurrent identified-patient sessions whose messages go
+through the router and receptionist LLM calls (no Chroma or web search).
+
+    python -m bench.async_chat_load --concurrency 16 --requests 8 --latency 0.2
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from bench.stubs import FakeGroqHandler, start_stub
+
+IDENTITY_MESSAGE = "my name is Priya Raj"
+ADMIN_MESSAGE = "can someone help me with transport to the clinic?"
+
+
+def _post(base_url: str, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    req = urllib.request.Request(
+        base_url + path,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(req, timeout=120) as resp:
+        return json.loads(resp.read())
+
+
+def _run_session(base_url: str, path: str, session_id: str, n_requests: int) -> List[float]:
+    _post(base_url, path, {"session_id": session_id, "message": IDENTITY_MESSAGE})
+    latencies = []
+    for _ in range(n_requests):
+        start = time.perf_counter()
+        _post(base_url, path, {"session_id": session_id, "message": ADMIN_MESSAGE})
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def _drive(base_url: str, path: str, concurrency: int, n_requests: int) -> Dict[str, float]:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [
+            pool.submit(_run_session, base_url, path, f"{path}-{i}-{time.time_ns()}", n_requests)
+            for i in range(concurrency)
+        ]
+        latencies = sorted(lat for f in futures for lat in f.result())
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "seconds": round(elapsed, 3),
+        "req_per_s": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=8, help="admin turns per session")
+    parser.add_argument("--latency", type=float, default=0.2, help="stand-in LLM latency in seconds")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    _, groq_url = start_stub(FakeGroqHandler, latency=args.latency)
+    os.environ["GROQ_BASE_URL"] = groq_url # read when the groq clients are first built
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+
+    import uvicorn
+    from app.api import ChatRequest, ChatResponse, SESSIONS, app
+    from app.agents.orchestrator import handle_message
+
+    @app.post("/chat_blocking", response_model=ChatResponse)
+    async def chat_blocking(payload: ChatRequest) -> ChatResponse: # the previous endpoint: sync pipeline inside async def
+        state = SESSIONS.get(payload.session_id) or {}
+        reply, new_state = handle_message(payload.message, state)
+        SESSIONS.set(payload.session_id, new_state)
+        return ChatResponse(session_id=payload.session_id, reply=reply, agent=new_state.get("mode", "receptionist"))
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    results = {
+        "config": vars(args),
+        "blocking": _drive(base_url, "/chat_blocking", args.concurrency, args.requests),
+        "async": _drive(base_url, "/chat", args.concurrency, args.requests),
+    }
+    results["speedup"] = round(results["async"]["req_per_s"] / results["blocking"]["req_per_s"], 2)
+    print(json.dumps(results, indent=2))
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
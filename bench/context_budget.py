@@ -0,0 +1,92 @@
+"""Clinical prompt size and end-to-end latency, unbounded context vs the token budget.
+
+Runs the distinct questions of bench/data/clinical_query_log.jsonl
+through the clinical agent (real embedding model and Chroma store, web
+search and answer cache off) against the fake Groq server, whose
+latency grows with the prompt length. Once with every retrieved chunk
+concatenated as before, once with the ContextBuilder budget.
+
+    python -m bench.context_budget --budget 1500 --prompt-token-ms 0.5
+"""
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, List
+
+from bench.answer_cache_replay import load_log
+from bench.stubs import FakeGroqHandler, start_stub
+
+
+def percentile(values: List[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def run(rows: List[Dict[str, str]], records: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    from app.agents import clinical
+    from app.tools.context_builder import count_tokens
+
+    tokens, latencies, fallbacks = [], [], 0
+    for row in rows:
+        state = {"patient_record": records[row["patient"]]}
+        prompts = clinical.clinical_prompts(row["question"], clinical.retrieve_docs(row["question"], state["patient_record"]), state["patient_record"])
+        if prompts is None: # nothing retrieved, or no chunk fits the budget: answered with the fallback
+            fallbacks += 1
+        else:
+            tokens.append(count_tokens(prompts[0]) + count_tokens(prompts[1]))
+        start = time.perf_counter()
+        clinical.clinical_agent(row["question"], state, allow_web=False)
+        latencies.append(time.perf_counter() - start)
+    return {
+        "questions": len(rows),
+        "fallbacks": fallbacks,
+        "prompt_tokens_mean": round(sum(tokens) / len(tokens), 1),
+        "prompt_tokens_p95": percentile(tokens, 95),
+        "prompt_tokens_max": max(tokens),
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "latency_p95_ms": round(percentile(latencies, 95) * 1000, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget", type=int, default=1500, help="CLINICAL_CONTEXT_TOKENS for the budgeted run")
+    parser.add_argument("--latency", type=float, default=0.3, help="fixed stand-in LLM latency in seconds")
+    parser.add_argument("--prompt-token-ms", type=float, default=0.5, help="stand-in latency per prompt token in ms")
+    args = parser.parse_args()
+
+    server, groq_url = start_stub(FakeGroqHandler, latency=args.latency)
+    server.prompt_token_latency = args.prompt_token_ms / 1000
+    os.environ["GROQ_BASE_URL"] = groq_url
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+    os.environ["ANSWER_CACHE"] = "0"
+    os.environ["LLM_COALESCE"] = "0"
+
+    from app.agents import clinical
+    from app.tools.context_builder import ContextBuilder
+    from app.tools.patient_db import load_patients
+
+    records = {p["patient_name"]: p for p in load_patients()}
+    seen, rows = set(), []
+    for row in load_log():
+        if row["question"].lower() not in seen: # a fixed set of distinct questions
+            seen.add(row["question"].lower())
+            rows.append(row)
+
+    clinical.ANSWER_CACHE = False
+    clinical.context_builder = None
+    unbounded = run(rows, records)
+    clinical.context_builder = ContextBuilder(budget_tokens=args.budget)
+    budgeted = run(rows, records)
+
+    print(json.dumps({
+        "config": vars(args),
+        "unbounded": unbounded,
+        "budgeted": budgeted,
+        "prompt_token_reduction": round(1 - budgeted["prompt_tokens_mean"] / unbounded["prompt_tokens_mean"], 3),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
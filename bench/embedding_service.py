@@ -0,0 +1,66 @@
+"""Per-query embedding latency and batch sizes of the embedding service under concurrency.
+
+Embeds distinct messages from many threads, first with the bare model
+(one encode per call) and then through EmbeddingService (micro-batched),
+then replays the same messages to show memoisation.
+
+    python -m bench.embedding_service --threads 16 --per-thread 20
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+from bench.intent_routing import load_eval, percentile
+
+
+def _drive(embed: Callable[[str], Any], messages: List[str], threads: int) -> Dict[str, float]:
+    latencies: List[float] = []
+
+    def one(text: str) -> None:
+        start = time.perf_counter()
+        embed(text)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, messages))
+    elapsed = time.perf_counter() - start
+    return {
+        "queries": len(messages),
+        "queries_per_s": round(len(messages) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--per-thread", type=int, default=20)
+    parser.add_argument("--window-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+    from app.tools.embedding_service import EmbeddingService
+
+    model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    base = [row["message"] for row in load_eval()]
+    n = args.threads * args.per_thread
+    messages = [f"{base[i % len(base)]} ({i})" for i in range(n)] # distinct texts, no cache hits
+    model.embed_query("warm up")
+
+    service = EmbeddingService(model, cache_size=4 * n, batch_window_ms=args.window_ms)
+    results = {
+        "direct": _drive(model.embed_query, messages, args.threads),
+        "service": _drive(service.embed_query, messages, args.threads),
+    }
+    results["service"]["batch_size_histogram"] = dict(sorted(service.batch_size_histogram.items()))
+    results["service_repeat"] = _drive(service.embed_query, [m.upper() for m in messages], args.threads)
+    results["service_repeat"]["cache"] = dict(service.stats)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Fault-injection checks of the LLM gateway against the local fake Groq server.
+
+Sends concurrent chat calls through app.llm.groq_client (real SDK, real
+HTTP) while the stand-in server injects 429s with Retry-After, 503s,
+stalls longer than the call timeout and a full outage, and with a
+requests-per-minute quota configured. For each scenario reports
+success rate, latency, retries, errors by kind and queue wait, and
+checks the expected behaviour. A last scenario cancels the half-open
+trial call and checks the breaker still recovers. Exits non-zero if a
+check fails.
+
+    python -m bench.groq_gateway --calls 40
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+from bench.stubs import FakeGroqHandler, StubServer, start_stub
+
+CALL_TIMEOUT = 1.0 # seconds per attempt, the stall scenario stalls longer
+
+
+def configure(server: StubServer, **faults: Any) -> None:
+    server.error_rate = faults.get("error_rate", 0.0)
+    server.error_status = faults.get("error_status", 503)
+    server.retry_after = faults.get("retry_after")
+    server.stall_rate = faults.get("stall_rate", 0.0)
+    server.stall_seconds = faults.get("stall_seconds", 0.0)
+    server.requests = 0
+
+
+async def run_calls(n: int) -> Dict[str, Any]:
+    from app.llm import groq_client
+
+    async def one() -> float:
+        start = time.perf_counter()
+        await groq_client.call_groq_chat_async("You are a test.", "hello", max_tokens=8)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    outcomes = await asyncio.gather(*(one() for _ in range(n)), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    latencies = sorted(o for o in outcomes if isinstance(o, float))
+    failures: Dict[str, int] = {}
+    for o in outcomes:
+        if isinstance(o, BaseException):
+            failures[type(o).__name__] = failures.get(type(o).__name__, 0) + 1
+    gw = groq_client.gateway
+    return {
+        "ok": len(latencies),
+        "failed": failures,
+        "seconds": round(elapsed, 2),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1) if latencies else None,
+        "gateway": dict(gw.stats),
+        "errors": dict(gw.errors),
+        "queue_wait_p95_ms": round(gw.queue_wait_ms(95), 1),
+        "breaker": gw.breaker.state,
+    }
+
+
+async def run_cancelled_trial(server: StubServer) -> Dict[str, Any]:
+    """ opens the breaker, cancels the half-open trial while it stalls, then lets the server recover.
+    """
+    from app.llm import groq_client
+
+    async def call() -> str:
+        try:
+            await groq_client.call_groq_chat_async("You are a test.", "hello", max_tokens=8)
+            return "ok"
+        except Exception as e:
+            return type(e).__name__
+
+    gw = groq_client.gateway
+    configure(server, error_rate=1.0)
+    opened = await call()
+    state_after_outage = gw.breaker.state
+    await asyncio.sleep(gw.breaker.reset_seconds)
+    configure(server, stall_rate=1.0, stall_seconds=CALL_TIMEOUT / 2)
+    trial = asyncio.ensure_future(call())
+    await asyncio.sleep(0.05)
+    trial.cancel()
+    await asyncio.gather(trial, return_exceptions=True)
+    configure(server)
+    recovered = await call()
+    return {"first_call": opened, "state_after_outage": state_after_outage, "call_after_cancel": recovered, "breaker": gw.breaker.state}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.05, help="stand-in LLM latency in seconds")
+    args = parser.parse_args()
+
+    server, groq_url = start_stub(FakeGroqHandler, latency=args.latency)
+    os.environ["GROQ_BASE_URL"] = groq_url
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+    os.environ["GROQ_TIMEOUT"] = str(CALL_TIMEOUT) # read when groq_client is imported
+
+    from app.llm import groq_client
+    from app.llm.gateway import CircuitBreaker, LLMGateway
+
+    n = args.calls
+    # name: (faults, gateway settings, checks on the result)
+    scenarios: Dict[str, Any] = {
+        "healthy": ({}, {}, [
+            ("all calls succeed", lambda r: r["ok"] == n),
+            ("no retries", lambda r: r["gateway"]["retries"] == 0),
+        ]),
+        "rate_limited_429": ({"error_rate": 0.3, "error_status": 429, "retry_after": 0.3}, {"max_retries": 6}, [
+            ("all calls succeed", lambda r: r["ok"] == n),
+            ("429s were retried", lambda r: r["errors"].get("rate_limited", 0) > 0 and r["gateway"]["retries"] > 0),
+            ("Retry-After was honoured", lambda r: r["p95_ms"] >= 300),
+            ("breaker stayed closed", lambda r: r["breaker"] == "closed"),
+        ]),
+        "server_errors_503": ({"error_rate": 0.2, "error_status": 503}, {"max_retries": 5, "breaker": CircuitBreaker(failure_threshold=50)}, [
+            ("all calls succeed", lambda r: r["ok"] == n),
+            ("503s were retried", lambda r: r["errors"].get("http_503", 0) > 0),
+        ]),
+        "stalls": ({"stall_rate": 0.2, "stall_seconds": CALL_TIMEOUT * 3}, {"max_retries": 5, "breaker": CircuitBreaker(failure_threshold=50)}, [
+            ("all calls succeed", lambda r: r["ok"] == n),
+            ("stalled calls timed out and were retried", lambda r: r["errors"].get("timeout", 0) > 0),
+            ("no call waited for a whole stall", lambda r: r["p95_ms"] < CALL_TIMEOUT * 3 * 1000),
+        ]),
+        "outage": ({"error_rate": 1.0, "error_status": 503}, {"max_concurrency": 4, "breaker": CircuitBreaker(failure_threshold=5, reset_seconds=60)}, [
+            ("every call fails with LLMUnavailableError", lambda r: r["ok"] == 0 and set(r["failed"]) <= {"LLMUnavailableError", "CircuitOpenError"}),
+            ("circuit opened and rejected calls", lambda r: r["breaker"] == "open" and r["gateway"]["circuit_rejections"] > 0),
+            ("server was spared", lambda r: r["server_requests"] < n),
+        ]),
+        "rpm_quota": ({}, {"requests_per_minute": 300}, [ # 5/s after a burst of 50
+            ("all calls succeed", lambda r: r["ok"] == n),
+            ("calls beyond the burst waited for quota", lambda r: n <= 50 or r["seconds"] >= (n - 50) / 5 * 0.9),
+        ]),
+    }
+
+    async def run_scenarios() -> Dict[str, Dict[str, Any]]:
+        # one event loop for every scenario, the async client's connection pool belongs to it
+        out = {}
+        for name, (faults, settings, _) in scenarios.items():
+            if faults is None: # not a batch of calls, run below
+                continue
+            configure(server, **faults)
+            groq_client.gateway = LLMGateway(base_backoff=0.05, max_backoff=2, **settings)
+            out[name] = await run_calls(n)
+            out[name]["server_requests"] = server.requests
+        groq_client.gateway = LLMGateway(max_retries=0, breaker=CircuitBreaker(failure_threshold=1, reset_seconds=0.2))
+        out["cancelled_trial"] = await run_cancelled_trial(server)
+        return out
+
+    scenarios["cancelled_trial"] = (None, None, [
+        ("circuit opened", lambda r: r["state_after_outage"] == "open"),
+        ("the call after the cancelled trial went through", lambda r: r["call_after_cancel"] == "ok"),
+        ("breaker closed again", lambda r: r["breaker"] == "closed"),
+    ])
+
+    results: Dict[str, Any] = {"config": vars(args)}
+    failed_checks: List[str] = []
+    for name, result in asyncio.run(run_scenarios()).items():
+        checks = scenarios[name][2]
+        result["checks"] = {}
+        for label, check in checks:
+            passed = bool(check(result))
+            result["checks"][label] = passed
+            if not passed:
+                failed_checks.append(f"{name}: {label}")
+        results[name] = result
+
+    results["failed_checks"] = failed_checks
+    print(json.dumps(results, indent=2))
+    sys.exit(1 if failed_checks else 0)
+
+
+if __name__ == "__main__":
+    main()
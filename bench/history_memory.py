@@ -0,0 +1,111 @@
+"""Memory per session after a long conversation, unbounded history vs the bounded window.
+
+Plays --turns question/answer pairs into --sessions sessions and reports
+traced memory and serialised (JSON) bytes per session for the old
+ever-growing history list, the HISTORY_WINDOW ring, and the window with
+rolling summaries (HISTORY_SUMMARY=1, summarised against the fake Groq
+server after each reply as the API does), plus the p50/p95 time to
+record a turn.
+
+    python -m bench.history_memory --turns 1000 --sessions 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from bench.context_budget import percentile
+from bench.session_store_soak import REPLY
+from bench.stubs import FakeGroqHandler, start_stub
+
+
+def unbounded_turn(state: Dict[str, Any], question: str, reply: str) -> None:
+    history = state.setdefault("history", [])
+    history.append({"role": "user", "agent": None, "content": question})
+    history.append({"role": "assistant", "agent": "clinical", "content": reply})
+
+
+def bounded_turn(state: Dict[str, Any], question: str, reply: str) -> None:
+    from app.agents.history import append_entry
+
+    append_entry(state, {"role": "user", "agent": None, "content": question})
+    append_entry(state, {"role": "assistant", "agent": "clinical", "content": reply})
+
+
+def play(turn: Callable[[Dict[str, Any], str, str], None], state: Dict[str, Any], t: int) -> None:
+    turn(state, f"question {t}: why are my legs swelling?", f"{REPLY}(answer {t})") # distinct strings, like real replies
+
+
+def run(turn: Callable[[Dict[str, Any], str, str], None], sessions: int, turns: int, after_turn: Callable[[str, Dict[str, Any]], None] = lambda sid, state: None) -> Dict[str, Any]:
+    seconds = []
+    timed_state: Dict[str, Any] = {"session_id": "timed"}
+    for t in range(turns):
+        start = time.perf_counter()
+        play(turn, timed_state, t)
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    states: List[Dict[str, Any]] = []
+    for i in range(sessions):
+        state: Dict[str, Any] = {"session_id": f"s{i}"}
+        states.append(state)
+        for t in range(turns):
+            play(turn, state, t)
+            after_turn(f"s{i}", state)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return {
+        "bytes_per_session": round(used / sessions),
+        "json_bytes_per_session": round(sum(len(json.dumps(s)) for s in states) / sessions),
+        "history_bytes": states[0].get("history_bytes"),
+        "messages_kept": len(states[0].get("history", [])) + len(states[0].get("history_pending", [])),
+        "turn_p50_us": round(percentile(seconds, 50) * 1e6, 1),
+        "turn_p95_us": round(percentile(seconds, 95) * 1e6, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=1000, help="question/answer pairs per session")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--summary-sessions", type=int, default=5, help="sessions run with rolling summaries (one LLM call per batch)")
+    args = parser.parse_args()
+
+    server, groq_url = start_stub(FakeGroqHandler, latency=0.0)
+    os.environ["GROQ_BASE_URL"] = groq_url
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+    os.environ["LLM_COALESCE"] = "0"
+
+    from app.agents import history
+    from app.session_store import InMemorySessionStore
+
+    results: Dict[str, Any] = {"config": dict(vars(args), window=history.HISTORY_WINDOW)}
+    results["unbounded"] = run(unbounded_turn, args.sessions, args.turns)
+    history.HISTORY_SUMMARY = False
+    results["window"] = run(bounded_turn, args.sessions, args.turns)
+
+    history.HISTORY_SUMMARY = True
+    store = InMemorySessionStore()
+    loop = asyncio.new_event_loop()
+
+    def summarise(session_id: str, state: Dict[str, Any]) -> None: # what the API schedules once the reply is sent
+        store.set(session_id, state)
+        if history.needs_summary(state):
+            loop.run_until_complete(history.summarise_session(store, session_id))
+
+    requests_before = server.requests
+    results["window_with_summary"] = run(bounded_turn, args.summary_sessions, args.turns, after_turn=summarise)
+    results["window_with_summary"]["summaries"] = history.stats["summaries"]
+    results["window_with_summary"]["llm_calls"] = server.requests - requests_before
+    loop.close()
+
+    results["memory_reduction"] = round(1 - results["window"]["bytes_per_session"] / results["unbounded"]["bytes_per_session"], 3)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Time to import the API module, i.e. uvicorn startup and every --reload.
+
+Each run is a fresh interpreter. With --compare-rev the same measurement
+runs on another git revision (checked out into a temporary worktree).
+
+    python -m bench.import_time --runs 5 --compare-rev HEAD~1
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Any, Dict, List
+
+MODULE = "app.api"
+HEAVY_MODULES = ["torch", "sentence_transformers", "chromadb", "langchain_chroma", "groq", "tavily"]
+
+
+def measure(cwd: str, runs: int) -> Dict[str, Any]:
+    probe = (
+        "import sys, time; start = time.perf_counter(); import " + MODULE + "; "
+        "print(time.perf_counter() - start); print(','.join(m for m in " + repr(HEAVY_MODULES) + " if m in sys.modules))"
+    )
+    times: List[float] = []
+    heavy = ""
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", probe], cwd=cwd, capture_output=True, text=True, check=True).stdout.split("\n")
+        times.append(float(out[0]))
+        heavy = out[1]
+    return {
+        "import_s_median": round(statistics.median(times), 3),
+        "import_s_min": round(min(times), 3),
+        "heavy_modules_imported": heavy.split(",") if heavy else [],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--compare-rev", default=None, help="git revision to measure as well")
+    args = parser.parse_args()
+
+    results = {"current": measure(os.getcwd(), args.runs)}
+    if args.compare_rev:
+        worktree = tempfile.mkdtemp(prefix="import-bench-")
+        subprocess.run(["git", "worktree", "add", "--detach", worktree, args.compare_rev], check=True, capture_output=True)
+        try:
+            results[args.compare_rev] = measure(worktree, args.runs)
+        finally:
+            subprocess.run(["git", "worktree", "remove", "--force", worktree], check=True, capture_output=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
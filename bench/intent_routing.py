@@ -0,0 +1,92 @@
+"""Accuracy, LLM-call reduction and latency of the local intent tier.
+
+Runs every message of bench/data/intent_eval.jsonl through the local
+classifier in app.agents.orchestrator. With --with-llm the full router
+(local tier + LLM fallback) is compared against the LLM-only router,
+using whatever Groq endpoint GROQ_BASE_URL points at.
+
+    python -m bench.intent_routing [--min-sim 0.45 --margin 0.08] [--with-llm]
+"""
+import argparse
+import json
+import time
+from typing import Any, Callable, Dict, List
+
+EVAL_PATH = "bench/data/intent_eval.jsonl"
+RECEPTIONIST_LABELS = {"ADMIN", "IDENTITY"}
+IDENTIFIED_STATE: Dict[str, Any] = {"patient_record": {"primary_diagnosis": "CKD Stage 3", "discharge_date": "2025-01-15"}}
+
+
+def load_eval(path: str = EVAL_PATH) -> List[Dict[str, str]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _route(label: str) -> str:
+    return "receptionist" if label in RECEPTIONIST_LABELS else "clinical"
+
+
+def run_router(rows: List[Dict[str, str]], classify: Callable[[str], Any]) -> Dict[str, Any]:
+    """Classify every row, classify returns a label or None (escalated)."""
+    answered = correct = route_correct = 0
+    latencies = []
+    for row in rows:
+        start = time.perf_counter()
+        label = classify(row["message"])
+        latencies.append((time.perf_counter() - start) * 1000)
+        if label is None:
+            continue
+        answered += 1
+        correct += label == row["label"]
+        route_correct += _route(label) == _route(row["label"])
+    return {
+        "messages": len(rows),
+        "answered": answered,
+        "accuracy": round(correct / answered, 3) if answered else None,
+        "route_accuracy": round(route_correct / answered, 3) if answered else None,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--min-sim", type=float, default=None)
+    parser.add_argument("--margin", type=float, default=None)
+    parser.add_argument("--with-llm", action="store_true", help="also run the LLM router end-to-end")
+    args = parser.parse_args()
+
+    from app.agents import orchestrator
+
+    if args.min_sim is not None:
+        orchestrator.LOCAL_INTENT_MIN_SIM = args.min_sim
+    if args.margin is not None:
+        orchestrator.LOCAL_INTENT_MARGIN = args.margin
+
+    rows = load_eval()
+    orchestrator._get_intent_centroids() # warm up: embed the example messages once
+
+    local = run_router(rows, lambda m: orchestrator._local_intent(m)[0])
+    local["llm_call_reduction"] = round(local["answered"] / local["messages"], 3)
+    results: Dict[str, Any] = {
+        "min_sim": orchestrator.LOCAL_INTENT_MIN_SIM,
+        "margin": orchestrator.LOCAL_INTENT_MARGIN,
+        "local_tier": local,
+    }
+
+    if args.with_llm:
+        orchestrator.LOCAL_INTENT = False
+        results["llm_only"] = run_router(rows, lambda m: orchestrator._classify_intent(m, dict(IDENTIFIED_STATE)))
+        orchestrator.LOCAL_INTENT = True
+        results["local_then_llm"] = run_router(rows, lambda m: orchestrator._classify_intent(m, dict(IDENTIFIED_STATE)))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
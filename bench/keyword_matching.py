@@ -0,0 +1,77 @@
+"""Microbenchmark of the routing keyword heuristics, substring scans vs the compiled matcher.
+
+The legacy functions below are the list-scanning versions of
+_quick_admin_check, is_medical_query and wants_latest_or_web that
+app.agents.keywords replaced. Also reports where the two disagree
+(the compiled matcher requires keywords to start at a word boundary).
+
+    python -m bench.keyword_matching --repeat 2000
+"""
+import argparse
+import json
+import time
+from typing import Callable, Dict, List
+
+from app.agents.keywords import (
+    ADMIN_KEYWORDS,
+    KIDNEY_CONCEPTS,
+    MEDICAL_KEYWORDS,
+    MEDICAL_TOPIC_WORDS,
+    WEB_KEYWORDS,
+    match_keywords,
+)
+from bench.intent_routing import load_eval
+
+
+def legacy_route(message: str) -> Dict[str, bool]:
+    text = message.strip().lower()
+    admin = any(k in text for k in ADMIN_KEYWORDS)
+    medical = (
+        "medical" in text or "symptom" in text or "symptomps" in text
+        or any(k in text for k in MEDICAL_KEYWORDS)
+        or (any(k in text for k in KIDNEY_CONCEPTS) and any(t in text for t in MEDICAL_TOPIC_WORDS))
+    )
+    web = any(k in text for k in WEB_KEYWORDS)
+    return {"admin": admin, "medical": medical, "web": web}
+
+
+def compiled_route(message: str) -> Dict[str, bool]:
+    found = match_keywords.__wrapped__(message) # bypass the cache so every call really scans
+    medical = "medical_trigger" in found or "medical" in found or ("kidney" in found and "topic" in found)
+    return {"admin": "admin" in found, "medical": medical, "web": "web" in found}
+
+
+def _time(route: Callable[[str], Dict[str, bool]], messages: List[str], repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for m in messages:
+            route(m)
+    return (time.perf_counter() - start) / (repeat * len(messages)) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    messages = [row["message"] for row in load_eval()]
+    messages += [m + " and also " + n for m, n in zip(messages, reversed(messages))] # longer messages
+
+    disagreements = [
+        {"message": m, "legacy": legacy_route(m), "compiled": compiled_route(m)}
+        for m in messages
+        if legacy_route(m) != compiled_route(m)
+    ]
+    legacy_us = _time(legacy_route, messages, args.repeat)
+    compiled_us = _time(compiled_route, messages, args.repeat)
+    print(json.dumps({
+        "messages": len(messages),
+        "legacy_us_per_message": round(legacy_us, 2),
+        "compiled_us_per_message": round(compiled_us, 2),
+        "speedup": round(legacy_us / compiled_us, 2),
+        "disagreements": disagreements,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
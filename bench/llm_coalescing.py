@@ -0,0 +1,68 @@
+"""Duplicate LLM calls during a message blast, with and without coalescing.
+
+Simulates many sessions sending the same message at once (e.g. after a
+reminder SMS) through the temperature-0 router prompt, then a second
+wave a moment later, against the local fake Groq server. Reports how
+many completions reached the server and the coalescer's counters.
+
+    python -m bench.llm_coalescing --sessions 200 --latency 0.3
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict
+
+from bench.stubs import FakeGroqHandler, start_stub
+
+BLAST_MESSAGE = "when is my follow-up?"
+
+
+async def blast(sessions: int, gap: float) -> Dict[str, Any]:
+    from app.agents.orchestrator import CLASSIFIER_LLM_KWARGS, _classifier_prompts
+    from app.llm.groq_client import call_groq_chat_async
+
+    system_prompt, user_prompt = _classifier_prompts(BLAST_MESSAGE, {}) # new sessions share the same prompt
+    waves = []
+    for _ in range(2):
+        start = time.perf_counter()
+        await asyncio.gather(*(call_groq_chat_async(system_prompt, user_prompt, **CLASSIFIER_LLM_KWARGS) for _ in range(sessions)))
+        waves.append(round((time.perf_counter() - start) * 1000, 1))
+        await asyncio.sleep(gap)
+    return {"wave_ms": waves}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.3, help="stand-in LLM latency in seconds")
+    parser.add_argument("--gap", type=float, default=1.0, help="seconds between the two waves")
+    args = parser.parse_args()
+
+    server, groq_url = start_stub(FakeGroqHandler, latency=args.latency)
+    os.environ["GROQ_BASE_URL"] = groq_url
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+    os.environ.setdefault("GROQ_MAX_CONCURRENCY", "64")
+
+    from app.llm import groq_client
+    from app.llm.coalesce import LLMCoalescer
+
+    async def run_both() -> Dict[str, Any]:
+        # one event loop for both runs, the async client's connection pool belongs to it
+        out: Dict[str, Any] = {}
+        for label, coalesce in (("uncoalesced", False), ("coalesced", True)):
+            groq_client.COALESCE = coalesce
+            groq_client.coalescer = LLMCoalescer(cache_ttl=30)
+            server.requests = 0
+            out[label] = await blast(args.sessions, args.gap)
+            out[label]["server_requests"] = server.requests
+            out[label]["coalescer"] = dict(groq_client.coalescer.stats) if coalesce else None
+        return out
+
+    results: Dict[str, Any] = {"config": vars(args), **asyncio.run(run_both())}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""Offline load test of /chat: scripted patient conversations against local stand-ins.
+
+Starts the fake Groq and Tavily servers (bench/stubs.py) with lognormal
+latency and injected errors, replaces the embedding model and Chroma store
+with HashEmbeddings and StubVectorStore over bench/data/standin_textbook.jsonl
+(no reranker), and runs the FastAPI app in-process. --users virtual patients
+then work through --sessions conversations built from data/patients.json:
+identity (and the discharge date when the name is shared), admin questions,
+then clinical questions, some asking for the latest guidance so they search
+the web. Reports throughput, errors and p50/p95/p99 latency overall, per
+answering agent and per script step as JSON. --out saves the results,
+--compare diffs them against a saved run and exits non-zero on a regression.
+
+    python -m bench.load_suite --users 16 --sessions 64 --out bench_results/base.json
+    python -m bench.load_suite --users 16 --sessions 64 --compare bench_results/base.json
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from bench.context_budget import percentile
+from bench.stubs import FakeGroqHandler, FakeTavilyHandler, HashEmbeddings, StubVectorStore, load_standin_textbook, start_stub
+
+PATIENTS_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "patients.json")
+
+ADMIN_MESSAGES = [
+    "can I reschedule my follow-up appointment to next week?",
+    "what time does the nephrology clinic open?",
+    "how do I get a copy of my discharge summary?",
+    "where can I park when I come for my visit?",
+    "is there transport to the hospital for my appointment?",
+    "what is the hospital phone number?",
+]
+
+STEP_AGENT = {"admin": "receptionist", "clinical": "clinical", "web": "clinical"} # who should answer each step
+
+Turn = Tuple[str, str] # (step, message)
+
+
+def load_patients(path: str = PATIENTS_PATH) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def clinical_questions(patient: Dict[str, Any]) -> List[str]:
+    """Questions a patient with this discharge record would plausibly ask."""
+    diagnosis = patient["primary_diagnosis"]
+    sign = patient["warning_signs"].split(",")[0].strip().lower()
+    medication = patient["medications"][0]
+    questions = [
+        f"I have {sign}, should I be worried?",
+        f"What does {diagnosis} mean for my kidneys?",
+        f"What foods should I eat with this diet: {patient['dietary_restrictions'].lower()}?",
+    ]
+    if medication[:1].isupper() and not medication.lower().startswith(("no ", "pain", "nsaid")):
+        questions.append(f"Can I take ibuprofen with {medication.split()[0]}?")
+    else:
+        questions.append("Which painkillers are safe for my kidneys?")
+    return questions
+
+
+def build_script(patient: Dict[str, Any], shared_names: set, rng: random.Random, admin_turns: int, clinical_turns: int, web_share: float) -> List[Turn]:
+    """One conversation: identify, ask admin questions, then clinical ones (the last one asking
+    for the latest guidance with probability web_share)."""
+    name = patient["patient_name"]
+    turns: List[Turn] = [("identity", f"my name is {name}")]
+    if name.lower() in shared_names:
+        turns.append(("identity", patient["discharge_date"]))
+    turns += [("admin", m) for m in rng.sample(ADMIN_MESSAGES, min(admin_turns, len(ADMIN_MESSAGES)))]
+    questions = clinical_questions(patient)
+    turns += [("clinical", q) for q in rng.sample(questions, min(clinical_turns, len(questions)))]
+    if clinical_turns and rng.random() < web_share:
+        turns[-1] = ("web", f"What are the latest treatment guidelines for {patient['primary_diagnosis']}?")
+    return turns
+
+
+def build_scripts(patients: List[Dict[str, Any]], n_sessions: int, seed: int, admin_turns: int, clinical_turns: int, web_share: float) -> List[List[Turn]]:
+    counts = Counter(p["patient_name"].lower() for p in patients)
+    shared = {name for name, n in counts.items() if n > 1}
+    rng = random.Random(seed)
+    return [build_script(patients[i % len(patients)], shared, rng, admin_turns, clinical_turns, web_share) for i in range(n_sessions)]
+
+
+def _post(base_url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    req = urllib.request.Request(
+        base_url + "/chat",
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(req, timeout=120) as resp:
+        return json.loads(resp.read())
+
+
+def _run_session(base_url: str, session_id: str, script: List[Turn], think: float, seed: int, unavailable_reply: str) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    samples = []
+    for step, message in script:
+        start = time.perf_counter()
+        try:
+            body = _post(base_url, {"session_id": session_id, "message": message})
+            agent = body.get("agent", "unknown")
+            error = "llm_unavailable" if body.get("reply") == unavailable_reply else None
+        except (urllib.error.URLError, socket.timeout, ValueError) as e:
+            agent, error = "none", type(e).__name__
+        samples.append({"step": step, "agent": agent, "ms": (time.perf_counter() - start) * 1000, "error": error})
+        if think > 0:
+            time.sleep(rng.expovariate(1 / think))
+    return samples
+
+
+def latency_summary(samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+    ms = [s["ms"] for s in samples]
+    return {
+        "requests": len(ms),
+        "errors": sum(1 for s in samples if s["error"]),
+        "mean_ms": round(sum(ms) / len(ms), 1),
+        "p50_ms": round(percentile(ms, 50), 1),
+        "p95_ms": round(percentile(ms, 95), 1),
+        "p99_ms": round(percentile(ms, 99), 1),
+        "max_ms": round(max(ms), 1),
+    }
+
+
+def summarise(samples: List[Dict[str, Any]], seconds: float) -> Dict[str, Any]:
+    def grouped(key: str) -> Dict[str, Any]:
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for s in samples:
+            groups.setdefault(s[key], []).append(s)
+        return {name: latency_summary(group) for name, group in sorted(groups.items())}
+
+    errors = Counter(s["error"] for s in samples if s["error"])
+    return {
+        "seconds": round(seconds, 3),
+        "requests": len(samples),
+        "req_per_s": round(len(samples) / seconds, 2),
+        "error_rate": round(sum(errors.values()) / len(samples), 4),
+        "errors": dict(errors),
+        "misrouted": sum(1 for s in samples if s["step"] in STEP_AGENT and not s["error"] and s["agent"] != STEP_AGENT[s["step"]]),
+        "latency": {"all": latency_summary(samples), "by_agent": grouped("agent"), "by_step": grouped("step")},
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], max_regression: float, min_delta_ms: float) -> Dict[str, Any]:
+    """Relative change of every throughput and latency figure both runs have. A latency figure
+    regresses when it grew by more than max_regression and min_delta_ms, throughput when it fell
+    by more than max_regression, the error rate when it rose by more than a percentage point."""
+    changes: List[Dict[str, Any]] = []
+
+    def add(metric: str, base: float, cur: float, regressed: bool) -> None:
+        changes.append({
+            "metric": metric,
+            "baseline": base,
+            "current": cur,
+            "change": round(cur / base - 1, 3) if base else None,
+            "regressed": regressed,
+        })
+
+    base_rps, cur_rps = baseline["req_per_s"], current["req_per_s"]
+    add("req_per_s", base_rps, cur_rps, cur_rps < base_rps * (1 - max_regression))
+    add("error_rate", baseline["error_rate"], current["error_rate"], current["error_rate"] > baseline["error_rate"] + 0.01)
+    groups = [("all", current["latency"]["all"], baseline["latency"]["all"])]
+    for kind in ("by_agent", "by_step"):
+        for name, cur in current["latency"][kind].items():
+            base = baseline["latency"][kind].get(name)
+            if base is not None:
+                groups.append((f"{kind}.{name}", cur, base))
+    for prefix, cur, base in groups:
+        for field in ("p50_ms", "p95_ms", "p99_ms"):
+            grew = cur[field] - base[field]
+            add(f"{prefix}.{field}", base[field], cur[field], grew > min_delta_ms and cur[field] > base[field] * (1 + max_regression))
+
+    differs = sorted(k for k, v in current["config"].items() if k not in ("out", "compare", "max_regression", "min_delta_ms") and baseline.get("config", {}).get(k) != v)
+    return {
+        "max_regression": max_regression,
+        "min_delta_ms": min_delta_ms,
+        "config_differs": differs, # figures of runs with different settings are not comparable
+        "regressions": [c["metric"] for c in changes if c["regressed"]],
+        "changes": changes,
+    }
+
+
+def _install_stand_ins(embed_latency: float, vector_latency: float) -> Dict[str, Any]:
+    """Puts the hashed embeddings and the in-memory store where the app's lazy singletons would
+    load the real ones, with the retriever built as configured by the RETRIEVAL_* settings."""
+    from app.agents import clinical
+    from app.tools.hybrid_retriever import BM25Index, HybridRetriever
+
+    embeddings = HashEmbeddings(latency=embed_latency)
+    chunks = load_standin_textbook()
+    store = StubVectorStore(embeddings, chunks, latency=vector_latency)
+    clinical._emb_model.set(embeddings)
+    clinical._vect_store.set(store)
+    clinical._retriever.set(HybridRetriever(
+        store, BM25Index.build(chunks) if clinical.RETRIEVAL_MODE == "hybrid" else None,
+        candidates=clinical.RETRIEVAL_CANDIDATES,
+        min_score=clinical.RETRIEVAL_MIN_SCORE,
+        score_gap=clinical.RETRIEVAL_SCORE_GAP,
+        min_k=clinical.RETRIEVAL_MIN_K,
+        max_k=clinical.RETRIEVAL_MAX_K,
+        topic_mode=clinical.RETRIEVAL_TOPIC_MODE,
+        keyword_min_coverage=clinical.RETRIEVAL_KEYWORD_COVERAGE,
+    ))
+    return {"embeddings": embeddings}
+
+
+def _wait_ready(base_url: str, timeout: float = 120) -> None:
+    deadline = time.time() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(base_url + "/ready", timeout=5):
+                return
+        except urllib.error.HTTPError: # 503 until the warm-up is done
+            if time.time() > deadline:
+                raise RuntimeError("the app did not become ready")
+            time.sleep(0.1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=16, help="conversations running at once")
+    parser.add_argument("--sessions", type=int, default=64, help="conversations in total")
+    parser.add_argument("--admin-turns", type=int, default=2)
+    parser.add_argument("--clinical-turns", type=int, default=2)
+    parser.add_argument("--web-share", type=float, default=0.25, help="share of conversations whose last question asks for the latest guidance")
+    parser.add_argument("--think", type=float, default=0.0, help="mean seconds between a reply and the next message")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="median seconds of a stand-in completion")
+    parser.add_argument("--llm-sigma", type=float, default=0.5, help="lognormal spread of the completion latency")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-error-status", type=int, default=503)
+    parser.add_argument("--llm-stall-rate", type=float, default=0.0)
+    parser.add_argument("--llm-stall-seconds", type=float, default=5.0)
+    parser.add_argument("--search-latency", type=float, default=0.8, help="median seconds of a stand-in web search")
+    parser.add_argument("--search-sigma", type=float, default=0.5)
+    parser.add_argument("--search-error-rate", type=float, default=0.0)
+    parser.add_argument("--embed-latency", type=float, default=0.005, help="seconds per stand-in embedding model call")
+    parser.add_argument("--vector-latency", type=float, default=0.002, help="seconds per stand-in vector search")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="relative change counted as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="latency changes smaller than this are never regressions")
+    args = parser.parse_args()
+
+    groq, groq_url = start_stub(FakeGroqHandler, latency=args.llm_latency)
+    groq.latency_sigma = args.llm_sigma
+    groq.error_rate = args.llm_error_rate
+    groq.error_status = args.llm_error_status
+    groq.stall_rate = args.llm_stall_rate
+    groq.stall_seconds = args.llm_stall_seconds
+    groq.rng = random.Random(args.seed)
+    tavily, tavily_url = start_stub(FakeTavilyHandler, latency=args.search_latency)
+    tavily.latency_sigma = args.search_sigma
+    tavily.error_rate = args.search_error_rate
+    tavily.rng = random.Random(args.seed + 1)
+    # read when the app modules are imported or the clients first built
+    os.environ["GROQ_BASE_URL"] = groq_url
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+    os.environ["TAVILY_BASE_URL"] = tavily_url
+    os.environ["TAVILY_API_KEY"] = "bench"
+    os.environ["WEB_CACHE_PATH"] = "" # every web question reaches the stand-in, so runs compare
+    os.environ.setdefault("LOG_CONSOLE", "0")
+
+    import uvicorn
+    from app.api import LLM_UNAVAILABLE_REPLY, app
+    from app.llm import groq_client
+
+    stand_ins = _install_stand_ins(args.embed_latency, args.vector_latency)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    base_url = f"http://127.0.0.1:{args.port}"
+    _wait_ready(base_url)
+
+    scripts = build_scripts(load_patients(), args.sessions, args.seed, args.admin_turns, args.clinical_turns, args.web_share)
+    run_id = time.time_ns()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        futures = [
+            pool.submit(_run_session, base_url, f"load-{run_id}-{i}", script, args.think, args.seed + i, LLM_UNAVAILABLE_REPLY)
+            for i, script in enumerate(scripts)
+        ]
+        samples = [s for f in futures for s in f.result()]
+    elapsed = time.perf_counter() - start
+    server.should_exit = True
+
+    results: Dict[str, Any] = {"config": vars(args), **summarise(samples, elapsed)}
+    results["sessions_per_s"] = round(args.sessions / elapsed, 2)
+    results["stand_ins"] = {
+        "llm_requests": groq.requests,
+        "search_requests": tavily.requests,
+        "embedding_calls": stand_ins["embeddings"].calls,
+    }
+    results["llm_usage"] = dict(groq_client.usage_stats)
+
+    comparison: Optional[Dict[str, Any]] = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            comparison = compare(results, json.load(f), args.max_regression, args.min_delta_ms)
+        results["comparison"] = {"baseline": args.compare, **comparison}
+
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    if comparison is not None and comparison["regressions"]:
+        print(f"regressions: {', '.join(comparison['regressions'])}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Per-request logging cost under concurrent load, direct handlers vs the queued setup.
+
+--threads threads each handle --requests stand-in chat requests that log
+the four ROUTER/CONTEXT/RETRIEVAL lines a clinical turn writes. Once with
+the old setup (FileHandler and console StreamHandler called on the
+request thread) and once through app.logging_setup's queue and listener
+thread, in text and JSON format. The console goes to os.devnull so the
+terminal's speed doesn't decide the result. Reports p50/p95/p99 µs of
+logging per request and checks every line reached app.log. Exits
+non-zero if a check fails.
+
+    python -m bench.logging_overhead --threads 8 --requests 2000
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from app import logging_setup
+from bench.context_budget import percentile
+
+LINES_PER_REQUEST = 4
+
+
+def log_request(log: logging.Logger, i: int) -> None:
+    session_id = f"s{i % 500}"
+    log.info("ROUTER session_id=%s intent=%s allow_web=%s message=%s", session_id, "CLINICAL", True, "why are my legs swelling after discharge?")
+    log.info("RETRIEVAL vector_ms=%.1f bm25_ms=%.1f k=%d chunks_per_answer=%.2f insufficient=%d/%d", 12.3, 1.2, 4, 3.8, 2, i + 1)
+    log.info("CONTEXT prompt_tokens=%d prefix_tokens=%d chunks=%d build_ms=%.2f", 1380, 410, 4, 0.41)
+    log.info("ROUTER session_id=%s final_agent=clinical intent=%s", session_id, "CLINICAL")
+
+
+def direct_setup(log_dir: str, kind: str, console: Any) -> Callable[[], None]:
+    formatter = logging_setup.make_formatter(kind)
+    handlers = [logging.FileHandler(os.path.join(log_dir, "app.log"), encoding="utf-8"), logging.StreamHandler(console)]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        bench_logger.addHandler(handler)
+
+    def stop() -> None:
+        for handler in handlers:
+            handler.close()
+    return stop
+
+
+def queued_setup(log_dir: str, kind: str, console: Any) -> Callable[[], None]:
+    handlers = logging_setup.make_handlers(log_dir, kind, console=False)
+    handlers.append(logging.StreamHandler(console))
+    handlers[-1].setFormatter(logging_setup.make_formatter(kind))
+    listener = logging_setup.start_queue_logging(bench_logger, handlers, queue_size=1_000_000) # nothing dropped, to compare like for like
+    return listener.stop
+
+
+def run(setup: Callable[[str, str, Any], Callable[[], None]], kind: str, threads: int, requests: int) -> Dict[str, Any]:
+    log_dir = tempfile.mkdtemp()
+    bench_logger.handlers.clear()
+    with open(os.devnull, "w") as console:
+        stop = setup(log_dir, kind, console)
+        per_request: List[List[float]] = [[] for _ in range(threads)]
+        barrier = threading.Barrier(threads + 1)
+
+        def work(t: int) -> None:
+            barrier.wait()
+            for i in range(requests):
+                start = time.perf_counter()
+                log_request(bench_logger, t * requests + i)
+                per_request[t].append(time.perf_counter() - start)
+
+        workers = [threading.Thread(target=work, args=(t,)) for t in range(threads)]
+        for w in workers:
+            w.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - start
+        stop() # the queued setup writes out its backlog here
+        drained = time.perf_counter() - start
+    with open(os.path.join(log_dir, "app.log"), "r", encoding="utf-8") as f:
+        lines = sum(1 for _ in f)
+    seconds = [s for ts in per_request for s in ts]
+    return {
+        "p50_us": round(percentile(seconds, 50) * 1e6, 1),
+        "p95_us": round(percentile(seconds, 95) * 1e6, 1),
+        "p99_us": round(percentile(seconds, 99) * 1e6, 1),
+        "requests_per_s": round(threads * requests / elapsed),
+        "all_written_s": round(drained, 3),
+        "lines": lines,
+    }
+
+
+bench_logger = logging.getLogger("bench.logging_overhead")
+bench_logger.propagate = False # keep the app's own handlers out of it
+bench_logger.setLevel(logging.INFO)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per thread")
+    args = parser.parse_args()
+    expected = args.threads * args.requests * LINES_PER_REQUEST
+
+    results = {
+        "direct_text": run(direct_setup, "text", args.threads, args.requests),
+        "queued_text": run(queued_setup, "text", args.threads, args.requests),
+        "queued_json": run(queued_setup, "json", args.threads, args.requests),
+    }
+    checks = [(f"{name} wrote every line", r["lines"] == expected) for name, r in results.items()]
+    checks.append(("queued logging is cheaper per request at p50", results["queued_text"]["p50_us"] < results["direct_text"]["p50_us"]))
+    failed = [label for label, ok in checks if not ok]
+    print(json.dumps({"config": vars(args), **results, "failed": failed}, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
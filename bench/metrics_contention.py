@@ -0,0 +1,111 @@
+"""Cost of recording metrics from many threads, and of a /metrics scrape.
+
+Increments a counter and observes a histogram from --threads threads at
+once, with app.metrics' per-thread shards vs a single dict behind a lock
+(the usual thread-safe counter), and checks no increment is lost. Then
+times rendering the exposition text, alone and summed with the samples
+of --workers other workers through the METRICS_SHARED_PATH SQLite file.
+Exits non-zero if a check fails.
+
+    python -m bench.metrics_contention --threads 8 --ops 200000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict
+
+from app import metrics
+
+
+class LockedCounter:
+    def __init__(self) -> None:
+        self.values: Dict[Any, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+def hammer(record: Callable[[int], None], threads: int, ops: int) -> float:
+    barrier = threading.Barrier(threads + 1)
+
+    def work() -> None:
+        barrier.wait()
+        for i in range(ops):
+            record(i)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for w in workers:
+        w.join()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=200000, help="increments per thread")
+    parser.add_argument("--workers", type=int, default=4, help="other workers' samples in the shared file")
+    args = parser.parse_args()
+    total = args.threads * args.ops
+    agents = ("receptionist", "clinical")
+
+    locked = LockedCounter()
+    locked_s = hammer(lambda i: locked.inc(agents[i & 1]), args.threads, args.ops)
+    sharded = metrics.Counter("bench_total", "bench", ("agent",))
+    sharded_s = hammer(lambda i: sharded.inc(agents[i & 1]), args.threads, args.ops)
+    histogram = metrics.Histogram("bench_seconds", "bench", ("agent",))
+    histogram_s = hammer(lambda i: histogram.observe((i % 100) / 50, agents[i & 1]), args.threads, args.ops)
+
+    for i in range(1000): # something to render
+        metrics.agent_latency.observe((i % 100) / 20, agents[i & 1])
+        metrics.intents.inc(("CLINICAL", "ADMIN", "SMALL_TALK")[i % 3], ("local", "llm")[i & 1])
+    start = time.perf_counter()
+    text = metrics.render()
+    render_ms = (time.perf_counter() - start) * 1000
+
+    shared = metrics.SharedSamples(os.path.join(tempfile.mkdtemp(), "metrics.db"))
+    own = metrics.registry.samples()
+    for pid in range(args.workers): # stand-ins for the other workers' rows
+        with shared._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO worker_metrics (pid, samples, updated_at) VALUES (?, ?, ?)", (-1 - pid, json.dumps(own), time.time()))
+    start = time.perf_counter()
+    shared.put(own)
+    combined = metrics.registry.combine([own] + shared.others())
+    metrics.registry.render(combined)
+    shared_ms = (time.perf_counter() - start) * 1000
+    intents_own = sum(v for _, _, v in own["chat_intent_total"])
+    intents_all = sum(v for _, _, v in combined["chat_intent_total"])
+
+    sharded_total = sum(v for _, _, v in sharded.samples())
+    histogram_count = sum(v for name, _, v in histogram.samples() if name.endswith("_count"))
+    result = {
+        "config": vars(args),
+        "locked_ns_per_inc": round(locked_s / total * 1e9, 1),
+        "sharded_ns_per_inc": round(sharded_s / total * 1e9, 1),
+        "histogram_ns_per_observe": round(histogram_s / total * 1e9, 1),
+        "render_ms": round(render_ms, 3),
+        "render_bytes": len(text),
+        f"render_with_{args.workers}_workers_ms": round(shared_ms, 3),
+    }
+    checks = [
+        ("locked counter lost nothing", sum(locked.values.values()) == total),
+        ("sharded counter lost nothing", sharded_total == total),
+        ("histogram lost nothing", histogram_count == total),
+        ("workers' samples are summed", intents_all == intents_own * (args.workers + 1)),
+    ]
+    failed = [label for label, ok in checks if not ok]
+    print(json.dumps({**result, "failed": failed}, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
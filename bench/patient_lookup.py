@@ -0,0 +1,130 @@
+"""Patient lookup over a synthetic discharge file, linear scans vs PatientIndex.
+
+Writes a synthetic patients file (--records, default 500k) shaped like
+data/patients.json, then times index build, exact / partial / misspelt
+name lookups and the discharge-date disambiguation step. The legacy
+function below is the two-pass scan find_patient_by_name used before.
+
+    python -m bench.patient_lookup --records 500000 --queries 200
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+from app.tools.patient_db import PatientIndex
+
+SYLLABLES = ["ab", "hi", "ram", "pri", "ya", "jo", "hn", "ma", "ri", "a", "ah", "med", "fa", "ti", "da", "vid",
+             "ka", "ro", "sa", "ra", "el", "en", "ko", "fi", "om", "gra", "ce", "ni", "mei", "li", "an", "to",
+             "smi", "th", "ku", "mar", "gar", "ci", "chen", "ok", "af", "or", "na", "ir", "ros", "si", "had", "sil",
+             "va", "no", "vak", "pa", "tel", "jon", "es", "ta", "men", "sah", "du", "bo", "is", "re", "yes", "ng"]
+DIAGNOSES = ["Chronic Kidney Disease Stage 3", "Acute Kidney Injury", "Nephrotic Syndrome", "Diabetic Nephropathy"]
+
+
+def _word(rng: random.Random) -> str:
+    # 2-3 syllables, a few of them much more common than the rest, like parts of real names
+    return "".join(
+        SYLLABLES[min(int(rng.paretovariate(1.0)), len(SYLLABLES)) - 1] if rng.random() < 0.3 else rng.choice(SYLLABLES)
+        for _ in range(rng.randint(2, 3))
+    )
+
+
+def synthetic_records(n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    records = []
+    for _ in range(n):
+        records.append({
+            "patient_name": f"{_word(rng)} {_word(rng)}".title(),
+            "discharge_date": f"2025-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}",
+            "primary_diagnosis": rng.choice(DIAGNOSES),
+            "medications": ["Furosemide 20mg twice daily"],
+            "dietary_restrictions": "Low sodium (2g/day)",
+            "follow_up": "Nephrology clinic in 2 weeks",
+            "warning_signs": "Swelling, decreased urine output",
+            "discharge_instructions": "Monitor blood pressure daily",
+        })
+    return records
+
+
+def legacy_find_patient_by_name(patients: List[Dict[str, Any]], name: str) -> List[Dict[str, Any]]:
+    target = " ".join(name.strip().split()).lower()
+    exact_matches = [p for p in patients if " ".join(p.get("patient_name", "").strip().split()).lower() == target]
+    if exact_matches:
+        return exact_matches
+    return [p for p in patients if target in p.get("patient_name", "").lower()]
+
+
+def legacy_disambiguate(patients: List[Dict[str, Any]], name: str, date: str) -> List[Dict[str, Any]]:
+    return [p for p in legacy_find_patient_by_name(patients, name) if p.get("discharge_date") == date]
+
+
+def misspell(name: str, rng: random.Random) -> str:
+    i = rng.randrange(1, len(name) - 1)
+    return name[:i] + name[i + 1:] # drop one letter
+
+
+def _time(lookup: Callable[[str], Any], queries: List[Any]) -> Dict[str, float]:
+    latencies = []
+    for q in queries:
+        start = time.perf_counter()
+        lookup(*q) if isinstance(q, tuple) else lookup(q)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=500000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--legacy-queries", type=int, default=20, help="the linear scan is slow, time fewer queries")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "patients.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(synthetic_records(args.records), f)
+        start = time.perf_counter()
+        with open(path, "r", encoding="utf-8") as f:
+            patients = json.load(f)
+        load_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = PatientIndex(patients)
+    build_s = time.perf_counter() - start
+
+    sample = rng.sample(patients, args.queries)
+    workloads = {
+        "exact": [p["patient_name"] for p in sample],
+        "partial": [p["patient_name"].split()[-1] for p in sample], # surname only
+        "misspelt": [misspell(p["patient_name"], rng) for p in sample],
+        "disambiguation": [(p["patient_name"], p["discharge_date"]) for p in sample],
+    }
+
+    found = sum(1 for q in workloads["misspelt"] if index.find_by_name(q))
+    results: Dict[str, Any] = {
+        "records": args.records,
+        "json_load_s": round(load_s, 2),
+        "index_build_s": round(build_s, 2),
+        "misspelt_found": f"{found}/{args.queries}",
+    }
+    for kind, queries in workloads.items():
+        if kind == "disambiguation":
+            indexed = _time(lambda n, d: index.find_by_name(n, discharge_date=d), queries)
+            legacy = _time(lambda n, d: legacy_disambiguate(patients, n, d), queries[:args.legacy_queries])
+        else:
+            indexed = _time(index.find_by_name, queries)
+            legacy = _time(lambda q: legacy_find_patient_by_name(patients, q), queries[:args.legacy_queries])
+        results[kind] = {"indexed": indexed, "linear": legacy}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Load time and memory of the patient sources against the old json.load loader.
+
+Each variant runs in a fresh process over the same synthetic records
+(see bench.patient_lookup) and reports wall time and peak RSS:
+
+- legacy: json.load of the whole JSON array, as load_patients did
+- json: JsonPatientSource + PatientIndex (the default for data/patients.json)
+- jsonl_import: JsonLinesPatientSource streamed into a new SQLite store + PatientIndex
+- jsonl_restart: the same with the store reused from the previous run
+- append: time for the registry to pick up lines appended to the JSON Lines file
+
+It also checks that a JSON Lines file whose last line has no newline keeps that record,
+that a half-written line is only stored once it is finished, and that an import leaves
+no temporary store behind, and exits non-zero if a check fails.
+
+    python -m bench.patient_source --records 500000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict
+
+from bench.patient_lookup import synthetic_records
+
+
+def run_variant(variant: str, tmp: str, appended: int) -> Dict[str, Any]:
+    json_path, jsonl_path, db_path = (os.path.join(tmp, n) for n in ("patients.json", "patients.jsonl", "patients.db"))
+    start = time.perf_counter()
+    if variant == "legacy":
+        with open(json_path, "r", encoding="utf-8") as f:
+            records = json.load(f)
+        count = len(records)
+    else:
+        from app.tools.patient_db import PatientRegistry
+        from app.tools.patient_source import make_patient_source
+        registry = PatientRegistry(make_patient_source(json_path if variant == "json" else jsonl_path, db_path))
+        count = len(registry.index)
+        if variant == "append":
+            with open(jsonl_path, "a", encoding="utf-8") as f:
+                for record in synthetic_records(appended, seed=1):
+                    f.write(json.dumps(record) + "\n")
+            start = time.perf_counter()
+            registry.refresh()
+            count = len(registry.index) - count
+    return {
+        "records": count,
+        "seconds": round(time.perf_counter() - start, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def check_unterminated_lines(tmp: str) -> Dict[str, Any]:
+    """Import and tail a small JSON Lines file whose last line has no newline."""
+    from app.tools.patient_source import JsonLinesPatientSource
+    path, db_path = os.path.join(tmp, "unterminated.jsonl"), os.path.join(tmp, "unterminated.db")
+    lines = [json.dumps(r) for r in synthetic_records(4, seed=2)]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines[:2])) # no newline after the last record
+    source = JsonLinesPatientSource(path, db_path)
+    imported = len(source.load())
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("\n" + lines[2][:10]) # a line still being written
+    partial = source.load_appended()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(lines[2][10:] + "\n")
+    finished = source.load_appended()
+    restarted = JsonLinesPatientSource(path, db_path)
+    result = {
+        "imported": imported,
+        "while_partial": len(partial or []),
+        "once_finished": len(finished or []),
+        "after_restart": len(restarted.load()),
+        "leftover_files": sorted(n for n in os.listdir(tmp) if n.startswith("unterminated.db.")),
+    }
+    result["checks"] = {
+        "last line without newline imported": imported == 2,
+        "half-written line held back": partial == [],
+        "finished line appended": len(finished or []) == 1,
+        "store reused with every record": result["after_restart"] == 3,
+        "no temporary store left": not result["leftover_files"],
+    }
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=500000)
+    parser.add_argument("--appended", type=int, default=1000, help="lines appended for the append variant")
+    parser.add_argument("--variant", help=argparse.SUPPRESS) # set in the child processes
+    parser.add_argument("--tmp", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(run_variant(args.variant, args.tmp, args.appended)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        records = synthetic_records(args.records)
+        with open(os.path.join(tmp, "patients.json"), "w", encoding="utf-8") as f:
+            json.dump(records, f)
+        with open(os.path.join(tmp, "patients.jsonl"), "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        del records
+
+        results: Dict[str, Any] = {"records": args.records, "unterminated": check_unterminated_lines(tmp)}
+        for variant in ("legacy", "json", "jsonl_import", "jsonl_restart", "append"):
+            out = subprocess.run(
+                [sys.executable, "-m", "bench.patient_source", "--variant", variant, "--tmp", tmp, "--appended", str(args.appended)],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            results[variant] = json.loads(out.strip().splitlines()[-1])
+        failed = [label for label, ok in results["unterminated"]["checks"].items() if not ok]
+        results["failed"] = failed
+        print(json.dumps(results, indent=2))
+        sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
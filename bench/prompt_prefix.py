@@ -0,0 +1,148 @@
+"""Prompt construction time and provider prompt caching with per-patient prompt prefixes.
+
+Every patient of data/patients.json is identified and then asks
+--turns questions. Each turn builds the receptionist and clinical
+prompts (from fixed textbook chunks, so no Chroma store is needed), once
+with the prefix cache cleared every turn and once reusing the prefixes
+built at identity confirmation, and reports p50/p95 build time and the
+prefix token counts. Checks that the system prompt of a patient is
+byte-for-byte the same every turn, that changing the record gives a new
+prefix, and, sending the clinical prompts to the fake Groq server (which
+treats a system prompt it has seen as cached), the share of prompt
+tokens served from the provider's cache. Exits non-zero if a check fails.
+
+    python -m bench.prompt_prefix --turns 5
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from bench.context_budget import percentile
+from bench.stubs import FakeGroqHandler, start_stub
+
+QUESTIONS = (
+    "Why are my ankles swollen in the evening?",
+    "Can I take ibuprofen for my back pain?",
+    "How much water should I drink a day?",
+    "What should my potassium level be?",
+    "Is it normal to feel tired after discharge?",
+)
+
+CHUNKS = (
+    "Edema in chronic kidney disease follows sodium and water retention; loop diuretics and a low sodium diet are the mainstay of treatment.",
+    "Nonsteroidal anti-inflammatory drugs reduce renal blood flow and can precipitate acute kidney injury in patients with reduced GFR.",
+    "Fluid restriction is individualised; patients with oliguria or hyponatremia are usually limited to 1 to 1.5 litres a day.",
+    "Hyperkalemia is common when GFR falls below 30 ml/min, particularly with ACE inhibitors, and dietary potassium should be reviewed.",
+)
+
+
+def textbook_docs() -> List[Any]:
+    from langchain_core.documents import Document
+    return [Document(page_content=text, metadata={"source": "bench", "page": i}) for i, text in enumerate(CHUNKS)]
+
+
+def build_turns(records: List[Dict[str, Any]], turns: int, docs: List[Any], reuse: bool) -> Tuple[List[float], Dict[str, List[str]]]:
+    """ seconds per turn to build both agents' prompts, and each patient's system prompts in turn order.
+    """
+    from app.agents.clinical import clinical_prompts
+    from app.agents.prompt_prefix import prefixes
+    from app.agents.receptionist import receptionist_prompts
+
+    seconds, systems = [], {}
+    prefixes.clear()
+    for record in records:
+        prefixes.warm(record) # identity confirmation
+        for turn in range(turns):
+            if not reuse:
+                prefixes.clear()
+            question = QUESTIONS[turn % len(QUESTIONS)]
+            start = time.perf_counter()
+            receptionist_system, _ = receptionist_prompts(question, record)
+            clinical_system, _ = clinical_prompts(question, docs, record)
+            seconds.append(time.perf_counter() - start)
+            systems.setdefault(record["patient_name"], []).append(receptionist_system + "\0" + clinical_system)
+    return seconds, systems
+
+
+def timing(seconds: List[float]) -> Dict[str, float]:
+    return {
+        "build_p50_ms": round(percentile(seconds, 50) * 1000, 3),
+        "build_p95_ms": round(percentile(seconds, 95) * 1000, 3),
+    }
+
+
+def provider_cache(records: List[Dict[str, Any]], turns: int, docs: List[Any]) -> Dict[str, Any]:
+    from app.agents.clinical import clinical_prompts
+    from app.llm import groq_client
+
+    before = dict(groq_client.usage_stats)
+    latencies = []
+    for record in records:
+        for turn in range(turns):
+            system_prompt, user_prompt = clinical_prompts(QUESTIONS[turn % len(QUESTIONS)], docs, record)
+            start = time.perf_counter()
+            groq_client.call_groq_chat(system_prompt, user_prompt, max_tokens=20)
+            latencies.append(time.perf_counter() - start)
+    prompt_tokens = groq_client.usage_stats["prompt_tokens"] - before["prompt_tokens"]
+    cached = groq_client.usage_stats["cached_prompt_tokens"] - before["cached_prompt_tokens"]
+    return {
+        "calls": len(latencies),
+        "prompt_tokens": prompt_tokens,
+        "cached_prompt_tokens": cached,
+        "cached_share": round(cached / max(1, prompt_tokens), 3),
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=5, help="questions per patient")
+    parser.add_argument("--patients", type=int, default=10, help="patients sent to the fake Groq server")
+    parser.add_argument("--prompt-token-ms", type=float, default=0.5, help="stand-in latency per uncached prompt token in ms")
+    args = parser.parse_args()
+
+    server, groq_url = start_stub(FakeGroqHandler, latency=0.05)
+    server.prompt_token_latency = args.prompt_token_ms / 1000
+    os.environ["GROQ_BASE_URL"] = groq_url
+    os.environ.setdefault("GROQ_API_KEY", "bench")
+    os.environ["LLM_COALESCE"] = "0"
+
+    from app.agents.prompt_prefix import prefixes
+    from app.agents.receptionist import receptionist_prompts
+    from app.tools.patient_db import load_patients
+
+    records = [dict(r) for r in load_patients()]
+    docs = textbook_docs()
+
+    rebuilt, _ = build_turns(records, args.turns, docs, reuse=False)
+    reused, systems = build_turns(records, args.turns, docs, reuse=True)
+    record = records[0]
+    before, _ = receptionist_prompts(QUESTIONS[0], record)
+    after, _ = receptionist_prompts(QUESTIONS[0], dict(record, medications=list(record["medications"]) + ["Sevelamer 800mg with meals"]))
+
+    result: Dict[str, Any] = {
+        "patients": len(records),
+        "rebuilt_every_turn": timing(rebuilt),
+        "reused": timing(reused),
+        "prefix_tokens": {name: prefixes.get(name, record).tokens for name in ("receptionist", "clinical", "clinical_web")},
+        "prefix_stats": dict(prefixes.stats),
+        "byte_stable": all(len(set(turns)) == 1 for turns in systems.values()),
+        "record_change_invalidates": before != after and "Sevelamer" in after,
+        "provider_cache": provider_cache(records[:args.patients], args.turns, docs),
+    }
+    checks: List[Tuple[str, Callable[[Dict[str, Any]], bool]]] = [
+        ("system prompts are byte-for-byte stable across turns", lambda r: r["byte_stable"]),
+        ("a changed record gets a new prefix", lambda r: r["record_change_invalidates"]),
+        ("reused prefixes are not slower to build", lambda r: r["reused"]["build_p50_ms"] <= r["rebuilt_every_turn"]["build_p50_ms"]),
+        ("repeat turns hit the provider's prompt cache", lambda r: r["provider_cache"]["cached_prompt_tokens"] > 0),
+    ]
+    failed = [label for label, check in checks if not check(result)]
+    print(json.dumps({"config": vars(args), "result": result, "failed": failed}, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Retrieval quality and latency: vector vs BM25 vs hybrid (vs hybrid + rerank).
+
+Runs the questions of bench/data/retrieval_eval.jsonl against the real
+Chroma store and its BM25 index (build it with `python -m app.ingest
+--bm25-only`). A chunk is relevant to a question when its text contains
+all of the question's terms. Reports recall@k (relevant chunks in the
+top k over min(k, relevant chunks)), MRR@k and the p50/p95 latency of
+each retrieval stage. The *_adaptive retrievers use the app's relevance
+threshold and adaptive k; for them it also reports the questions left
+without context, and recall on the bare drug-name / lab-term questions
+(exact_term) that the embedding model scores below the threshold and
+only the keyword hits can answer.
+
+    python -m bench.retrieval_eval --k 6 --rerank-model cross-encoder/ms-marco-MiniLM-L-6-v2
+"""
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, List
+
+from bench.context_budget import percentile
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), "data", "retrieval_eval.jsonl")
+
+
+def load_questions(path: str = DATA_PATH) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def relevant(text: str, terms: List[str]) -> bool:
+    text = text.lower()
+    return all(t in text for t in terms)
+
+
+class BM25Only:
+    """The keyword half of the hybrid retriever on its own, for comparison."""
+
+    def __init__(self, retriever: Any):
+        self.retriever = retriever
+
+    def retrieve(self, query: str, query_vector: List[float]):
+        start = time.perf_counter()
+        ids = [chunk_id for chunk_id, _ in self.retriever.bm25.search(query, self.retriever.max_k)]
+        timings = {"bm25_ms": (time.perf_counter() - start) * 1000}
+        found = self.retriever._fetch(ids) if ids else {}
+        return [found[i] for i in ids if i in found], timings
+
+
+def evaluate(retriever: Any, questions: List[Dict[str, Any]], vectors: List[List[float]], totals: List[int], k: int) -> Dict[str, Any]:
+    recalls, reciprocal_ranks, exact_recalls = [], [], []
+    insufficient = 0
+    stage_ms: Dict[str, List[float]] = {}
+    for q, vector, total in zip(questions, vectors, totals):
+        docs, timings = retriever.retrieve(q["question"], vector)
+        insufficient += not docs
+        hits = [relevant(d.page_content, q["terms"]) for d in docs[:k]]
+        recalls.append(sum(hits) / min(k, total) if total else 0.0)
+        if q.get("exact_term"):
+            exact_recalls.append(recalls[-1])
+        reciprocal_ranks.append(next((1 / rank for rank, hit in enumerate(hits, start=1) if hit), 0.0))
+        for stage, value in timings.items():
+            if stage.endswith("_ms"):
+                stage_ms.setdefault(stage, []).append(value)
+    result: Dict[str, Any] = {
+        f"recall@{k}": round(sum(recalls) / len(recalls), 3),
+        f"mrr@{k}": round(sum(reciprocal_ranks) / len(reciprocal_ranks), 3),
+        f"recall@{k}_exact_term": round(sum(exact_recalls) / len(exact_recalls), 3) if exact_recalls else None,
+        "insufficient": insufficient,
+    }
+    for stage, values in stage_ms.items():
+        result[f"{stage[:-3]}_p50_ms"] = round(percentile(values, 50), 2)
+        result[f"{stage[:-3]}_p95_ms"] = round(percentile(values, 95), 2)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--candidates", type=int, default=20, help="chunks taken from each retriever before fusion")
+    parser.add_argument("--rerank-model", default=None, help="cross-encoder to also evaluate hybrid + rerank")
+    parser.add_argument("--rerank-budget-ms", type=float, default=150)
+    args = parser.parse_args()
+
+    from app.agents import clinical
+    from app.tools.hybrid_retriever import BM25_FILENAME, BM25Index, CrossEncoderReranker, HybridRetriever, iter_collection_chunks
+
+    questions = load_questions()
+    store = clinical.get_vect_store()
+    texts = [text for _, text, _ in iter_collection_chunks(store._collection)]
+    totals = [sum(relevant(t, q["terms"]) for t in texts) for q in questions]
+    vectors = [clinical.embed_query(q["question"]) for q in questions]
+    bm25 = BM25Index.load(os.path.join(clinical.CHROMA_PERSIST_DIRECTORY, BM25_FILENAME))
+
+    hybrid = HybridRetriever(store, bm25, candidates=args.candidates, min_k=args.k, max_k=args.k)
+    retrievers: Dict[str, Any] = {
+        "vector": HybridRetriever(store, None, min_k=args.k, max_k=args.k),
+        "bm25": BM25Only(hybrid),
+        "hybrid": hybrid,
+    }
+    adaptive = {
+        "min_score": clinical.RETRIEVAL_MIN_SCORE,
+        "score_gap": clinical.RETRIEVAL_SCORE_GAP,
+        "min_k": clinical.RETRIEVAL_MIN_K,
+        "max_k": args.k,
+    }
+    retrievers["vector_adaptive"] = HybridRetriever(store, None, **adaptive)
+    retrievers["hybrid_adaptive"] = HybridRetriever(store, bm25, candidates=args.candidates, keyword_min_coverage=clinical.RETRIEVAL_KEYWORD_COVERAGE, **adaptive)
+    if args.rerank_model:
+        reranker = CrossEncoderReranker(args.rerank_model, budget_ms=args.rerank_budget_ms)
+        retrievers["hybrid+rerank"] = HybridRetriever(store, bm25, reranker, candidates=args.candidates, min_k=args.k, max_k=args.k)
+
+    print(json.dumps({
+        "config": vars(args),
+        "chunks": len(texts),
+        "questions": len(questions),
+        "questions_without_relevant_chunks": sum(1 for t in totals if not t),
+        "results": {name: evaluate(r, questions, vectors, totals, args.k) for name, r in retrievers.items()},
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
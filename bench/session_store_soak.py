@@ -0,0 +1,105 @@
+"""Memory per session and a 100k-session soak of the session stores.
+
+Sessions look like real ones: an identified patient from
+data/patients.json plus a few turns of history.
+
+    python -m bench.session_store_soak --sessions 100000 --turns 6
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from app.session_store import InMemorySessionStore, SQLiteSessionStore, SessionStore
+
+REPLY = (
+    "Leg swelling (edema) in chronic kidney disease happens when the kidneys cannot remove enough "
+    "salt and water. Keep to your fluid restriction, weigh yourself daily and elevate your legs. "
+) * 3
+
+
+def make_state(session_id: str, record: Dict[str, Any], turns: int) -> Dict[str, Any]:
+    history: List[Dict[str, Any]] = [
+        {"role": "user", "agent": None, "content": f"my name is {record['patient_name']}"},
+        {"role": "assistant", "agent": "receptionist", "content": f"{record['patient_name']}! I see you were discharged on {record['discharge_date']}."},
+    ]
+    for i in range(turns):
+        history.append({"role": "user", "agent": None, "content": f"question {i}: why are my legs swelling?"})
+        history.append({"role": "assistant", "agent": "clinical", "content": REPLY})
+    return {
+        "session_id": session_id,
+        "patient_name": record["patient_name"],
+        "patient_record": dict(record),
+        "history": history,
+        "mode": "clinical",
+    }
+
+
+def memory_per_session(records: List[Dict[str, Any]], turns: int, n: int = 5000) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    store = InMemorySessionStore(max_sessions=n)
+    for i in range(n):
+        store.set(f"s{i}", make_state(f"s{i}", records[i % len(records)], turns))
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / n
+
+
+def soak(store: SessionStore, records: List[Dict[str, Any]], sessions: int, turns: int, measure: Callable[[], int]) -> Dict[str, Any]:
+    rng = random.Random(0)
+    start = time.perf_counter()
+    for i in range(sessions):
+        store.set(f"s{i}", make_state(f"s{i}", records[i % len(records)], turns))
+        if i and i % 4 == 0: # revisit an earlier session now and then, like a returning patient
+            sid = f"s{rng.randrange(i)}"
+            state = store.get(sid)
+            if state is not None:
+                state["history"].append({"role": "user", "agent": None, "content": "thanks"})
+                store.set(sid, state)
+    elapsed = time.perf_counter() - start
+    return {
+        "sessions_written": sessions,
+        "sessions_kept": len(store),
+        "seconds": round(elapsed, 2),
+        "writes_per_s": round(sessions / elapsed, 1),
+        "footprint_mb": round(measure() / 1e6, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--turns", type=int, default=6, help="question/answer pairs per session")
+    parser.add_argument("--max-sessions", type=int, default=10000, help="in-memory store bound")
+    args = parser.parse_args()
+
+    with open("data/patients.json", "r", encoding="utf-8") as f:
+        records = json.load(f)
+
+    results: Dict[str, Any] = {
+        "bytes_per_session_in_memory": round(memory_per_session(records, args.turns)),
+        "bytes_per_session_json": len(json.dumps(make_state("s0", records[0], args.turns))),
+    }
+
+    tracemalloc.start()
+    memory_store = InMemorySessionStore(max_sessions=args.max_sessions)
+    results["memory_lru"] = soak(memory_store, records, args.sessions, args.turns, lambda: tracemalloc.get_traced_memory()[0])
+    results["memory_lru"]["evictions"] = memory_store.stats["evictions"]
+    tracemalloc.stop()
+    del memory_store
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sessions.db")
+        sqlite_store = SQLiteSessionStore(path=path)
+        results["sqlite"] = soak(sqlite_store, records, args.sessions, args.turns, lambda: os.path.getsize(path) + os.path.getsize(path + "-wal"))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""Local stand-ins for external services used by the benchmarks.
+
+The fake Groq server speaks just enough of the OpenAI-compatible
+``/openai/v1/chat/completions`` API for the Groq SDK to parse its replies,
+the fake Tavily server just enough of ``/search`` for app.tools.web_search.
+HashEmbeddings and StubVectorStore replace the sentence-transformers model
+and the Chroma store with a small in-memory corpus.
+"""
+import json
+import math
+import os
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+CLINICAL_HINTS = ("swelling", "pain", "kidney", "urine", "medication", "diet", "creatinine", "symptom")
+
+
+def fake_router_label(user_prompt: str) -> str:
+    """Pick a plausible router label from the 'Next user message' line."""
+    marker = "Next user message:"
+    text = user_prompt.split(marker, 1)[-1].lower()
+    if any(h in text for h in CLINICAL_HINTS):
+        return "CLINICAL"
+    return "ADMIN"
+
+
+def fake_completion_text(body: Dict[str, Any]) -> str:
+    """Deterministic reply for a chat completion request body."""
+    messages = body.get("messages", [])
+    system_prompt = messages[0]["content"] if messages else ""
+    user_prompt = messages[-1]["content"] if messages else ""
+    if "router for a hospital chatbot" in system_prompt:
+        return fake_router_label(user_prompt)
+    words = max(1, int(body.get("max_tokens") or 50) // 2)
+    return " ".join(["stub"] * words)
+
+
+class FakeGroqHandler(BaseHTTPRequestHandler):
+    """Answers chat completions after ``server.latency`` seconds.
+
+    The latency is drawn per request around that median when
+    ``server.latency_sigma`` is set, see StubServer.sample_latency.
+    Streaming requests get one SSE chunk per word, ``server.token_latency`` apart.
+    Prompt processing adds ``server.prompt_token_latency`` per prompt token
+    (~4 characters), so longer prompts answer later like the real API. A system
+    prompt the server has seen before counts as a prompt cache hit: its tokens
+    are reported as ``prompt_tokens_details.cached_tokens`` and cost no latency.
+    Faults are injected at random: ``server.error_rate`` of requests fail with
+    ``server.error_status`` (sending ``server.retry_after`` as Retry-After if set),
+    and ``server.stall_rate`` of them first stall for ``server.stall_seconds``.
+    """
+
+    server: "StubServer"
+
+    def log_message(self, format: str, *args: Any) -> None: # keep benchmark output clean
+        pass
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        self.server.requests += 1
+        if self.server.rng.random() < self.server.stall_rate:
+            time.sleep(self.server.stall_seconds)
+        messages = body.get("messages", [])
+        prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+        cached_tokens = 0
+        if messages and messages[0].get("role") == "system":
+            system_prompt = messages[0].get("content") or ""
+            with self.server.lock:
+                if system_prompt in self.server.seen_prefixes:
+                    cached_tokens = len(system_prompt) // 4
+                self.server.seen_prefixes.add(system_prompt)
+        time.sleep(self.server.sample_latency() + (prompt_tokens - cached_tokens) * self.server.prompt_token_latency)
+        if self.server.rng.random() < self.server.error_rate:
+            self._send_error(self.server.error_status)
+            return
+
+        content = fake_completion_text(body)
+        completion_tokens = len(content.split())
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+        if body.get("stream"):
+            self._send_stream(body, content, usage)
+            return
+        payload = {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": usage,
+        }
+        self._send_json(200, payload)
+
+    def _send_stream(self, body: Dict[str, Any], content: str, usage: Dict[str, Any]) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        words = content.split(" ")
+        for i, word in enumerate(words):
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": word if i == 0 else " " + word},
+                        "finish_reason": None,
+                    }
+                ],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(self.server.token_latency)
+        last = { # Groq sends the usage in x_groq on the last chunk
+            "id": "chatcmpl-stub",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            "x_groq": {"id": "req-stub", "usage": usage},
+        }
+        self.wfile.write(f"data: {json.dumps(last)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _send_error(self, status: int) -> None:
+        headers = {"retry-after": str(self.server.retry_after)} if self.server.retry_after is not None else {}
+        self._send_json(status, {"error": {"message": f"injected {status}", "type": "stub_error"}}, headers)
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeTavilyHandler(BaseHTTPRequestHandler):
+    """Answers Tavily searches after ``server.latency`` seconds (see StubServer.sample_latency),
+    with ``max_results`` results.
+
+    ``server.error_rate`` of requests fail with ``server.error_status``. With
+    ``server.token_latency`` set the body is sent in ten pieces that far apart, a
+    response that trickles in. The most searches ever handled at once is kept in
+    ``server.max_in_flight``.
+    """
+
+    server: "StubServer"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+        try:
+            time.sleep(self.server.sample_latency())
+            if self.server.rng.random() < self.server.error_rate:
+                self._send_json(self.server.error_status, {"detail": {"error": f"injected {self.server.error_status}"}})
+                return
+            query = body.get("query", "")
+            results = [
+                {
+                    "title": f"Result {i} for {query}",
+                    "url": f"https://example.org/search/{i}",
+                    "content": f"Snippet {i} about {query}.",
+                    "score": round(1 - i / 10, 2),
+                }
+                for i in range(1, int(body.get("max_results") or 5) + 1)
+            ]
+            payload = {"query": query, "results": results, "response_time": self.server.latency}
+            if self.server.token_latency > 0:
+                self._send_trickle(payload)
+            else:
+                self._send_json(200, payload)
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+
+    _send_json = FakeGroqHandler._send_json
+
+    def _send_trickle(self, payload: Dict[str, Any]) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        step = max(1, -(-len(data) // 10))
+        for i in range(0, len(data), step):
+            self.wfile.write(data[i:i + step])
+            self.wfile.flush()
+            time.sleep(self.server.token_latency)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    latency: float = 0.0
+    latency_sigma: float = 0.0 # spread of the lognormal latency, 0 for always exactly latency
+    token_latency: float = 0.0
+    prompt_token_latency: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 503
+    retry_after: Optional[float] = None
+    stall_rate: float = 0.0
+    stall_seconds: float = 0.0
+    requests: int = 0 # handled so far, including failed ones
+    in_flight: int = 0
+    max_in_flight: int = 0
+    seen_prefixes: set # system prompts already sent, see FakeGroqHandler
+    lock = threading.Lock()
+    rng = random.Random(0)
+
+    def sample_latency(self) -> float:
+        """A request's latency: ``latency`` itself, or with ``latency_sigma`` a draw from the
+        lognormal distribution with that median, whose long right tail is what API latencies look like.
+        """
+        if self.latency <= 0 or self.latency_sigma <= 0:
+            return self.latency
+        with self.lock:
+            return self.rng.lognormvariate(math.log(self.latency), self.latency_sigma)
+
+
+def start_stub(handler: type, latency: float = 0.0, port: int = 0) -> Tuple[StubServer, str]:
+    """Start a stub server on a background thread and return it with its base URL."""
+    server = StubServer(("127.0.0.1", port), handler)
+    server.latency = latency
+    server.seen_prefixes = set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, bound_port = server.server_address[:2]
+    return server, f"http://{host}:{bound_port}"
+
+
+STANDIN_TEXTBOOK_PATH = os.path.join(os.path.dirname(__file__), "data", "standin_textbook.jsonl")
+
+
+class HashEmbeddings:
+    """Stand-in for the sentence-transformers model: each word (as BM25 tokenises it) is hashed
+    to one of ``dim - 1`` signed dimensions, so texts sharing words get a high cosine similarity.
+    The last dimension is the same for every text (weight ``shared``, relative to the words), which
+    puts unrelated texts at a cosine of shared² / (1 + shared²), ~0.33 by default, just below the
+    app's relevance threshold, the way sentence embeddings of any two nephrology texts are similar.
+    Every model call (one per batch) takes ``latency`` seconds, like an encode on the CPU.
+    """
+
+    def __init__(self, dim: int = 384, latency: float = 0.0, shared: float = 0.7):
+        self.dim = dim
+        self.latency = latency
+        self.shared = shared
+        self.calls = 0
+
+    def _embed(self, text: str) -> List[float]:
+        from app.tools.hybrid_retriever import tokenize
+
+        vec = [0.0] * self.dim
+        for token in tokenize(text):
+            h = zlib.crc32(token.encode("utf-8"))
+            vec[h % (self.dim - 1)] += 1.0 if h & 0x80000000 else -1.0
+        words = math.sqrt(sum(v * v for v in vec))
+        if words:
+            vec = [v / words for v in vec]
+        vec[-1] = self.shared
+        norm = math.sqrt(sum(v * v for v in vec))
+        return [v / norm for v in vec]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class StubVectorStore:
+    """In-memory stand-in for the Chroma store, with the two calls HybridRetriever makes.
+    Distances are squared L2 between unit vectors, like Chroma's default space.
+    """
+
+    def __init__(self, embeddings: Any, chunks: List[Tuple[str, str, str]], latency: float = 0.0):
+        from langchain_core.documents import Document
+
+        self.latency = latency
+        self.chunks = chunks
+        self._docs = [Document(id=chunk_id, page_content=text, metadata={"topic": topic}) for chunk_id, text, topic in chunks]
+        self._vectors = embeddings.embed_documents([text for _, text, _ in chunks])
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding: List[float], k: int = 4, filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Any, float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        topics = set(filter["topic"]["$in"]) if filter else None
+        scored = [
+            (doc, 2 - 2 * sum(a * b for a, b in zip(embedding, vec)))
+            for doc, vec in zip(self._docs, self._vectors)
+            if topics is None or doc.metadata["topic"] in topics
+        ]
+        scored.sort(key=lambda item: item[1])
+        return scored[:k]
+
+    def get(self, ids: List[str], include: Optional[List[str]] = None) -> Dict[str, List[Any]]:
+        by_id = {doc.id: doc for doc in self._docs}
+        found = [by_id[i] for i in ids if i in by_id]
+        return {
+            "ids": [d.id for d in found],
+            "documents": [d.page_content for d in found],
+            "metadatas": [d.metadata for d in found],
+        }
+
+
+def load_standin_textbook(path: str = STANDIN_TEXTBOOK_PATH) -> List[Tuple[str, str, str]]:
+    """(id, text, topic) chunks of the small synthetic textbook the stand-in store serves."""
+    with open(path, "r", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return [(row["id"], row["text"], row["topic"]) for row in rows]
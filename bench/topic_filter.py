@@ -0,0 +1,83 @@
+"""Retrieval latency and relevance with the patient's diagnosis ignored, boosted or used as a filter.
+
+Runs the questions of bench/data/retrieval_eval.jsonl, each asked by a
+patient with the question's "diagnosis", against the real Chroma store
+and BM25 index (re-run `python -m app.ingest` first so chunks carry
+topic metadata). For each RETRIEVAL_TOPIC_MODE reports recall@k and
+MRR@k (as bench.retrieval_eval), the share of returned chunks from the
+diagnosis' topics, how often the filter found nothing and fell back to
+the whole textbook, p50/p95 vector search latency, and the share of the
+collection the filter leaves to search.
+
+    python -m bench.topic_filter --k 6
+"""
+import argparse
+import json
+import os
+from collections import Counter
+from typing import Any, Dict, List
+
+from bench.context_budget import percentile
+from bench.retrieval_eval import load_questions, relevant
+
+
+def run(retriever: Any, questions: List[Dict[str, Any]], vectors: List[List[float]], totals: List[int], k: int) -> Dict[str, Any]:
+    from app.tools.topics import diagnosis_topics
+
+    recalls, reciprocal_ranks, vector_ms, on_topic, returned = [], [], [], 0, 0
+    fallbacks_before = retriever.stats["topic_fallbacks"]
+    for q, vector, total in zip(questions, vectors, totals):
+        topics = diagnosis_topics(q["diagnosis"])
+        docs, stats = retriever.retrieve(q["question"], vector, topics)
+        hits = [relevant(d.page_content, q["terms"]) for d in docs[:k]]
+        recalls.append(sum(hits) / min(k, total) if total else 0.0)
+        reciprocal_ranks.append(next((1 / rank for rank, hit in enumerate(hits, start=1) if hit), 0.0))
+        vector_ms.append(stats["vector_ms"])
+        on_topic += sum(1 for d in docs if (d.metadata or {}).get("topic") in topics)
+        returned += len(docs)
+    return {
+        f"recall@{k}": round(sum(recalls) / len(recalls), 3),
+        f"mrr@{k}": round(sum(reciprocal_ranks) / len(reciprocal_ranks), 3),
+        "on_topic_share": round(on_topic / max(1, returned), 3),
+        "topic_fallbacks": retriever.stats["topic_fallbacks"] - fallbacks_before,
+        "vector_p50_ms": round(percentile(vector_ms, 50), 2),
+        "vector_p95_ms": round(percentile(vector_ms, 95), 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--candidates", type=int, default=20, help="chunks taken from each retriever before fusion")
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the questions, for steadier latencies")
+    args = parser.parse_args()
+
+    from app.agents import clinical
+    from app.tools.hybrid_retriever import BM25_FILENAME, BM25Index, HybridRetriever, iter_collection_chunks
+    from app.tools.topics import diagnosis_topics
+
+    questions = load_questions() * args.repeat
+    store = clinical.get_vect_store()
+    chunks = list(iter_collection_chunks(store._collection))
+    chunk_topics = Counter(topic for _, _, topic in chunks)
+    totals = [sum(relevant(text, q["terms"]) for _, text, _ in chunks) for q in questions]
+    vectors = [clinical.embed_query(q["question"]) for q in questions]
+    bm25 = BM25Index.load(os.path.join(clinical.CHROMA_PERSIST_DIRECTORY, BM25_FILENAME))
+    searched = [sum(chunk_topics[t] for t in diagnosis_topics(q["diagnosis"])) / len(chunks) for q in questions]
+
+    results = {}
+    for mode in ("off", "boost", "filter"):
+        retriever = HybridRetriever(store, bm25, candidates=args.candidates, min_k=args.k, max_k=args.k, topic_mode=mode)
+        results[mode] = run(retriever, questions, vectors, totals, args.k)
+
+    print(json.dumps({
+        "config": vars(args),
+        "chunks": len(chunks),
+        "chunks_by_topic": dict(chunk_topics.most_common()),
+        "filtered_candidate_share_mean": round(sum(searched) / len(searched), 3),
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Cost of tracing per chat request, off vs JSON lines export, and a check of the span tree.
+
+Runs a stand-in request with the pipeline's shape (chat > classify >
+llm, clinical_prepare > retrieve > embed/chroma_search, web_search,
+llm; the async stages awaited, the blocking ones on run_blocking) with
+no real work in it, so what is measured is the tracing itself: µs per
+request and per span with TRACE_EXPORT off and with "jsonl". Then
+checks the exported spans: one trace per request, every parent present,
+session_id on every span and durations that nest. Exits non-zero if a
+check fails.
+
+    python -m bench.tracing_overhead --requests 20000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, List
+
+from app import tracing
+from app.concurrency import run_blocking
+
+SPANS_PER_REQUEST = 9
+
+
+@tracing.traced("embed")
+def embed() -> List[float]:
+    return [0.0]
+
+
+def chroma_search() -> None:
+    with tracing.span("chroma_search", filtered=False):
+        pass
+
+
+@tracing.traced("retrieve")
+def retrieve() -> List[Any]:
+    embed()
+    chroma_search()
+    tracing.annotate(k=4)
+    return []
+
+
+@tracing.traced("llm")
+async def llm() -> str:
+    tracing.annotate(model="stub", prompt_tokens=900, cached_prompt_tokens=600, completion_tokens=120)
+    return "reply"
+
+
+@tracing.traced("web_search")
+async def web_search() -> List[Any]:
+    tracing.annotate(cache_hit=True, results=3)
+    return []
+
+
+@tracing.traced("classify")
+async def classify() -> str:
+    tracing.annotate(tier="llm")
+    return await llm()
+
+
+@tracing.traced("clinical_prepare")
+async def prepare() -> None:
+    await run_blocking(retrieve)
+    await web_search()
+
+
+@tracing.traced("chat")
+async def request(session_id: str) -> str:
+    tracing.annotate(session_id=session_id)
+    await classify()
+    await prepare()
+    reply = await llm()
+    tracing.annotate(agent="clinical")
+    return reply
+
+
+async def run(requests: int) -> float:
+    start = time.perf_counter()
+    for i in range(requests):
+        await request(f"s{i % 100}")
+    return time.perf_counter() - start
+
+
+def check_tree(path: str, requests: int) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        spans = [json.loads(line) for line in f]
+    traces: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for s in spans:
+        traces[s["trace_id"]].append(s)
+    complete = 0
+    for trace in traces.values():
+        by_id = {s["span_id"]: s for s in trace}
+        roots = [s for s in trace if s["parent_id"] is None]
+        linked = all(s["parent_id"] is None or s["parent_id"] in by_id for s in trace)
+        nested = all(s["parent_id"] is None or s["duration_ms"] <= by_id[s["parent_id"]]["duration_ms"] + 0.01 for s in trace if linked)
+        if len(roots) == 1 and roots[0]["name"] == "chat" and linked and nested and all(s["session_id"] for s in trace):
+            complete += 1
+    return {"spans": len(spans), "traces": len(traces), "complete_traces": complete, "names": sorted({s["name"] for s in spans})}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    tracing.configure([])
+    asyncio.run(run(200)) # warm up
+    off = asyncio.run(run(args.requests))
+
+    path = os.path.join(tempfile.mkdtemp(), "traces.jsonl")
+    tracing.TRACE_PATH = path
+    tracing.configure(["jsonl"])
+    on = asyncio.run(run(args.requests))
+    tracing.flush()
+    tree = check_tree(path, args.requests)
+    tracing.configure([])
+
+    result = {
+        "config": vars(args),
+        "off_us_per_request": round(off / args.requests * 1e6, 2),
+        "jsonl_us_per_request": round(on / args.requests * 1e6, 2),
+        "jsonl_us_per_span": round((on - off) / (args.requests * SPANS_PER_REQUEST) * 1e6, 2),
+        "dropped": tracing.stats["dropped"],
+        "tree": tree,
+    }
+    checks = [
+        ("one trace per request", tree["traces"] == args.requests),
+        ("every span written", tree["spans"] + tracing.stats["dropped"] == args.requests * SPANS_PER_REQUEST),
+        ("spans form one tree per request with session ids", tree["complete_traces"] == tree["traces"]),
+    ]
+    failed = [label for label, ok in checks if not ok]
+    print(json.dumps({**result, "failed": failed}, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Checks of the web search tool against the local fake Tavily server.
+
+Runs app.tools.web_search (real HTTP) against the stand-in server:
+result fields, the on-disk cache (rephrased queries, a fresh cache
+instance, TTL), the answer deadline with the late result cached in the
+background, a response trickling in past the deadline, the concurrency
+cap, coalescing of identical searches and failures. Reports each scenario and exits non-zero if a check fails.
+
+    python -m bench.web_search --deadline 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from bench.stubs import FakeTavilyHandler, StubServer, start_stub
+
+Check = Tuple[str, Callable[[Dict[str, Any]], bool]]
+
+
+def reset(server: StubServer, latency: float, error_rate: float = 0.0, trickle: float = 0.0) -> None:
+    server.latency = latency
+    server.token_latency = trickle
+    server.error_rate = error_rate
+    server.error_status = 500
+    server.requests = 0
+    server.max_in_flight = 0
+
+
+async def timed(coro: Any) -> Tuple[Any, float]:
+    start = time.perf_counter()
+    result = await coro
+    return result, time.perf_counter() - start
+
+
+def timed_sync(func: Callable[..., Any], *args: Any) -> Tuple[Any, float]:
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+async def scenarios(server: StubServer, deadline: float) -> Dict[str, Tuple[Dict[str, Any], List[Check]]]:
+    from app.tools import web_search as ws
+
+    out: Dict[str, Tuple[Dict[str, Any], List[Check]]] = {}
+
+    reset(server, 0.05)
+    results, _ = await timed(ws.web_search_async("latest KDIGO guideline on SGLT2 inhibitors", num_results=3))
+    out["fields"] = ({"results": results}, [
+        ("three results", lambda r: len(r["results"]) == 3),
+        ("url and snippet are filled", lambda r: all(x["url"].startswith("https://") and x["snippet"] for x in r["results"])),
+    ])
+
+    reset(server, 0.05)
+    again, seconds = await timed(ws.web_search_async("  Latest KDIGO guideline on SGLT2-inhibitors?! ", num_results=3))
+    fresh = ws.WebSearchCache(ws.WEB_CACHE_PATH, ws.WEB_CACHE_TTL).get(ws._cache_key("latest kdigo guideline on sglt2 inhibitors", 3))
+    out["cache"] = ({"results": again, "ms": round(seconds * 1000, 1), "server_requests": server.requests, "fresh_instance_hit": fresh is not None}, [
+        ("rephrased query is a cache hit", lambda r: r["server_requests"] == 0 and r["results"] == results),
+        ("cache is on disk", lambda r: r["fresh_instance_hit"]),
+    ])
+
+    reset(server, deadline * 3)
+    late, seconds = await timed(ws.web_search_async("new potassium binders 2025", num_results=3))
+    await asyncio.sleep(deadline * 3)
+    requests_after_late = server.requests
+    cached, _ = await timed(ws.web_search_async("new potassium binders 2025", num_results=3))
+    out["deadline"] = ({"first": late, "first_ms": round(seconds * 1000, 1), "second_results": len(cached), "server_requests": server.requests}, [
+        ("slow search returns nothing at the deadline", lambda r: r["first"] == [] and r["first_ms"] < deadline * 1000 + 200),
+        ("late result was cached for the next ask", lambda r: r["second_results"] == 3 and r["server_requests"] == requests_after_late),
+    ])
+
+    reset(server, 0.3)
+    ws.WEB_SEARCH_DEADLINE, saved_deadline = 30.0, ws.WEB_SEARCH_DEADLINE
+    batch, seconds = await timed(asyncio.gather(*(ws.web_search_async(f"dialysis question {i}", num_results=2) for i in range(20))))
+    out["concurrency"] = ({"ok": sum(1 for b in batch if b), "seconds": round(seconds, 2), "max_in_flight": server.max_in_flight}, [
+        ("all searches answered", lambda r: r["ok"] == 20),
+        (f"at most {ws.WEB_SEARCH_MAX_CONCURRENCY} searches at once", lambda r: r["max_in_flight"] <= ws.WEB_SEARCH_MAX_CONCURRENCY),
+    ])
+
+    reset(server, 0.3)
+    same = await asyncio.gather(*(ws.web_search_async("tacrolimus levels after transplant", num_results=2) for _ in range(10)))
+    out["coalescing"] = ({"ok": sum(1 for b in same if b), "server_requests": server.requests}, [
+        ("identical searches share one request", lambda r: r["ok"] == 10 and r["server_requests"] == 1),
+    ])
+    ws.WEB_SEARCH_DEADLINE = saved_deadline
+
+    reset(server, 0.05, error_rate=1.0)
+    failed = await ws.web_search_async("hyperkalemia treatment update", num_results=2)
+    out["errors"] = ({"results": failed, "errors": ws.stats["errors"]}, [
+        ("a failing search returns nothing instead of raising", lambda r: r["results"] == [] and r["errors"] > 0),
+    ])
+
+    reset(server, deadline * 3)
+    sync_results, sync_seconds = await asyncio.get_running_loop().run_in_executor(None, timed_sync, ws.web_search, "sync deadline question", 2)
+    out["sync_deadline"] = ({"results": sync_results, "ms": round(sync_seconds * 1000, 1)}, [
+        ("blocking search gives up at the deadline", lambda r: r["results"] == [] and r["ms"] < deadline * 1000 + 300),
+    ])
+
+    reset(server, 0.0, trickle=deadline * 0.3) # every read arrives well within the timeouts, the whole body after 3x the deadline
+    trickled, trickle_seconds = await asyncio.get_running_loop().run_in_executor(None, timed_sync, ws.web_search, "sync trickle question", 2)
+    out["sync_trickle"] = ({"results": trickled, "ms": round(trickle_seconds * 1000, 1)}, [
+        ("a trickling response does not outlast the deadline", lambda r: r["results"] == [] and r["ms"] < deadline * 1000 + 300),
+    ])
+
+    reset(server, 0.05)
+    cache = ws._cache.get()
+    cache.ttl_seconds, saved_ttl = 0.2, cache.ttl_seconds
+    await ws.web_search_async("renal diet update", num_results=2)
+    await asyncio.sleep(0.3)
+    await ws.web_search_async("renal diet update", num_results=2)
+    cache.ttl_seconds = saved_ttl
+    out["ttl"] = ({"server_requests": server.requests}, [
+        ("expired entries are searched again", lambda r: r["server_requests"] == 2),
+    ])
+    return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--deadline", type=float, default=0.5, help="WEB_SEARCH_DEADLINE in seconds")
+    args = parser.parse_args()
+
+    server, tavily_url = start_stub(FakeTavilyHandler)
+    os.environ["TAVILY_BASE_URL"] = tavily_url # read when web_search is imported
+    os.environ["TAVILY_API_KEY"] = "bench"
+    os.environ["WEB_SEARCH_DEADLINE"] = str(args.deadline)
+    os.environ["WEB_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "web_cache.db")
+
+    results = asyncio.run(scenarios(server, args.deadline))
+    report, failed = {}, []
+    for name, (result, checks) in results.items():
+        result["checks"] = {}
+        for label, check in checks:
+            ok = bool(check(result))
+            result["checks"][label] = ok
+            if not ok:
+                failed.append(f"{name}: {label}")
+        report[name] = result
+    print(json.dumps({"config": vars(args), "scenarios": report, "failed": failed}, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()